@@ -0,0 +1,541 @@
+"""
+Benchmarks for the Sm compiler
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from scanner import Scanner
+from tokens import Token
+from parser_code_generator import Compiler, compile_files, compile_source
+from interpreter import Interpreter
+from watch import Incremental_Compiler
+from client import request
+from generator import Program_Generator
+from profiler import PHASES, Profiler
+
+EXAMPLE = 'example/example_program'
+
+def sample_source(size):
+    '''Returns a program of at least size characters made by repeating
+       the example program.'''
+    with open(EXAMPLE) as f:
+        example = f.read().strip()
+    copies = size // (len(example) + 2) + 1
+    return ';\n'.join([example] * copies)
+
+def scan(input_file):
+    '''Scans every token in input_file and returns the number found.'''
+    scanner = Scanner(input_file)
+    count = 0
+    while scanner.lookahead() != Token.END:
+        scanner.take()
+        count += 1
+    return count
+
+def bench_scanner(sizes):
+    '''Times the scanner over inputs of increasing size. The time per
+       character stays flat when scanning is linear.'''
+    print('{0:>10} {1:>10} {2:>10} {3:>10}'.format('chars', 'tokens',
+                                                  'seconds', 'ns/char'))
+    for size in sizes:
+        text = sample_source(size)
+        start = time.perf_counter()
+        tokens = scan(io.StringIO(text))
+        elapsed = time.perf_counter() - start
+        print('{0:>10} {1:>10} {2:>10.4f} {3:>10.1f}'.format(
+              len(text), tokens, elapsed, elapsed / len(text) * 1e9))
+
+def bench_stream(sizes):
+    '''Streams files of increasing size through the scanner. Peak memory
+       stays flat when the input is never held in memory as a whole.'''
+    example = sample_source(10**4)
+    print('{0:>10} {1:>10} {2:>10} {3:>12}'.format('chars', 'tokens',
+                                                  'seconds', 'peak RSS kB'))
+    for size in sizes:
+        with tempfile.TemporaryFile('w+') as f:
+            for _ in range(size // len(example) + 1):
+                f.write(example + ';\n')
+            f.write('ot 0')
+            chars = f.tell()
+            f.seek(0)
+            start = time.perf_counter()
+            tokens = scan(f)
+            elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print('{0:>10} {1:>10} {2:>10.4f} {3:>12}'.format(chars, tokens,
+                                                         elapsed, peak))
+
+def bench_batch(files, size):
+    '''Compiles a directory of files with increasing numbers of processes.
+       The speedup should grow close to linearly up to the core count.'''
+    cores = os.cpu_count() or 1
+    jobs = sorted({1, cores} | {2**i for i in range(cores.bit_length())})
+    print('{0:>6} {1:>10} {2:>10}'.format('jobs', 'seconds', 'speedup'))
+    with tempfile.TemporaryDirectory() as directory:
+        text = sample_source(size)
+        paths = []
+        for i in range(files):
+            paths.append(os.path.join(directory, 'p{0}.sm'.format(i)))
+            with open(paths[-1], 'w') as f:
+                f.write(text)
+        for n in jobs:
+            start = time.perf_counter()
+            for path, seconds, error, cached in compile_files(paths, n):
+                assert error is None, error
+            elapsed = time.perf_counter() - start
+            if n == 1:
+                serial = elapsed
+            print('{0:>6} {1:>10.4f} {2:>10.2f}'.format(n, elapsed,
+                                                       serial / elapsed))
+
+def nested_sources(depth):
+    '''Returns programs that nest depth levels deep in different ways.'''
+    return {
+        'parentheses': 'x: ' + '(' * depth + '1' + ')' * depth + ';\not x',
+        'wl blocks': 'in x;\n' + 'wl x > 0 {\nx: x - 1;\n' * depth + 'ot x' +
+                     '\n}' * depth,
+        'if-el blocks': 'in x;\n' + 'if x > 0 {\n' * depth + 'ot x' +
+                        '\n} el {\not 0\n}' * depth,
+        'nt': 'in x;\nif ' + 'nt ' * depth + 'x > 0 {\not x\n}',
+        '+ chain': 'in x;\not ' + ' + '.join(['x'] * depth),
+        '& chain': 'in x;\nif ' + ' & '.join(['x > 0'] * depth) + ' {\not x\n}',
+    }
+
+def time_compile(text, repeat):
+    '''Returns the best time in seconds to compile text.'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compile_source(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Times compile_source in another checkout of the compiler
+BASELINE = '''
+import sys, time
+from parser_code_generator import compile_source
+text = sys.stdin.read()
+best = float('inf')
+for _ in range({0}):
+    start = time.perf_counter()
+    compile_source(text)
+    best = min(best, time.perf_counter() - start)
+print(best)
+'''
+
+def bench_nesting(depths, size, repeat, baseline):
+    '''Compiles programs nested deeper than Python's recursion limit,
+       then times a shallow program. Given the directory of another
+       checkout, the shallow program is also timed with that compiler.'''
+    print('recursion limit', sys.getrecursionlimit())
+    print('{0:>14} {1:>8} {2:>10} {3:>12}'.format('nesting', 'depth',
+                                                  'seconds', 'us/level'))
+    for depth in depths:
+        for kind, text in nested_sources(depth).items():
+            try:
+                elapsed = time_compile(text, 1)
+            except RecursionError:
+                print('{0:>14} {1:>8} {2:>10}'.format(kind, depth,
+                                                      'RecursionError'))
+                continue
+            print('{0:>14} {1:>8} {2:>10.4f} {3:>12.2f}'.format(
+                  kind, depth, elapsed, elapsed / depth * 1e6))
+    text = sample_source(size)
+    elapsed = time_compile(text, repeat)
+    print('shallow program of {0} chars: {1:.4f} s'.format(len(text), elapsed))
+    if baseline:
+        result = subprocess.run([sys.executable, '-c', BASELINE.format(repeat)],
+                                input=text, cwd=baseline, capture_output=True,
+                                text=True, check=True)
+        before = float(result.stdout)
+        print('{0}: {1:.4f} s, {2:.2f}x the time'.format(baseline, before,
+                                                       elapsed / before))
+
+# Measures the syntax tree of the program on stdin with the compiler in
+# the current directory: bytes held by the tree, then the best time to
+# parse it and to generate code from it
+TREE = '''
+import io, sys, time, tracemalloc
+from parser_code_generator import Compiler
+text = sys.stdin.read()
+compiler = Compiler(optimise=False)
+tracemalloc.start()
+ast = compiler.parse(io.StringIO(text))
+size = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+parse = generate = float('inf')
+for _ in range({0}):
+    start = time.perf_counter()
+    ast = compiler.parse(io.StringIO(text))
+    parse = min(parse, time.perf_counter() - start)
+    start = time.perf_counter()
+    compiler.generate(ast)
+    generate = min(generate, time.perf_counter() - start)
+print(size, parse, generate)
+'''
+
+def bench_tree(sizes, repeat, baseline):
+    '''Measures the memory used by the syntax tree of programs of
+       increasing size and the time to parse them and generate code.
+       Given the directory of another checkout, its compiler is measured
+       on the same programs.'''
+    compilers = [os.path.dirname(os.path.abspath(__file__))]
+    if baseline:
+        compilers.append(baseline)
+    print('{0:>10} {1:>12} {2:>10} {3:>10} {4:>10}  {5}'.format(
+          'chars', 'tree kB', 'bytes/char', 'parse s', 'codegen s',
+          'compiler'))
+    for size in sizes:
+        text = sample_source(size)
+        for directory in compilers:
+            result = subprocess.run([sys.executable, '-c', TREE.format(repeat)],
+                                    input=text, cwd=directory,
+                                    capture_output=True, text=True,
+                                    check=True)
+            tree, parse, generate = map(float, result.stdout.split())
+            print('{0:>10} {1:>12.0f} {2:>10.1f} {3:>10.4f} {4:>10.4f}  {5}'
+                  .format(len(text), tree / 1024, tree / len(text), parse,
+                          generate, directory))
+
+# Times parsing the program on stdin with the compiler in the current
+# directory, from scanning to the syntax tree
+PARSE = '''
+import io, sys, time
+from parser_code_generator import Parser
+from scanner import Scanner
+text = sys.stdin.read()
+best = float('inf')
+for _ in range({0}):
+    start = time.perf_counter()
+    Parser(Scanner(io.StringIO(text))).program()
+    best = min(best, time.perf_counter() - start)
+print(best)
+'''
+
+def bench_parse(sizes, repeat, baseline):
+    '''Measures how many tokens a second are scanned, and scanned and
+       parsed into a syntax tree. Given the directory of another
+       checkout, its parser is timed on the same programs.'''
+    compilers = [os.path.dirname(os.path.abspath(__file__))]
+    if baseline:
+        compilers.append(baseline)
+    print('{0:>10} {1:>10} {2:>14} {3:>14}  {4}'.format(
+          'chars', 'tokens', 'scan tok/s', 'parse tok/s', 'compiler'))
+    for size in sizes:
+        text = sample_source(size)
+        scan_time = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            tokens = scan(io.StringIO(text))
+            scan_time = min(scan_time, time.perf_counter() - start)
+        for directory in compilers:
+            result = subprocess.run([sys.executable, '-c',
+                                     PARSE.format(repeat)],
+                                    input=text, cwd=directory,
+                                    capture_output=True, text=True,
+                                    check=True)
+            parse_time = float(result.stdout)
+            print('{0:>10} {1:>10} {2:>14} {3:>14.0f}  {4}'.format(
+                  len(text), tokens, '{0:.0f}'.format(tokens / scan_time)
+                  if directory == compilers[0] else '-',
+                  tokens / parse_time, directory))
+
+# Programs that keep the interpreter busy, with their input and the
+# number of times their innermost loop runs for that input
+LOOPS = {
+    'wl count': ('in n; s: 0; i: 0; wl i < n { s: s + i * i; i: i + 1 }; ot s',
+                 10**6, 10**6),
+    'fr count': ('in n; s: 0; fr i: n { s: s + i / 3 - i }; ot s', 10**6, 10**6),
+    'nested': ('in n; c: 0; i: n; wl i > 0 { j: n; wl j > 0 { c: c + i * j; '
+               'j: j - 1 }; i: i - 1 }; ot c', 1000, 10**6),
+    'collatz': ('in n; m: 0; fr k: n { x: k; wl x != 1 { if x / 2 * 2 = x '
+                '{ x: x / 2 } el { x: 3 * x + 1 }; m: m + 1 } }; ot m',
+                3000, 0),
+}
+
+def interpret(text, stdin, repeat):
+    '''Returns the best time in seconds to run a compiled program.'''
+    compiler = Compiler()
+    methods = compiler.generate(compiler.optimised(compiler.parse(
+              io.StringIO(text))))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Interpreter(methods).run(io.StringIO(stdin), io.StringIO())
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_interpreter(repeat):
+    '''Runs the example program and loops that do a lot of arithmetic in
+       the interpreter, without counting the time to compile them.'''
+    with open(EXAMPLE) as f:
+        example = f.read()
+    print('{0:>10} {1:>10} {2:>14}'.format('program', 'seconds',
+                                          'ns/iteration'))
+    elapsed = interpret(example, '7\n', repeat)
+    print('{0:>10} {1:>10.6f} {2:>14}'.format('example', elapsed, '-'))
+    for name, (text, n, iterations) in LOOPS.items():
+        elapsed = interpret(text, str(n) + '\n', repeat)
+        print('{0:>10} {1:>10.4f} {2:>14}'.format(name, elapsed,
+              '{0:.1f}'.format(elapsed / iterations * 1e9) if iterations
+              else '-'))
+
+def bench_server(runs, requests, threads):
+    '''Compiles the example program starting a new compiler each time,
+       through client.py and the compile server and with requests sent
+       to the server from threads, then prints the server's stats.'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(EXAMPLE, 'rb') as f:
+        example = f.read()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'server.sock')
+        server = subprocess.Popen([sys.executable,
+                                   os.path.join(here, 'server.py'),
+                                   '--socket', path, '--no-cache'])
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.05)
+            print('{0:>10} {1:>12}'.format('compiler', 'ms/program'))
+            for name, command in [
+                    ('cold', ['parser_code_generator.py', '--no-cache']),
+                    ('client', ['client.py', '--socket', path])]:
+                start = time.perf_counter()
+                for _ in range(runs):
+                    subprocess.run([sys.executable,
+                                    os.path.join(here, command[0])] +
+                                   command[1:], input=example,
+                                   stdout=subprocess.DEVNULL, check=True)
+                elapsed = time.perf_counter() - start
+                print('{0:>10} {1:>12.1f}'.format(name,
+                                                  elapsed / runs * 1000))
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                replies = list(executor.map(
+                    lambda _: request({}, example, path), range(requests)))
+            elapsed = time.perf_counter() - start
+            assert all('error' not in header for header, _ in replies)
+            print('{0} requests from {1} threads: {2:.0f} requests/s'.format(
+                  requests, threads, requests / elapsed))
+            stats, _ = request({'stats': True}, path=path)
+            print('server: {0} requests, p50 {1:.2f} ms, p99 {2:.2f} ms'
+                  .format(stats['requests'], stats['p50 ms'],
+                          stats['p99 ms']))
+        finally:
+            server.terminate()
+            server.wait()
+
+def measure(text, repeat):
+    '''Compiles text repeat times with a Profiler and returns the best
+       time of each phase, then once more tracing memory for the peak of
+       each phase. Returns the results of the profiler with those.'''
+    best = {}
+    for _ in range(repeat):
+        profiler = Profiler(memory=False)
+        Compiler(hooks=[profiler]).compile(io.StringIO(text), io.StringIO())
+        for phase, seconds in profiler.seconds.items():
+            best[phase] = min(best.get(phase, seconds), seconds)
+    traced = not tracemalloc.is_tracing()
+    profiler = Profiler()
+    Compiler(hooks=[profiler]).compile(io.StringIO(text), io.StringIO())
+    if traced:
+        tracemalloc.stop()
+    results = profiler.results()
+    for phase, measured in results['phases'].items():
+        measured['seconds'] = best[phase]
+    results['seconds'] = sum(best.values())
+    results['peak'] = max(measured['peak'] for measured
+                          in results['phases'].values())
+    return results
+
+def commit():
+    '''Returns the git commit of the compiler, or None outside a checkout.'''
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def bench_suite(sizes, repeat, settings, output, compare):
+    '''Compiles generated programs of increasing size, timing the scanner,
+       the parser, the optimiser, code generation and writing the class
+       apart, with the peak memory of each. The results are saved as JSON
+       to output, and given the JSON of an earlier run they are compared
+       with it.'''
+    results = {'commit': commit(), 'python': platform.python_version(),
+               'settings': dict(settings, repeat=repeat), 'results': []}
+    before = {}
+    if compare:
+        with open(compare) as f:
+            earlier = json.load(f)
+        if earlier['settings'] != results['settings']:
+            print('warning: {0} was run with other settings'.format(compare))
+        before = {result['size']: result for result in earlier['results']}
+        print('compared with {0} ({1})'.format(compare, earlier['commit']))
+    # the first compile is slower, it should not count against the smallest
+    measure(Program_Generator(**settings).program(sizes[0]), 1)
+    print('{0:>9} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10}'.format(
+          'size', 'tokens', 'lex', 'parse', 'optimise', 'codegen', 'write',
+          'peak kB'))
+    for size in sizes:
+        text = Program_Generator(**settings).program(size)
+        measured = measure(text, repeat)
+        result = {'size': size, 'chars': len(text),
+                  'tokens': measured['tokens'], 'nodes': measured['nodes'],
+                  'phases': measured['phases'],
+                  'seconds': measured['seconds'], 'peak': measured['peak']}
+        results['results'].append(result)
+        phases = [result['phases'][phase]['seconds'] for phase in PHASES]
+        print('{0:>9} {1:>9} {2:>9.4f} {3:>9.4f} {4:>9.4f} {5:>9.4f} '
+              '{6:>9.4f} {7:>10.1f}'.format(size, result['tokens'],
+              *phases, result['peak'] / 1024))
+        if size in before:
+            old = before[size]
+            ratios = [result['phases'][phase]['seconds'] /
+                      old['phases'][phase]['seconds'] for phase in PHASES]
+            print('{0:>9} {1:>9} {2:>8.2f}x {3:>8.2f}x {4:>8.2f}x {5:>8.2f}x '
+                  '{6:>8.2f}x {7:>9.2f}x'.format('', 'ratio', *ratios,
+                  result['peak'] / old['peak']))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+def bench_watch(size, edits):
+    '''Compiles a large program from scratch, then times recompiling it
+       after edits that add a statement in the middle, as watch mode does
+       each time the file is saved.'''
+    text = sample_source(size)
+    start = time.perf_counter()
+    compile_source(text)
+    print('{0} lines, full compile: {1:.1f} ms'.format(
+          text.count('\n') + 1, (time.perf_counter() - start) * 1000))
+    compiler = Incremental_Compiler()
+    start = time.perf_counter()
+    compiler.update(text)
+    print('first watch compile: {0:.1f} ms'.format(
+          (time.perf_counter() - start) * 1000))
+    print('{0:>6} {1:>10} {2:>12} {3:>12}'.format('edit', 'compiled',
+                                                  'update ms', 'output ms'))
+    for n in range(edits):
+        middle = text.index(';', len(text) // 2)
+        text = text[:middle] + ';\not ' + str(n) + text[middle:]
+        start = time.perf_counter()
+        compiled = compiler.update(text)
+        updated = time.perf_counter()
+        compiler.jasmin()
+        written = time.perf_counter()
+        print('{0:>6} {1:>10} {2:>12.1f} {3:>12.1f}'.format(
+              n + 1, compiled, (updated - start) * 1000,
+              (written - updated) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+    scanner = sub.add_parser('scanner', help='lexing time against input size')
+    scanner.add_argument('--sizes', type=int, nargs='+',
+                         default=[10**3, 10**4, 10**5, 10**6, 10**7])
+    stream = sub.add_parser('stream', help='memory use when streaming files')
+    stream.add_argument('--sizes', type=int, nargs='+',
+                        default=[10**5, 10**6, 10**7])
+    batch = sub.add_parser('batch', help='speedup of parallel compilation')
+    batch.add_argument('--files', type=int, default=64)
+    batch.add_argument('--size', type=int, default=10**4,
+                       help='characters in each file')
+    nesting = sub.add_parser('nesting', help='deeply nested programs and '
+                             'the speed on shallow ones')
+    nesting.add_argument('--depths', type=int, nargs='+',
+                         default=[10, 100, 1000, 10000])
+    nesting.add_argument('--size', type=int, default=10**5,
+                         help='characters in the shallow program')
+    nesting.add_argument('--repeat', type=int, default=5)
+    nesting.add_argument('--baseline', metavar='DIR',
+                         help='checkout of another version to compare with')
+    tree = sub.add_parser('tree', help='memory used by the syntax tree')
+    tree.add_argument('--sizes', type=int, nargs='+',
+                      default=[10**4, 10**5, 10**6])
+    tree.add_argument('--repeat', type=int, default=3)
+    tree.add_argument('--baseline', metavar='DIR',
+                      help='checkout of another version to compare with')
+    parse = sub.add_parser('parse', help='tokens a second scanned and '
+                                         'parsed')
+    parse.add_argument('--sizes', type=int, nargs='+',
+                       default=[10**4, 10**5, 10**6])
+    parse.add_argument('--repeat', type=int, default=3)
+    parse.add_argument('--baseline', metavar='DIR',
+                       help='checkout of another version to compare with')
+    interpreter = sub.add_parser('interpreter',
+                                 help='speed of running programs without '
+                                      'a JVM')
+    interpreter.add_argument('--repeat', type=int, default=3)
+    watch = sub.add_parser('watch', help='recompiling a large program after '
+                                         'small edits')
+    watch.add_argument('--size', type=int, default=2 * 10**6,
+                       help='characters in the program')
+    watch.add_argument('--edits', type=int, default=5)
+    server = sub.add_parser('server', help='compiling through the compile '
+                                           'server against cold starts')
+    server.add_argument('--runs', type=int, default=20,
+                        help='programs compiled starting a new process each')
+    server.add_argument('--requests', type=int, default=1000,
+                        help='requests sent straight to the server')
+    server.add_argument('--threads', type=int, default=16)
+    suite = sub.add_parser('suite', help='time and memory of each phase on '
+                                         'generated programs, saved as JSON')
+    suite.add_argument('--sizes', type=int, nargs='+',
+                       default=[10**3, 10**4, 10**5, 10**6],
+                       help='least characters in each program')
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--depth', type=int, default=3,
+                       help='deepest nesting of blocks')
+    suite.add_argument('--width', type=int, default=4,
+                       help='most operands in an expression')
+    suite.add_argument('--identifiers', type=int, default=16,
+                       help='number of different variables')
+    suite.add_argument('--booleans', type=int, default=3,
+                       help='most comparisons in a condition')
+    suite.add_argument('--output', metavar='FILE',
+                       help='save the results as JSON to FILE')
+    suite.add_argument('--compare', metavar='FILE',
+                       help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+    if args.benchmark == 'scanner':
+        bench_scanner(args.sizes)
+    elif args.benchmark == 'stream':
+        bench_stream(args.sizes)
+    elif args.benchmark == 'batch':
+        bench_batch(args.files, args.size)
+    elif args.benchmark == 'nesting':
+        bench_nesting(args.depths, args.size, args.repeat, args.baseline)
+    elif args.benchmark == 'tree':
+        bench_tree(args.sizes, args.repeat, args.baseline)
+    elif args.benchmark == 'parse':
+        bench_parse(args.sizes, args.repeat, args.baseline)
+    elif args.benchmark == 'interpreter':
+        bench_interpreter(args.repeat)
+    elif args.benchmark == 'watch':
+        bench_watch(args.size, args.edits)
+    elif args.benchmark == 'server':
+        bench_server(args.runs, args.requests, args.threads)
+    elif args.benchmark == 'suite':
+        settings = {'seed': args.seed, 'depth': args.depth,
+                    'width': args.width, 'identifiers': args.identifiers,
+                    'booleans': args.booleans}
+        bench_suite(args.sizes, args.repeat, settings, args.output,
+                    args.compare)
+
+if __name__ == '__main__':
+    main()
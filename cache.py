@@ -0,0 +1,132 @@
+"""
+On-disk cache of compiled programs
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import glob
+import hashlib
+import os
+import tempfile
+
+# Default location and size limit of the cache
+CACHE_DIR = os.environ.get('SM_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'sm'))
+CACHE_SIZE = 64 * 2**20
+
+def fingerprint():
+    '''Returns a hash of the compiler's own source, so that changing the
+       compiler never reuses output from an older version.'''
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class Compile_Cache:
+    '''Maps the text of a program to the bytes of its compiled output,
+       Jasmin assembly or a class file. Entries are files named by a hash
+       of the source text, the compiler fingerprint and the compiler
+       options. Once the cache grows past max_size bytes the least
+       recently used entries are removed.'''
+
+    def __init__(self, directory=CACHE_DIR, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.fingerprint = fingerprint()
+        # Lookups since the cache was created
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, options=''):
+        '''Returns a hash of the fingerprint and options, which the text
+           of a source is added to as it is read.'''
+        digest = hashlib.sha256()
+        for part in (self.fingerprint, options):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest
+
+    def entry(self, digest):
+        '''Returns the file that holds the entry for a digest that has had
+           all of the source added.'''
+        digest = digest.copy()
+        digest.update(b'\0')
+        return os.path.join(self.directory, digest.hexdigest() + '.j')
+
+    def path(self, source, options=''):
+        '''Returns the file that holds the entry for source.'''
+        digest = self.digest(options)
+        digest.update(source.encode())
+        return self.entry(digest)
+
+    def get(self, source, options=''):
+        '''Returns the cached output for source or None.'''
+        return self.lookup(self.path(source, options))
+
+    def put(self, source, code, options=''):
+        '''Stores the output for source and evicts old entries.'''
+        self.store(self.path(source, options), code)
+
+    def lookup(self, path):
+        '''Returns the output in the entry at path or None.'''
+        try:
+            with open(path, 'rb') as f:
+                code = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        # the modification time records when an entry was last used
+        try:
+            os.utime(path)
+        except OSError:
+            # another process evicted it after it was read
+            pass
+        self.hits += 1
+        return code
+
+    def store(self, path, code):
+        '''Stores output in the entry at path and evicts old entries.'''
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first so readers never see half an entry
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(code)
+        os.replace(temp, path)
+        self.evict()
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache fits
+           in max_size bytes.'''
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.j')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        return 'cache: {0} hits, {1} misses'.format(self.hits, self.misses)
+
+class Hashing_Reader:
+    '''Reads a text stream for the scanner and adds what it reads to a
+       digest from Compile_Cache.digest, so a program is looked up once
+       it has been read without its text ever being kept whole.'''
+    def __init__(self, stream, digest):
+        self.stream = stream
+        self.digest = digest
+
+    def read(self, size=-1):
+        text = self.stream.read(size)
+        self.digest.update(text.encode())
+        return text
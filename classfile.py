@@ -0,0 +1,267 @@
+"""
+Binary class file output, so programs run without assembling them with Jasmin
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import io
+import struct
+from jasmin import LABEL, LimitError, descriptor_size, fields, inverse_jump, \
+                   jumps, max_stack
+
+# Class file version 45.3 is read by every JVM and needs no StackMapTable
+MAJOR_VERSION = 45
+MINOR_VERSION = 3
+
+# Longest code a method can have
+MAX_CODE = 2**16 - 1
+
+access_flags = { 'public':0x0001, 'private':0x0002, 'protected':0x0004,
+                 'static':0x0008, 'final':0x0010, 'super':0x0020 }
+
+opcodes = { 'iconst_m1':0x02, 'iconst_0':0x03, 'iconst_1':0x04,
+            'iconst_2':0x05, 'iconst_3':0x06, 'iconst_4':0x07,
+            'iconst_5':0x08, 'bipush':0x10, 'sipush':0x11, 'ldc':0x12,
+            'ldc_w':0x13, 'iload':0x15, 'aload':0x19, 'iload_0':0x1a,
+            'iload_1':0x1b, 'iload_2':0x1c, 'iload_3':0x1d, 'aload_0':0x2a,
+            'aload_1':0x2b, 'aload_2':0x2c, 'aload_3':0x2d, 'istore':0x36,
+            'astore':0x3a, 'istore_0':0x3b, 'istore_1':0x3c,
+            'istore_2':0x3d, 'istore_3':0x3e, 'astore_0':0x4b,
+            'astore_1':0x4c, 'astore_2':0x4d, 'astore_3':0x4e, 'pop':0x57,
+            'dup':0x59,
+            'iadd':0x60, 'isub':0x64, 'imul':0x68, 'idiv':0x6c, 'ineg':0x74,
+            'ishl':0x78, 'ishr':0x7a, 'iushr':0x7c,
+            'iinc':0x84, 'ifeq':0x99, 'ifne':0x9a, 'iflt':0x9b, 'ifge':0x9c,
+            'ifgt':0x9d, 'ifle':0x9e, 'if_icmpeq':0x9f, 'if_icmpne':0xa0,
+            'if_icmplt':0xa1, 'if_icmpge':0xa2, 'if_icmpgt':0xa3,
+            'if_icmple':0xa4, 'goto':0xa7, 'ireturn':0xac, 'return':0xb1,
+            'getstatic':0xb2, 'putstatic':0xb3, 'invokevirtual':0xb6,
+            'invokespecial':0xb7, 'invokenonvirtual':0xb7,
+            'invokestatic':0xb8, 'new':0xbb, 'athrow':0xbf, 'wide':0xc4,
+            'goto_w':0xc8 }
+
+# Instructions whose operand is a local variable
+local_variables = {'iload', 'aload', 'istore', 'astore', 'iinc'}
+
+def member(reference):
+    '''Splits a field or method such as java/lang/System/out or
+       java/util/Scanner.nextInt()I into its class, name and descriptor.
+       Like Jasmin, the class and name may be separated by / or .'''
+    if '(' in reference:
+        reference, descriptor = reference[:reference.index('(')], \
+                                reference[reference.index('('):]
+    else:
+        descriptor = None
+    split = max(reference.rfind('/'), reference.rfind('.'))
+    return reference[:split], reference[split+1:], descriptor
+
+class Constant_Pool:
+    '''The constants of a class. Each constant gets an index the first
+       time it is used, so the same class always gives the same bytes.'''
+
+    def __init__(self):
+        self.indexes = {}
+        self.entries = []
+
+    def add(self, key, data):
+        if key not in self.indexes:
+            self.entries.append(data)
+            self.indexes[key] = len(self.entries)
+        return self.indexes[key]
+
+    def utf8(self, text):
+        data = text.encode('utf-8')
+        return self.add(('Utf8', text),
+                        struct.pack('>BH', 1, len(data)) + data)
+
+    def integer(self, value):
+        return self.add(('Integer', value), struct.pack('>Bi', 3, value))
+
+    def class_(self, name):
+        return self.add(('Class', name),
+                        struct.pack('>BH', 7, self.utf8(name)))
+
+    def string(self, text):
+        return self.add(('String', text),
+                        struct.pack('>BH', 8, self.utf8(text)))
+
+    def name_and_type(self, name, descriptor):
+        return self.add(('NameAndType', name, descriptor),
+                        struct.pack('>BHH', 12, self.utf8(name),
+                                    self.utf8(descriptor)))
+
+    def field(self, reference, descriptor):
+        class_, name, _ = member(reference)
+        return self.add(('Fieldref', class_, name, descriptor),
+                        struct.pack('>BHH', 9, self.class_(class_),
+                                    self.name_and_type(name, descriptor)))
+
+    def method(self, reference):
+        class_, name, descriptor = member(reference)
+        return self.add(('Methodref', class_, name, descriptor),
+                        struct.pack('>BHH', 10, self.class_(class_),
+                                    self.name_and_type(name, descriptor)))
+
+    def constant(self, ins):
+        '''Returns the index of the constant an instruction refers to.'''
+        op = ins[0]
+        if op in ('getstatic', 'putstatic'):
+            return self.field(ins[1], ins[2])
+        if op.startswith('invoke'):
+            return self.method(ins[1])
+        if op == 'new':
+            return self.class_(ins[1])
+        if op == 'ldc':
+            if isinstance(ins[1], int):
+                return self.integer(ins[1])
+            return self.string(ins[1])
+        return None
+
+    def write(self, stream):
+        stream.write(struct.pack('>H', len(self.entries) + 1))
+        stream.writelines(self.entries)
+
+def encode(ins, index):
+    '''Returns the bytes of an instruction that is not a jump, where index
+       is the constant it refers to.'''
+    op = ins[0]
+    if op in local_variables:
+        # locals past 255 and large increments need the wide form
+        if op == 'iinc' and not (ins[1] < 2**8 and -2**7 <= ins[2] < 2**7):
+            return struct.pack('>BBHh', opcodes['wide'], opcodes[op],
+                               ins[1], ins[2])
+        if op == 'iinc':
+            return struct.pack('>BBb', opcodes[op], ins[1], ins[2])
+        if ins[1] >= 2**8:
+            return struct.pack('>BBH', opcodes['wide'], opcodes[op], ins[1])
+        return struct.pack('>BB', opcodes[op], ins[1])
+    if op == 'bipush':
+        return struct.pack('>Bb', opcodes[op], ins[1])
+    if op == 'sipush':
+        return struct.pack('>Bh', opcodes[op], ins[1])
+    if op == 'ldc':
+        if index >= 2**8:
+            return struct.pack('>BH', opcodes['ldc_w'], index)
+        return struct.pack('>BB', opcodes[op], index)
+    if index is not None:
+        return struct.pack('>BH', opcodes[op], index)
+    return struct.pack('>B', opcodes[op])
+
+def code_size(code):
+    '''Returns the bytes code takes at most, when every ldc needs ldc_w and
+       no jump needs goto_w.'''
+    size = 0
+    for ins in code:
+        if ins[0] in jumps:
+            size += 3
+        elif ins[0] != LABEL:
+            size += len(encode(ins, 2**8 if len(ins) > 1 else None))
+    return size
+
+def assemble(code, pool):
+    '''Returns the bytecode for a list of instructions and labels, and
+       the offset of each label in it.'''
+    encoded = [None if ins[0] == LABEL or ins[0] in jumps else
+               encode(ins, pool.constant(ins)) for ins in code]
+    # jumps further than a signed 16 bit offset use goto_w, a conditional
+    # one jumps over a goto_w when its condition is false
+    far = set()
+    while True:
+        offsets, labels, position = [], {}, 0
+        for i, ins in enumerate(code):
+            offsets.append(position)
+            if ins[0] == LABEL:
+                labels[ins[1]] = position
+            elif encoded[i] is not None:
+                position += len(encoded[i])
+            elif i in far:
+                position += 5 if ins[0] == 'goto' else 8
+            else:
+                position += 3
+        if position > MAX_CODE:
+            raise LimitError('code of {0} bytes is over the limit of {1}'
+                             .format(position, MAX_CODE))
+        out_of_range = {i for i, ins in enumerate(code) if ins[0] in jumps
+                        and i not in far and
+                        not -2**15 <= labels[ins[1]] - offsets[i] < 2**15}
+        if not out_of_range:
+            break
+        far |= out_of_range
+    result = []
+    for i, ins in enumerate(code):
+        if encoded[i] is not None:
+            result.append(encoded[i])
+        elif ins[0] in jumps:
+            offset = labels[ins[1]] - offsets[i]
+            if i not in far:
+                result.append(struct.pack('>Bh', opcodes[ins[0]], offset))
+            elif ins[0] == 'goto':
+                result.append(struct.pack('>Bi', opcodes['goto_w'], offset))
+            else:
+                skip = opcodes[inverse_jump[ins[0]]]
+                result.append(struct.pack('>BhBi', skip, 8, opcodes['goto_w'],
+                                          offset - 3))
+    return b''.join(result), labels
+
+def max_locals(method):
+    '''Returns the local variable words a method needs when it does not
+       say, enough for its arguments and every local it uses.'''
+    arguments, _ = descriptor_size(method.descriptor)
+    if 'static' not in method.access.split():
+        arguments += 1
+    used = [ins[1] + 1 for ins in method.code if ins[0] in local_variables]
+    used += [int(ins[0][-1]) + 1 for ins in method.code
+             if ins[0][-2:-1] == '_' and ins[0][:-2] in local_variables]
+    return max([arguments] + used)
+
+def write_method(stream, method, pool):
+    '''Writes a method_info structure with its Code attribute.'''
+    code, labels = assemble(method.code, pool)
+    locals_ = method.max_locals
+    if locals_ is None:
+        locals_ = max_locals(method)
+    stack = method.max_stack
+    if stack is None:
+        stack = max_stack(method.code, method.handlers)
+    flags = 0
+    for word in method.access.split():
+        flags |= access_flags[word]
+    stream.write(struct.pack('>HHHH', flags, pool.utf8(method.name),
+                             pool.utf8(method.descriptor), 1))
+    handlers = method.handlers
+    stream.write(struct.pack('>HIHHI', pool.utf8('Code'),
+                             12 + len(code) + 8 * len(handlers), stack,
+                             locals_, len(code)))
+    stream.write(code)
+    # every handler catches any exception, which is catch type 0
+    stream.write(struct.pack('>H', len(handlers)))
+    for start, end, handler in handlers:
+        stream.write(struct.pack('>HHHH', labels[start], labels[end],
+                                 labels[handler], 0))
+    # no attributes of the Code attribute
+    stream.write(struct.pack('>H', 0))
+
+def write_class(stream, name, methods):
+    '''Writes a class and its methods to a binary stream as a class file.'''
+    pool = Constant_Pool()
+    this = pool.class_(name)
+    super_ = pool.class_('java/lang/Object')
+    # the methods come after the constant pool but add constants to it
+    body = io.BytesIO()
+    declared = fields(name, methods)
+    body.write(struct.pack('>HHHHH', access_flags['public'] |
+                           access_flags['super'], this, super_, 0,
+                           len(declared)))
+    # fields have no attributes
+    for field, descriptor in declared:
+        body.write(struct.pack('>HHHH', access_flags['private'] |
+                               access_flags['static'], pool.utf8(field),
+                               pool.utf8(descriptor), 0))
+    body.write(struct.pack('>H', len(methods)))
+    for method in methods:
+        write_method(body, method, pool)
+    body.write(struct.pack('>H', 0))
+    stream.write(struct.pack('>IHH', 0xCAFEBABE, MINOR_VERSION,
+                             MAJOR_VERSION))
+    pool.write(stream)
+    stream.write(body.getvalue())
@@ -0,0 +1,104 @@
+"""
+Client for the compile server that compiles an Sm program from stdin to
+stdout like parser_code_generator.py, without loading the compiler
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Default path of the server's socket
+SOCKET = os.environ.get('SM_SOCKET',
+                        os.path.join(os.path.expanduser('~'), '.cache', 'sm',
+                                     'server.sock'))
+# Seconds the client waits for the server to reply
+TIMEOUT = 60.0
+
+def request(header, body=b'', path=SOCKET, timeout=TIMEOUT):
+    '''Sends one request to the server listening at path and returns the
+       header and body of its reply. A request is a line of JSON and then
+       the body until the end of the connection, and so is the reply.
+       Raises OSError when no server is listening.'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(header).encode() + b'\n' + body)
+        s.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = s.recv(2**16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    line, _, body = b''.join(chunks).partition(b'\n')
+    return json.loads(line), body
+
+def compile_local(source, options):
+    '''Compiles source in this process, for when no server is running.
+       Returns a reply like the server's.'''
+    from parser_code_generator import SPLIT_SIZE, compile_source
+    try:
+        output = compile_source(source.decode(), options['optimise'],
+                                options['class'], options['buffered'],
+                                options.get('split', SPLIT_SIZE))
+    except Exception as e:
+        return {'error': type(e).__name__, 'message': str(e)}, b''
+    return {'ok': True}, output if options['class'] else output.encode()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles an Sm program from stdin to Jasmin assembly '
+                    'on stdout through the compile server started by '
+                    'server.py, or in this process when it is not running.')
+    parser.add_argument('--class', dest='class_file', action='store_true',
+                        help='write Program.class instead of Jasmin assembly')
+    parser.add_argument('--no-optimise', action='store_true',
+                        help='generate code without optimising it')
+    parser.add_argument('--buffered', action='store_true',
+                        help='read input and write output through buffered '
+                             'streams instead of a Scanner and System.out')
+    parser.add_argument('--split-size', type=int, metavar='BYTES',
+                        help='move statements into methods of their own when '
+                             'main would have more than this many bytes of '
+                             'code, 0 never does')
+    parser.add_argument('--socket', default=SOCKET,
+                        help='path of the server socket '
+                             '(default: $SM_SOCKET or ~/.cache/sm/server.sock)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='seconds to wait for the server')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the stats of the server as JSON instead '
+                             'of compiling')
+    parser.add_argument('--stop', action='store_true',
+                        help='stop the server instead of compiling')
+    args = parser.parse_args()
+    if args.stats or args.stop:
+        header, _ = request({'stats': True} if args.stats else {'stop': True},
+                            path=args.socket, timeout=args.timeout)
+        if args.stats:
+            print(json.dumps(header, indent=2))
+        return
+    options = {'class': args.class_file, 'optimise': not args.no_optimise,
+               'buffered': args.buffered}
+    if args.split_size is not None:
+        options['split'] = args.split_size
+    source = sys.stdin.buffer.read()
+    try:
+        header, output = request(options, source, args.socket, args.timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        header, output = compile_local(source, options)
+    if header.get('error') == 'TrailingInputError':
+        print('syntax error: ' + header['message'])
+        sys.exit()
+    if 'error' in header:
+        print('{0}: {1}'.format(header['error'], header['message']),
+              file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.buffer.write(output)
+
+if __name__ == '__main__':
+    main()
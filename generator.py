@@ -0,0 +1,148 @@
+"""
+Seeded generator of random Sm programs for benchmarks
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import random
+import string
+
+COMPARISONS = ['=', '!=', '<', '<=', '>', '>=']
+
+def identifier_name(n):
+    '''Returns the nth identifier, v followed by letters, which is never a
+       reserved word.'''
+    letters = ''
+    while True:
+        letters = string.ascii_lowercase[n % 26] + letters
+        n //= 26
+        if n == 0:
+            return 'v' + letters
+        n -= 1
+
+class Program_Generator:
+    '''Makes random programs that use all of the grammar in the README.
+       The same seed and settings always give the same program. Blocks
+       nest at most depth deep, expressions have up to width operands,
+       programs use identifiers variables and conditions have up to
+       booleans comparisons joined by &, | and nt. The programs compile
+       but are not meant to be run, loops need not end.'''
+    def __init__(self, seed=0, depth=3, width=4, identifiers=16, booleans=3):
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.width = width
+        self.booleans = booleans
+        self.names = [identifier_name(n) for n in range(identifiers)]
+
+    def program(self, size):
+        '''Returns a program of at least size characters.'''
+        statements, length = [], 0
+        while length < size:
+            statements.append(self.statement(0))
+            length += len(statements[-1]) + 2
+        return ';\n'.join(statements) + '\n'
+
+    def statements(self, level):
+        '''Returns a block of one to four statements at nesting level.'''
+        indent = '  ' * level
+        return ';\n'.join(indent + self.statement(level)
+                          for _ in range(self.random.randint(1, 4)))
+
+    def block(self, level):
+        return '{\n' + self.statements(level + 1) + '\n' + '  ' * level + '}'
+
+    def statement(self, level):
+        r = self.random.random()
+        # half the statements are simple, the rest are blocks while the
+        # nesting allows them
+        if level >= self.depth or r < 0.5:
+            r = self.random.random()
+            if r < 0.6:
+                return self.name() + ': ' + self.expression(self.width)
+            if r < 0.8:
+                return 'ot ' + (self.name() if r < 0.7
+                                else self.expression(self.width))
+            return 'in ' + self.name()
+        if r < 0.7:
+            text = 'if ' + self.condition(self.booleans) + ' ' + \
+                   self.block(level)
+            if self.random.random() < 0.5:
+                text += ' el ' + self.block(level)
+            return text
+        if r < 0.85:
+            return 'wl ' + self.condition(self.booleans) + ' ' + \
+                   self.block(level)
+        return 'fr ' + self.name() + ': ' + self.expression(2) + ' ' + \
+               self.block(level)
+
+    def name(self):
+        return self.random.choice(self.names)
+
+    def number(self):
+        if self.random.random() < 0.8:
+            return str(self.random.randint(0, 100))
+        return str(self.random.randint(0, 2**31 - 1))
+
+    def expression(self, width):
+        '''Returns an expression of one to width operands, some of them
+           expressions in parentheses.'''
+        operands = self.random.randint(1, max(width, 1))
+        parts = []
+        for i in range(operands):
+            if i:
+                parts.append(self.random.choice('+-*/'))
+            r = self.random.random()
+            if operands > 2 and r < 0.15:
+                parts.append('(' + self.expression(operands // 2) + ')')
+            elif r < 0.6:
+                parts.append(self.name())
+            else:
+                parts.append(self.number())
+        return ' '.join(parts)
+
+    def condition(self, comparisons):
+        '''Returns a boolean expression of one to comparisons comparisons.'''
+        count = self.random.randint(1, max(comparisons, 1))
+        terms = []
+        while count:
+            factors = []
+            for _ in range(self.random.randint(1, count)):
+                factors.append(self.factor(count))
+                count -= 1
+                if not count:
+                    break
+            terms.append(' & '.join(factors))
+        return ' | '.join(terms)
+
+    def factor(self, comparisons):
+        r = self.random.random()
+        if r < 0.15:
+            return 'nt ' + self.factor(1)
+        if r < 0.3 and comparisons > 1:
+            return '(' + self.condition(comparisons // 2) + ')'
+        return self.expression(max(self.width // 2, 1)) + ' ' + \
+               self.random.choice(COMPARISONS) + ' ' + \
+               self.expression(max(self.width // 2, 1))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Writes a random Sm program to stdout.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=1000,
+                        help='least number of characters in the program')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='deepest nesting of blocks')
+    parser.add_argument('--width', type=int, default=4,
+                        help='most operands in an expression')
+    parser.add_argument('--identifiers', type=int, default=16,
+                        help='number of different variables')
+    parser.add_argument('--booleans', type=int, default=3,
+                        help='most comparisons in a condition')
+    args = parser.parse_args()
+    generator = Program_Generator(args.seed, args.depth, args.width,
+                                  args.identifiers, args.booleans)
+    print(generator.program(args.size), end='')
+
+if __name__ == '__main__':
+    main()
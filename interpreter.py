@@ -0,0 +1,401 @@
+"""
+Interpreter that runs compiled Sm programs without a JVM
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import io
+import operator
+import re
+import sys
+from functools import partial
+from jasmin import LABEL, constant_value, descriptor_size, java_div, java_int
+from classfile import member
+from scanner import TrailingInputError
+from parser_code_generator import Compiler
+
+class JavaException(Exception):
+    """An exception the JVM would throw, which ends the program"""
+    def __init__(self, name, message=None):
+        self.name = name
+        super().__init__(name if message is None else name + ': ' + message)
+
+class Input:
+    '''A java.util.Scanner reading whitespace separated ints from a text
+       stream one line at a time.'''
+
+    def open(self, stream):
+        self.stream = stream
+        self.words = []
+
+    def next_int(self):
+        while not self.words:
+            line = self.stream.readline()
+            if not line:
+                raise JavaException('java.util.NoSuchElementException')
+            self.words = line.split()[::-1]
+        word = self.words[-1]
+        if not re.fullmatch(r'[-+]?[0-9]+', word):
+            raise JavaException('java.util.InputMismatchException')
+        value = int(word)
+        if value != java_int(value):
+            raise JavaException('java.util.InputMismatchException',
+                                'For input string: "{0}"'.format(word))
+        self.words.pop()
+        return value
+
+    def read(self):
+        '''Returns the next character as an int, or -1 at the end, as a
+           java.io.BufferedInputStream does.'''
+        c = self.stream.read(1)
+        return ord(c) if c else -1
+
+class Output:
+    '''A java.io.PrintStream, or a java.io.PrintWriter or
+       java.io.BufferedOutputStream over one, writing to a text stream.'''
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def open(self, output):
+        self.stream = output.stream
+
+    def println(self, value):
+        self.stream.write(str(value) + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+# Library methods a program can call, by class, name and descriptor
+natives = {
+    ('java/util/Scanner', '<init>', '(Ljava/io/InputStream;)V'): Input.open,
+    ('java/util/Scanner', 'nextInt', '()I'): Input.next_int,
+    ('java/lang/String', 'valueOf', '(I)Ljava/lang/String;'): str,
+    ('java/io/PrintStream', 'println', '(Ljava/lang/String;)V'): Output.println,
+    ('java/lang/Object', '<init>', '()V'): lambda this: None,
+    ('java/io/BufferedInputStream', '<init>', '(Ljava/io/InputStream;)V'):
+        Input.open,
+    ('java/io/InputStream', 'read', '()I'): Input.read,
+    ('java/io/BufferedOutputStream', '<init>', '(Ljava/io/OutputStream;)V'):
+        Output.open,
+    ('java/io/PrintWriter', '<init>', '(Ljava/io/OutputStream;)V'):
+        Output.open,
+    ('java/io/PrintWriter', 'println', '(I)V'): Output.println,
+    ('java/io/PrintWriter', 'flush', '()V'): Output.flush,
+}
+
+# Classes a program can make with new
+classes = { 'java/util/Scanner': Input, 'java/io/BufferedInputStream': Input,
+            'java/io/BufferedOutputStream': Output,
+            'java/io/PrintWriter': Output }
+
+# Exceptions a program can throw itself
+for exception in ('java/util/NoSuchElementException',
+                  'java/util/InputMismatchException'):
+    classes[exception] = partial(JavaException, exception.replace('/', '.'))
+    natives[(exception, '<init>', '()V')] = lambda this: None
+
+# Operations of the interpreter. Each instruction becomes one operation and
+# its argument, with constants, locals and jump targets worked out before
+# running. The most common sequences of loads and a conditional jump are
+# one operation.
+(LOAD, STORE, PUSH, INC, ADD, SUB, MUL, DIV, NEG, SHL, SHR, USHR,
+ DIVIDE_SHIFT, JUMP, IF, IF_ZERO, IF_LOCALS, IF_LOCAL_CONSTANT, IF_LOCAL_ZERO,
+ GET, PUT, NEW, DUP, POP, CALL, INVOKE, RETURN, RETURN_INT, THROW) = range(29)
+
+# The operations of the shifts that divide by 2**k, without the constants
+divide_shift = [DUP, PUSH, SHR, PUSH, USHR, ADD, PUSH, SHR]
+
+simple = { 'iadd':ADD, 'isub':SUB, 'imul':MUL, 'idiv':DIV, 'ineg':NEG,
+           'ishl':SHL, 'ishr':SHR, 'iushr':USHR,
+           'dup':DUP, 'pop':POP, 'return':RETURN, 'ireturn':RETURN_INT,
+           'athrow':THROW }
+
+# What each conditional jump compares
+comparison = { 'eq':operator.eq, 'ne':operator.ne, 'lt':operator.lt,
+               'ge':operator.ge, 'gt':operator.gt, 'le':operator.le }
+
+def local_index(ins):
+    '''Returns the local an iload, istore, aload or astore uses.'''
+    if len(ins) > 1:
+        return ins[1]
+    return int(ins[0][-1])
+
+class Interpreter:
+    '''Runs the methods of a compiled class on Python ints that wrap
+       around like Java ints, reading In from stdin and writing Ot to
+       stdout. Each method is translated once to a flat list of
+       operations that a single loop dispatches on.'''
+
+    def __init__(self, methods, name='Program'):
+        self.name = name
+        self.methods = {method.name: method for method in methods}
+        self.translated = {}
+        self.statics = {}
+
+    def translate(self, method):
+        '''Returns the operations and arguments for a method's code, and
+           its exception handlers as the first operation each covers, the
+           operation after the last and the handler's operation.'''
+        code = [ins for ins in method.code if ins[0] != LABEL]
+        # index of the instruction after each label
+        targets, i = {}, 0
+        for ins in method.code:
+            if ins[0] == LABEL:
+                targets[ins[1]] = i
+            else:
+                i += 1
+        ops, args = [], []
+        for i, ins in enumerate(code):
+            op = ins[0]
+            value = constant_value(ins)
+            if value is not None:
+                ops.append(PUSH)
+                args.append(value)
+            elif op[1:5] == 'load':
+                ops.append(LOAD)
+                args.append(local_index(ins))
+            elif op[1:6] == 'store':
+                ops.append(STORE)
+                args.append(local_index(ins))
+            elif op == 'iinc':
+                ops.append(INC)
+                args.append((ins[1], ins[2]))
+            elif op == 'goto':
+                ops.append(JUMP)
+                args.append(targets[ins[1]])
+            elif op.startswith('if_icmp'):
+                ops.append(IF)
+                args.append((comparison[op[7:]], targets[ins[1]]))
+            elif op.startswith('if'):
+                ops.append(IF_ZERO)
+                args.append((comparison[op[2:]], targets[ins[1]]))
+            elif op in ('getstatic', 'putstatic'):
+                class_, name, _ = member(ins[1])
+                ops.append(GET if op == 'getstatic' else PUT)
+                args.append((class_, name))
+            elif op == 'new':
+                ops.append(NEW)
+                args.append(classes[ins[1]])
+            elif op.startswith('invoke'):
+                class_, name, descriptor = member(ins[1])
+                arguments, result = descriptor_size(descriptor)
+                if op != 'invokestatic':
+                    arguments += 1
+                if class_ == self.name:
+                    ops.append(CALL)
+                    args.append((name, arguments, result))
+                else:
+                    ops.append(INVOKE)
+                    args.append((natives[class_, name, descriptor], arguments,
+                                 result))
+            elif op in simple:
+                ops.append(simple[op])
+                args.append(None)
+            else:
+                raise ValueError('cannot run ' + op)
+        handlers = [tuple(targets[label] for label in handler)
+                    for handler in method.handlers]
+        return fuse(ops, args) + (handlers,)
+
+    def run(self, stdin, stdout):
+        '''Runs main with System.in reading stdin and System.out writing
+           to stdout. Raises JavaException if the program throws one.'''
+        self.statics[('java/lang/System', 'in')] = stdin
+        self.statics[('java/lang/System', 'out')] = Output(stdout)
+        self.call('main', [None])
+
+    def call(self, name, arguments):
+        '''Runs a method of the class and returns its result.'''
+        if name not in self.translated:
+            self.translated[name] = self.translate(self.methods[name])
+        ops, args, handlers = self.translated[name]
+        method = self.methods[name]
+        local = arguments + [0] * (method.max_locals - len(arguments))
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        statics = self.statics
+        pc = 0
+        while True:
+            try:
+                while True:
+                    op = ops[pc]
+                    arg = args[pc]
+                    pc += 1
+                    if op == LOAD:
+                        push(local[arg])
+                    elif op == PUSH:
+                        push(arg)
+                    elif op == STORE:
+                        local[arg] = pop()
+                    elif op == IF_LOCALS:
+                        compare, a, b, target, following = arg
+                        if compare(local[a], local[b]):
+                            pc = target
+                        else:
+                            pc = following
+                    elif op == IF_LOCAL_CONSTANT:
+                        compare, a, b, target, following = arg
+                        pc = target if compare(local[a], b) else following
+                    elif op == IF_LOCAL_ZERO:
+                        compare, a, target, following = arg
+                        pc = target if compare(local[a], 0) else following
+                    elif op == INC:
+                        index, value = arg
+                        value += local[index]
+                        if not -0x80000000 <= value <= 0x7fffffff:
+                            value = java_int(value)
+                        local[index] = value
+                    elif op == ADD:
+                        value = pop() + stack[-1]
+                        if not -0x80000000 <= value <= 0x7fffffff:
+                            value = java_int(value)
+                        stack[-1] = value
+                    elif op == SUB:
+                        value = stack[-2] - pop()
+                        if not -0x80000000 <= value <= 0x7fffffff:
+                            value = java_int(value)
+                        stack[-1] = value
+                    elif op == MUL:
+                        value = pop() * stack[-1]
+                        if not -0x80000000 <= value <= 0x7fffffff:
+                            value = java_int(value)
+                        stack[-1] = value
+                    elif op == NEG:
+                        stack[-1] = java_int(-stack[-1])
+                    elif op == SHL:
+                        shift = pop() & 31
+                        stack[-1] = java_int(stack[-1] << shift)
+                    elif op == SHR:
+                        shift = pop() & 31
+                        stack[-1] >>= shift
+                    elif op == USHR:
+                        shift = pop() & 31
+                        stack[-1] = java_int((stack[-1] & 0xffffffff) >> shift)
+                    elif op == DIVIDE_SHIFT:
+                        shift, pc = arg
+                        value = stack[-1]
+                        if value >= 0:
+                            stack[-1] = value >> shift
+                        else:
+                            stack[-1] = -(-value >> shift)
+                    elif op == DIV:
+                        divisor = pop()
+                        if divisor == 0:
+                            raise JavaException(
+                                'java.lang.ArithmeticException', '/ by zero')
+                        stack[-1] = java_div(stack[-1], divisor)
+                    elif op == JUMP:
+                        pc = arg
+                    elif op == IF:
+                        compare, target = arg
+                        b = pop()
+                        if compare(pop(), b):
+                            pc = target
+                    elif op == IF_ZERO:
+                        compare, target = arg
+                        if compare(pop(), 0):
+                            pc = target
+                    elif op == INVOKE:
+                        function, arguments, result = arg
+                        if arguments:
+                            values = stack[-arguments:]
+                            del stack[-arguments:]
+                        else:
+                            values = ()
+                        value = function(*values)
+                        if result:
+                            push(value)
+                    elif op == GET:
+                        push(statics.get(arg, 0))
+                    elif op == PUT:
+                        statics[arg] = pop()
+                    elif op == DUP:
+                        push(stack[-1])
+                    elif op == POP:
+                        pop()
+                    elif op == NEW:
+                        push(arg())
+                    elif op == CALL:
+                        name, arguments, result = arg
+                        values = stack[len(stack)-arguments:]
+                        del stack[len(stack)-arguments:]
+                        value = self.call(name, values)
+                        if result:
+                            push(value)
+                    elif op == RETURN:
+                        return None
+                    elif op == RETURN_INT:
+                        return pop()
+                    elif op == THROW:
+                        raise pop()
+            except JavaException as exception:
+                # the operation that threw is the one before pc
+                for start, end, handler in handlers:
+                    if start <= pc - 1 < end:
+                        break
+                else:
+                    raise
+                pc = handler
+                stack[:] = [exception]
+
+def fuse(ops, args):
+    '''Makes a load followed by a conditional jump, or two loads followed
+       by one, into one operation. The operation goes in place of the
+       first load and carries on after the jump when the condition is
+       false. The shifts the peephole optimiser divides by 2**k with
+       become one operation the same way. The instructions it replaced
+       stay where they were, for jumps to the middle of the sequence.'''
+    for i in range(len(ops)):
+        if ops[i:i+8] == divide_shift and args[i+1] == 31 and \
+           args[i+3] == 32 - args[i+6]:
+            ops[i] = DIVIDE_SHIFT
+            args[i] = (args[i+6], i + 8)
+            continue
+        if ops[i] != LOAD:
+            continue
+        if i + 2 < len(ops) and ops[i+1] in (LOAD, PUSH) and ops[i+2] == IF:
+            compare, target = args[i+2]
+            ops[i] = IF_LOCALS if ops[i+1] == LOAD else IF_LOCAL_CONSTANT
+            args[i] = (compare, args[i], args[i+1], target, i + 3)
+        elif i + 1 < len(ops) and ops[i+1] == IF_ZERO:
+            compare, target = args[i+1]
+            ops[i] = IF_LOCAL_ZERO
+            args[i] = (compare, args[i], target, i + 2)
+    return ops, args
+
+def run_source(text, stdin, stdout, optimise=True, buffered=False):
+    '''Compiles the program in text and runs it.'''
+    compiler = Compiler(optimise=optimise, buffered=buffered)
+    ast = compiler.optimised(compiler.parse(io.StringIO(text)))
+    Interpreter(compiler.generate(ast)).run(stdin, stdout)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs an Sm program without a JVM, reading its input '
+                    'from stdin.')
+    parser.add_argument('program', help='source file of the program')
+    parser.add_argument('--no-optimise', action='store_true',
+                        help='run the code generated without optimising it')
+    parser.add_argument('--buffered', action='store_true',
+                        help='run the code generated with buffered input '
+                             'and output')
+    args = parser.parse_args()
+    with open(args.program) as f:
+        text = f.read()
+    try:
+        run_source(text, sys.stdin, sys.stdout, not args.no_optimise,
+                   args.buffered)
+    except TrailingInputError as e:
+        print('syntax error: ' + str(e))
+        sys.exit()
+    except JavaException as e:
+        # report it the way the JVM does
+        sys.stdout.flush()
+        print('Exception in thread "main" ' + str(e), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
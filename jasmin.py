@@ -0,0 +1,326 @@
+"""
+Instructions and output of Jasmin assembly
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+def java_int(value):
+    '''Wraps value around to a 32 bit signed int, as JVM arithmetic does.'''
+    return (value + 2**31) % 2**32 - 2**31
+
+def java_div(a, b):
+    '''Divides like idiv, rounding toward zero.'''
+    quotient = abs(a) // abs(b)
+    return java_int(quotient if (a < 0) == (b < 0) else -quotient)
+
+# What the int arithmetic instructions compute
+arithmetic = { 'iadd': lambda a, b: java_int(a + b),
+               'isub': lambda a, b: java_int(a - b),
+               'imul': lambda a, b: java_int(a * b),
+               'idiv': java_div }
+
+def load_constant(value):
+    '''Returns the shortest instruction and operand that push an int.'''
+    if -1 <= value <= 5:
+        return ('iconst_m1',) if value == -1 else ('iconst_' + str(value),)
+    if -2**7 <= value < 2**7:
+        return ('bipush', value)
+    if -2**15 <= value < 2**15:
+        return ('sipush', value)
+    return ('ldc', value)
+
+def constant_value(instruction):
+    '''Returns the int an instruction pushes if it only loads a constant,
+       otherwise None.'''
+    op = instruction[0]
+    if op.startswith('iconst_'):
+        return -1 if op == 'iconst_m1' else int(op[7:])
+    if op in ('bipush', 'sipush', 'ldc') and isinstance(instruction[1], int):
+        return instruction[1]
+    return None
+
+# An instruction is a tuple of the opcode and its operands. Labels are
+# kept in the same list as (LABEL, name).
+LABEL = ':'
+
+# Conditional jumps, with the jump for the opposite condition
+inverse_jump = { 'if_icmpeq':'if_icmpne', 'if_icmpne':'if_icmpeq',
+                 'if_icmplt':'if_icmpge', 'if_icmpge':'if_icmplt',
+                 'if_icmpgt':'if_icmple', 'if_icmple':'if_icmpgt',
+                 'ifeq':'ifne', 'ifne':'ifeq', 'iflt':'ifge', 'ifge':'iflt',
+                 'ifgt':'ifle', 'ifle':'ifgt' }
+jumps = set(inverse_jump) | {'goto'}
+
+# Instructions after which execution never continues with the next one
+unconditional = {'goto', 'return', 'ireturn', 'athrow'}
+
+# Largest operand stack a method can declare
+MAX_STACK = 2**16 - 1
+
+class LimitError(Exception):
+    """A method goes past a limit of the class file format"""
+
+# Change in operand stack depth for instructions with a fixed effect
+stack_change = { 'iconst_m1':1, 'iconst_0':1, 'iconst_1':1, 'iconst_2':1,
+                 'iconst_3':1, 'iconst_4':1, 'iconst_5':1, 'bipush':1,
+                 'sipush':1, 'ldc':1, 'iload':1, 'aload':1, 'istore':-1,
+                 'astore':-1, 'iinc':0, 'iadd':-1, 'isub':-1, 'imul':-1,
+                 'idiv':-1, 'ineg':0, 'ishl':-1, 'ishr':-1, 'iushr':-1,
+                 'dup':1, 'pop':-1, 'goto':0, 'new':1, 'getstatic':1,
+                 'putstatic':-1, 'return':0, 'ireturn':-1, 'athrow':-1 }
+for n in range(4):
+    stack_change['iload_' + str(n)] = stack_change['aload_' + str(n)] = 1
+    stack_change['istore_' + str(n)] = stack_change['astore_' + str(n)] = -1
+for jump in inverse_jump:
+    stack_change[jump] = -2 if jump.startswith('if_icmp') else -1
+
+def descriptor_size(descriptor):
+    '''Returns the stack words taken by the arguments and the result of
+       a method descriptor such as (ILjava/lang/String;)V.'''
+    arguments, result = descriptor[1:].split(')')
+    words, i = 0, 0
+    while i < len(arguments):
+        while arguments[i] == '[':
+            i += 1
+        if arguments[i] == 'L':
+            i = arguments.index(';', i)
+        words += 2 if arguments[i] in 'JD' and arguments[i-1] != '[' else 1
+        i += 1
+    return words, {'V':0, 'J':2, 'D':2}.get(result, 1)
+
+def stack_effect(instruction):
+    '''Returns the change in operand stack depth after an instruction.'''
+    op = instruction[0]
+    if op.startswith('invoke'):
+        method = instruction[1]
+        arguments, result = descriptor_size(method[method.index('('):])
+        this = 0 if op == 'invokestatic' else 1
+        return result - arguments - this
+    return stack_change[op]
+
+def max_stack(code, handlers=()):
+    '''Returns the deepest the operand stack gets while running code,
+       following every path through the jumps. Exception handlers start
+       with the exception on the stack.'''
+    index = {ins[1]: i for i, ins in enumerate(code) if ins[0] == LABEL}
+    depth = [None] * len(code)
+    deepest = 0
+    work = [(0, 0)] + [(index[handler], 1) for _, _, handler in handlers]
+    while work:
+        i, d = work.pop()
+        # walk straight line code until reaching an instruction seen before
+        while i < len(code) and depth[i] is None:
+            depth[i] = d
+            ins = code[i]
+            if ins[0] != LABEL:
+                d += stack_effect(ins)
+                deepest = max(deepest, d)
+                if ins[0] in jumps:
+                    work.append((index[ins[1]], d))
+                if ins[0] in unconditional:
+                    break
+            i += 1
+    if deepest > MAX_STACK:
+        raise LimitError('operand stack of {0} is over the limit of {1}'
+                         .format(deepest, MAX_STACK))
+    return deepest
+
+def format_instruction(instruction):
+    '''Returns an instruction or label as a line of Jasmin.'''
+    if instruction[0] == LABEL:
+        return instruction[1] + ':\n'
+    return ' '.join(map(str, instruction)) + '\n'
+
+def catch_directive(start, end, handler):
+    '''Returns the Jasmin for an exception handler that catches anything.'''
+    return '.catch all from {0} to {1} using {2}\n'.format(start, end, handler)
+
+class Method:
+    '''A method of the generated class, with its instructions in a list.'''
+
+    def __init__(self, name, descriptor, access='public static'):
+        self.name = name
+        self.descriptor = descriptor
+        self.access = access
+        self.code = []
+        self.max_locals = 0
+        self.max_stack = 0
+        # (start, end, handler) labels of code that catches any exception
+        self.handlers = []
+
+    def emit(self, *parts):
+        '''Adds an instruction made of an opcode and its operands.'''
+        self.code.append(parts)
+
+    def label(self, label):
+        '''Adds a label for the next instruction.'''
+        self.code.append((LABEL, label))
+
+    def catch(self, start, end, handler):
+        '''Sends any exception thrown between the start and end labels to
+           the handler label.'''
+        self.handlers.append((start, end, handler))
+
+def constructor():
+    '''Returns the default constructor every class needs.'''
+    init = Method('<init>', '()V', 'public')
+    init.emit('aload_0')
+    init.emit('invokenonvirtual', 'java/lang/Object/<init>()V')
+    init.emit('return')
+    init.max_locals = init.max_stack = None
+    return init
+
+def read_int():
+    '''Returns readInt, a method of the generated class that reads the
+       next int from an InputStream one byte at a time. Like
+       Scanner.nextInt it skips whitespace, takes a sign and throws
+       NoSuchElementException at the end of the input and
+       InputMismatchException for anything that is not an int, but it
+       needs no regular expressions.'''
+    method = Method('readInt', '(Ljava/io/InputStream;)I', 'private static')
+    emit, label = method.emit, method.label
+    # locals: the stream, the byte read, the int so far as a negative
+    # number (which can reach -2**31) and whether it has a minus sign
+    stream, byte, value, negative = 0, 1, 2, 3
+    def read():
+        emit('aload', stream)
+        emit('invokevirtual', 'java/io/InputStream/read()I')
+        emit('istore', byte)
+    def throw(exception):
+        emit('new', exception)
+        emit('dup')
+        emit('invokespecial', exception + '/<init>()V')
+        emit('athrow')
+    label('skip')
+    read()
+    emit('iload', byte)
+    emit('bipush', ord(' '))
+    emit('if_icmpgt', 'sign')
+    emit('iload', byte)
+    emit('iconst_m1')
+    emit('if_icmpne', 'skip')
+    throw('java/util/NoSuchElementException')
+    label('sign')
+    emit('iconst_0')
+    emit('istore', negative)
+    emit('iload', byte)
+    emit('bipush', ord('-'))
+    emit('if_icmpne', 'plus')
+    emit('iconst_1')
+    emit('istore', negative)
+    emit('goto', 'signed')
+    label('plus')
+    emit('iload', byte)
+    emit('bipush', ord('+'))
+    emit('if_icmpne', 'first')
+    label('signed')
+    read()
+    label('first')
+    emit('iconst_0')
+    emit('istore', value)
+    emit('iload', byte)
+    emit('bipush', ord('0'))
+    emit('if_icmplt', 'mismatch')
+    emit('iload', byte)
+    emit('bipush', ord('9'))
+    emit('if_icmpgt', 'mismatch')
+    label('digit')
+    # value * 10 - digit must not go below -2**31
+    emit('iload', value)
+    emit('ldc', -214748364)
+    emit('if_icmplt', 'mismatch')
+    emit('iload', value)
+    emit('ldc', -214748364)
+    emit('if_icmpne', 'fits')
+    emit('iload', byte)
+    emit('bipush', ord('8'))
+    emit('if_icmpgt', 'mismatch')
+    label('fits')
+    emit('iload', value)
+    emit('bipush', 10)
+    emit('imul')
+    emit('iload', byte)
+    emit('bipush', ord('0'))
+    emit('isub')
+    emit('isub')
+    emit('istore', value)
+    read()
+    emit('iload', byte)
+    emit('bipush', ord('0'))
+    emit('if_icmplt', 'done')
+    emit('iload', byte)
+    emit('bipush', ord('9'))
+    emit('if_icmple', 'digit')
+    label('done')
+    # the int must end at whitespace or the end of the input
+    emit('iload', byte)
+    emit('bipush', ord(' '))
+    emit('if_icmpgt', 'mismatch')
+    emit('iload', negative)
+    emit('ifeq', 'positive')
+    emit('iload', value)
+    emit('ireturn')
+    label('positive')
+    emit('iload', value)
+    emit('ldc', -2**31)
+    emit('if_icmpeq', 'mismatch')
+    emit('iload', value)
+    emit('ineg')
+    emit('ireturn')
+    label('mismatch')
+    throw('java/util/InputMismatchException')
+    # every local has a one byte load and store
+    method.code = [(ins[0] + '_' + str(ins[1]),)
+                   if ins[0] in ('aload', 'iload', 'istore') else ins
+                   for ins in method.code]
+    method.max_locals = 4
+    method.max_stack = max_stack(method.code)
+    return method
+
+def fields(name, methods):
+    '''Returns the name and descriptor of every static field of the class
+       name that methods use, which the class has to declare.'''
+    found = set()
+    for method in methods:
+        for ins in method.code:
+            if ins[0] in ('getstatic', 'putstatic') and \
+               ins[1].startswith(name + '/'):
+                found.add((ins[1][len(name)+1:], ins[2]))
+    return sorted(found)
+
+def write_class(stream, name, methods):
+    '''Writes a class and its methods to a text stream as Jasmin.'''
+    stream.write('.class public ' + name + '\n')
+    stream.write('.super java/lang/Object\n')
+    for field, descriptor in fields(name, methods):
+        stream.write('.field private static {0} {1}\n'.format(field,
+                                                               descriptor))
+    for method in methods:
+        stream.write('.method {0} {1}{2}\n'.format(method.access, method.name,
+                                                   method.descriptor))
+        if method.max_locals is not None:
+            stream.write('.limit locals {0}\n'.format(method.max_locals))
+        if method.max_stack is not None:
+            stream.write('.limit stack {0}\n'.format(method.max_stack))
+        for handler in method.handlers:
+            stream.write(catch_directive(*handler))
+        stream.writelines(map(format_instruction, method.code))
+        stream.write('.end method\n')
+
+class Writer:
+    '''Writes Jasmin instructions to a text stream as they are generated.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit(self, *parts):
+        '''Writes one instruction or directive followed by its operands.'''
+        self.stream.write(format_instruction(parts))
+
+    def label(self, label):
+        '''Writes a label for the next instruction.'''
+        self.stream.write(label + ':\n')
+
+    def catch(self, start, end, handler):
+        '''Writes an exception handler that catches anything.'''
+        self.stream.write(catch_directive(start, end, handler))
@@ -1,7 +1,22 @@
-import re
+import argparse
+import bisect
+import glob
+import io
+import os
 import sys
-from token import Token
-from scanner import Scanner
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from types import GeneratorType
+from tokens import Token
+from scanner import CHUNK_SIZE, Scanner, TrailingInputError, lex
+from collections import Counter
+from jasmin import Method, Writer, arithmetic, constructor, load_constant, \
+                   max_stack, read_int, write_class
+import classfile
+import peephole
+import slots
+from cache import Compile_Cache, CACHE_DIR, Hashing_Reader
 
 class Symbol_Table:
     '''A symbol table maps identifiers to locations.'''
@@ -18,6 +33,16 @@ class Symbol_Table:
         self.symbol_table[identifier] = index
         return index
 
+class Temporary:
+    "Names temporaries"
+    def __init__(self):
+        self.count = 0
+    def next(self):
+        '''Returns the name of a new temporary, which has a space so no
+           identifier in a program can have the same name.'''
+        self.count += 1
+        return 'Temp ' + str(self.count)
+
 class Label:
     "Increments a label"
     def __init__(self):
@@ -27,477 +52,1870 @@ class Label:
         self.current_label += 1
         return 'l' + str(self.current_label)
 
+# Descriptors of the Java objects In and Ot use, which are kept in locals
+# like variables
+java_objects = { 'Java Scanner':'Ljava/util/Scanner;',
+                 'Java Input':'Ljava/io/InputStream;',
+                 'Java Writer':'Ljava/io/PrintWriter;' }
+
+class Code_Generator:
+    '''Writes the code for one method to a Method or Writer, giving
+       identifiers locations and jumps unique labels as it goes. With
+       buffered, In and Ot go through buffered streams instead of a
+       Scanner and System.out, and name is the class that has readInt.
+       Variables in shared are also used by other methods of the class,
+       which see them through static fields.'''
+    def __init__(self, writer, name='Program', buffered=False):
+        self.writer = writer
+        self.name = name
+        self.buffered = buffered
+        self.symbol_table = Symbol_Table()
+        self.label_generator = Label()
+        self.shared = frozenset()
+    def emit(self, *parts):
+        self.writer.emit(*parts)
+    def label(self, label):
+        self.writer.label(label)
+    def catch(self, start, end, handler):
+        self.writer.catch(start, end, handler)
+    def location(self, identifier):
+        return self.symbol_table.location(identifier)
+    def next_label(self):
+        return self.label_generator.next()
+    def field(self, identifier):
+        '''Returns the static field that holds a shared variable and its
+           descriptor. Fields can not have spaces, which no identifier in
+           a program has, so temporaries get an underscore instead.'''
+        return (self.name + '/' + identifier.replace(' ', '_'),
+                java_objects.get(identifier, 'I'))
+    def fetch(self, identifier):
+        '''Loads a shared variable from its field into its local.'''
+        field, descriptor = self.field(identifier)
+        self.emit('getstatic', field, descriptor)
+        self.emit('istore' if descriptor == 'I' else 'astore',
+                  self.location(identifier))
+    def publish(self, identifier):
+        '''Stores the local of a variable in its field, if it is shared.'''
+        if identifier in self.shared:
+            field, descriptor = self.field(identifier)
+            self.emit('iload' if descriptor == 'I' else 'aload',
+                      self.location(identifier))
+            self.emit('putstatic', field, descriptor)
+
 def indent(s, level):
     """ returns a string that displays the level of indentation"""
     return '    '*level + s + '\n'
 
+def run(task):
+    '''Runs a generator method with an explicit stack instead of recursion.
+       When the generator yields another generator, that one runs first and
+       what it returns is sent back; any other value yielded, such as the
+       result of a method that is not a generator, is sent straight back.
+       Returns what task returns.'''
+    waiting = []
+    value = None
+    while True:
+        try:
+            child = task.send(value)
+        except StopIteration as stop:
+            if not waiting:
+                return stop.value
+            task = waiting.pop()
+            value = stop.value
+            continue
+        if type(child) is GeneratorType:
+            waiting.append(task)
+            task = child
+            value = None
+        else:
+            value = child
+
+# Comparison that is true when the other is false
+negation = { '<':'>=', '=':'!=', '>':'<=', '<=':'>', '!=':'=', '>=':'<' }
+
+# Instruction that jumps when a comparison is true
+jump = { '<':'if_icmplt', '=':'if_icmpeq', '>':'if_icmpgt',
+         '<=':'if_icmple', '!=':'if_icmpne', '>=':'if_icmpge' }
+
+def constant(condition):
+    '''Returns True or False for a condition known at compile time,
+       otherwise None.'''
+    if isinstance(condition, Comparison_AST):
+        return condition.constant()
+    return None
+
+def number(expression):
+    '''Returns the value of a Number_AST as an int, otherwise None.'''
+    if isinstance(expression, Number_AST):
+        return int(expression.number)
+    return None
+
+def reads(expression):
+    '''Returns the names of the variables an expression reads.'''
+    return {node.identifier for node in expression.nodes()
+            if isinstance(node, Identifier_AST)}
+
+class Loop_Nest:
+    '''The loops inside one outermost loop, which hoist their invariant
+       expressions together. Every statement of the nest gets a position
+       in order, so a loop is the range of positions of the statements in
+       it and changes a variable when one of the positions the variable
+       is written at is in its range. An invariant expression goes
+       straight before the outermost loop it can leave, the one inside
+       the innermost loop around it that changes something it reads,
+       without passing through the loops in between. Temporaries are
+       named by temps.'''
+    def __init__(self, temps, outermost):
+        self.temps = temps
+        # positions each variable is written at, in order
+        self.writes = {}
+        # first position and the position after the last of each loop
+        self.ranges = {}
+        # ranges of the loops being hoisted, outermost first
+        self.open = []
+        # assignments of temporaries with the index of the loop in open
+        # they go in, -1 for before the outermost loop
+        self.pending = {}
+        # temporary for the text of each expression in pending
+        self.names = {}
+        position = 0
+        stack = [outermost]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                self.ranges[id(node[0])] = (node[1], position)
+                continue
+            if isinstance(node, (Assign_AST, In_AST)):
+                self.writes.setdefault(node.identifier.identifier,
+                                       []).append(position)
+            elif isinstance(node, (Wl_AST, Fr_AST)):
+                if isinstance(node, Fr_AST):
+                    self.writes.setdefault(
+                        node.assignment.identifier.identifier,
+                        []).append(position)
+                stack.append((node, position))
+                stack.append(node.body)
+            elif isinstance(node, If_El_AST):
+                stack.append(node._else)
+                stack.append(node.then)
+            elif isinstance(node, If_AST):
+                stack.append(node.then)
+            elif isinstance(node, Statements_AST):
+                stack.extend(reversed(node.statements))
+            position += 1
+    def next(self):
+        return self.temps.next()
+    def enter(self, loop):
+        '''Starts hoisting from loop, which is inside the open loops.'''
+        self.open.append(self.ranges[id(loop)])
+    def leave(self, loop):
+        '''Ends hoisting from the innermost open loop. Returns loop, the
+           new loop, with the assignments that go before it.'''
+        self.open.pop()
+        assignments = self.pending.pop(len(self.open) - 1, [])
+        if not assignments:
+            return loop
+        for text, _ in assignments:
+            del self.names[text]
+        return Statements_AST([st for _, st in assignments] + [loop])
+    def changes(self, identifier, index=-1):
+        '''Returns whether the open loop at index changes identifier.'''
+        positions = self.writes.get(identifier)
+        if not positions:
+            return False
+        first, after = self.open[index]
+        i = bisect.bisect_left(positions, first)
+        return i < len(positions) and positions[i] < after
+    def temporary(self, expression):
+        '''Returns the temporary that holds an expression the innermost
+           open loop does not change. The loops around it are searched
+           by halves for the innermost one that changes what the
+           expression reads, as every loop around that one does too.'''
+        text = run(expression.text())
+        if text not in self.names:
+            read = reads(expression)
+            low, high = -1, len(self.open) - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if any(self.changes(identifier, middle) for identifier in read):
+                    low = middle
+                else:
+                    high = middle - 1
+            identifier = Identifier_AST(self.next())
+            self.names[text] = identifier
+            self.pending.setdefault(low, []).append(
+                (text, Assign_AST(identifier, expression)))
+        return self.names[text]
+
+class Loop_Invariants:
+    '''Hoists the parts of the expressions in the innermost open loop of
+       a Loop_Nest that read no variable the loop changes out of it. Each
+       part is worked out once, before the loop, into a temporary that
+       the loop reads instead.'''
+    def __init__(self, nest):
+        self.nest = nest
+    def invariant(self, node, known):
+        '''Returns whether an operand of an expression reads nothing the
+           loop changes, given the answer for expressions already seen.'''
+        if isinstance(node, Expression_AST):
+            return known[node]
+        return not isinstance(node, Identifier_AST) or \
+               not self.nest.changes(node.identifier)
+    def expression(self, expression):
+        '''Returns expression with its largest invariant parts read from
+           temporaries. Division by a variable is never hoisted, as the
+           loop might not have divided at all.'''
+        if not isinstance(expression, Expression_AST):
+            return expression
+        order = []
+        stack = [expression]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for child in (node.left, node.right):
+                if isinstance(child, Expression_AST):
+                    stack.append(child)
+        known = {}
+        for node in reversed(order):
+            known[node] = self.invariant(node.left, known) and \
+                          self.invariant(node.right, known) and \
+                          (node.op != '/' or bool(number(node.right)))
+        # the parts that are not invariant, outermost first
+        changing = []
+        stack = [expression]
+        while stack:
+            node = stack.pop()
+            if known[node]:
+                continue
+            changing.append(node)
+            for child in (node.left, node.right):
+                if isinstance(child, Expression_AST):
+                    stack.append(child)
+        if not changing:
+            return self.nest.temporary(expression)
+        result = {}
+        for node in reversed(changing):
+            left, right = (result.get(child) or
+                           (self.nest.temporary(child) if
+                            isinstance(child, Expression_AST) else child)
+                           for child in (node.left, node.right))
+            if left is node.left and right is node.right:
+                result[node] = node
+            else:
+                result[node] = Expression_AST(left, node.op, right)
+        return result[expression]
+
+class Common_Subexpressions:
+    '''Works out an expression that a run of assignments, in and ot
+       statements, which has no jumps in it, needs more than once into a
+       temporary the first time, and reads the temporary after that. Two
+       expressions are the same when they have the same operators and
+       numbers and read the same variables, none of which is assigned
+       between them.'''
+    def __init__(self, temps):
+        self.temps = temps
+    def program(self, ast):
+        '''Replaces the statements of every block of the tree, which
+           optimisation has just made so nothing else holds them.'''
+        for node in [node for node in ast.nodes()
+                     if isinstance(node, Statements_AST)]:
+            node.statements = self.statements(node.statements)
+        return ast
+    def statements(self, statements):
+        '''Returns statements with each run of straight line statements
+           in them worked out with temporaries.'''
+        result, straight = [], []
+        for st in statements:
+            if isinstance(st, (Assign_AST, Ot_AST, In_AST)):
+                straight.append(st)
+                continue
+            result.extend(self.block(straight))
+            result.append(st)
+            straight = []
+        result.extend(self.block(straight))
+        return result
+    def block(self, statements):
+        '''Returns straight line statements with their common
+           subexpressions read from temporaries.'''
+        # every operator gets a key, the same for the same expression
+        keys, key, size, found = {}, {}, {}, {}
+        # times each variable has been assigned so far
+        version = Counter()
+        def operand(node):
+            '''Returns the key of an expression, or what a number or a
+               variable holds.'''
+            if isinstance(node, Expression_AST):
+                return key[node]
+            if isinstance(node, Identifier_AST):
+                return node.identifier, version[node.identifier]
+            return node.number
+        shared = False
+        for i, st in enumerate(statements):
+            if isinstance(st, In_AST):
+                version[st.identifier.identifier] += 1
+                continue
+            stack = [st.expression]
+            while stack:
+                node = stack.pop()
+                if not isinstance(node, Expression_AST) or node in key:
+                    continue
+                if node.left not in key and isinstance(node.left,
+                                                       Expression_AST) or \
+                   node.right not in key and isinstance(node.right,
+                                                        Expression_AST):
+                    stack.extend((node, node.right, node.left))
+                    continue
+                left, right = operand(node.left), operand(node.right)
+                k = keys.setdefault((left, node.op, right), len(keys))
+                key[node] = k
+                # an operand that is not an operator is one instruction
+                size[k] = size.get(left, 1) + size.get(right, 1) + 1
+                found.setdefault(k, []).append((i, node))
+                shared = shared or left == right and type(left) is int
+            if isinstance(st, Assign_AST):
+                version[st.identifier.identifier] += 1
+        # the largest expressions first, the parts of a later copy of one
+        # are not needed any more
+        unused = set()
+        chosen = {}
+        for k in sorted((k for k in found if len(found[k]) > 1),
+                        key=lambda k: -size[k]):
+            copies = [(i, node) for i, node in found[k] if node not in unused]
+            # each copy read from the temporary saves the size of the
+            # expression but costs a load, and the first costs a store
+            if (len(copies) - 1) * size[k] <= len(copies) + 1:
+                continue
+            chosen[k] = copies[0]
+            for _, copy in copies[1:]:
+                stack = [copy.left, copy.right]
+                while stack:
+                    node = stack.pop()
+                    if isinstance(node, Expression_AST) and node not in unused:
+                        unused.add(node)
+                        stack.extend((node.left, node.right))
+        if not chosen and not shared:
+            return statements
+        names = {k: Identifier_AST(self.temps.next()) for k in chosen}
+        def rewritten(expression, first=False):
+            '''Returns expression reading the chosen expressions from
+               their temporaries, except for expression itself when it is
+               the first copy. An operator with the same expression on
+               both sides gets the same node twice, which is written
+               once and duplicated.'''
+            if not isinstance(expression, Expression_AST):
+                return expression
+            if not first and key[expression] in names:
+                return names[key[expression]]
+            result = {}
+            stack = [expression]
+            while stack:
+                node = stack.pop()
+                if node in result:
+                    continue
+                children = [child for child in (node.left, node.right)
+                            if isinstance(child, Expression_AST) and
+                            child not in result and
+                            key[child] not in names]
+                if children:
+                    stack.append(node)
+                    stack.extend(children)
+                    continue
+                left, right = (result.get(child) or
+                               names.get(key.get(child), child)
+                               for child in (node.left, node.right))
+                if isinstance(node.left, Expression_AST) and \
+                   isinstance(node.right, Expression_AST) and \
+                   key[node.left] == key[node.right]:
+                    right = left
+                if left is node.left and right is node.right:
+                    result[node] = node
+                else:
+                    result[node] = Expression_AST(left, node.op, right)
+            return result[expression]
+        # temporaries go before the statement of their first copy, those
+        # inside others first
+        before = {}
+        for k, (i, node) in chosen.items():
+            before.setdefault(i, []).append(k)
+        result = []
+        for i, st in enumerate(statements):
+            for k in sorted(before.get(i, ()), key=lambda k: size[k]):
+                result.append(Assign_AST(names[k],
+                                         rewritten(chosen[k][1], True)))
+            if isinstance(st, Assign_AST):
+                st = Assign_AST(st.identifier, rewritten(st.expression))
+            elif isinstance(st, Ot_AST):
+                st = Ot_AST(rewritten(st.expression))
+            result.append(st)
+        return result
+
+def safe(tree):
+    '''Returns True if evaluating tree can not throw, which only a
+       division by zero can do.'''
+    return not any(isinstance(node, Expression_AST) and node.op == '/' and
+                   not number(node.right) for node in tree.nodes())
+
 # Each of the classes represents a node in the syntax tree
-# indented method returns a string that displays its self in a tree like structure.
-# code method returns a string with JVM bytecode for that section of the tree.
-# true_code/false_code methods allow jumps in the bytecode depending on the intented use.
+# tree method returns a string that displays its self in a tree like structure.
+# text method returns the node as source code.
+# write method writes the JVM bytecode for that section of the tree with a Code_Generator.
+# write_jump method of a condition jumps to one label when it is true and another when it is false.
+# children method returns the nodes directly below it in the tree.
+# fold method returns the node with constant parts worked out at compile time.
+# hoist method of a statement returns it with the loops in it hoisting their
+# invariant expressions, given the Loop_Nest of the loops around it if any.
+# invariant method returns the node with the parts of its expressions that a
+# Loop_Invariants finds invariant read from temporaries.
+#
+# Deeply nested programs must not run out of Python's stack, so tree, text,
+# write, write_jump, fold, hoist and invariant of nodes that can hold other
+# statements or conditions are generators that yield the methods they need
+# from the nodes below them, and are called through run. The others, and
+# expressions, which are walked with an explicit stack, are ordinary methods.
 
-class Program_AST:
-    """Base node"""
-    def __init__(self, program):
-        self.program = program
+class AST:
+    """Base class for nodes"""
+    # Nodes keep their fields in slots rather than a __dict__, which
+    # makes the tree for a large program a fraction of the size
+    __slots__ = ()
     def __repr__(self):
-        return repr(self.program)
+        return run(self.text())
     def indented(self, level):
-        return self.program.indented(level)
+        '''Returns a string that displays the tree below this node.'''
+        return run(self.tree(level))
+    def children(self):
+        return ()
+    def nodes(self):
+        '''Yields this node and every node below it.'''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children()))
     def code(self):
-        program = self.program.code()
-        local = symbol_table.size()
-        java_scanner = symbol_table.location('Java Scanner')
-        return '.class public Program\n' + \
-               '.super java/lang/Object\n' + \
-               '.method public <init>()V\n' + \
-               'aload_0\n' + \
-               'invokenonvirtual java/lang/Object/<init>()V\n' + \
-               'return\n' + \
-               '.end method\n' + \
-               '.method public static main([Ljava/lang/String;)V\n' + \
-               '.limit locals ' + str(local) + '\n' + \
-               '.limit stack 1024\n' + \
-               'new java/util/Scanner\n' + \
-               'dup\n' + \
-               'getstatic java/lang/System.in Ljava/io/InputStream;\n' + \
-               'invokespecial java/util/Scanner.<init>(Ljava/io/InputStream;)V\n' + \
-               'astore ' + str(java_scanner) + '\n' + \
-               program + \
-               'return\n' + \
-               '.end method\n'
-
-class Statements_AST:
+        '''Returns the JVM bytecode for this section of the tree.'''
+        stream = io.StringIO()
+        # only nodes that contain statements write through a generator
+        task = self.write(Code_Generator(Writer(stream)))
+        if type(task) is GeneratorType:
+            run(task)
+        return stream.getvalue()
+
+def open_input(out):
+    '''Writes the code that makes the Java Scanner that In reads from, or
+       with buffered the BufferedInputStream.'''
+    if out.buffered:
+        java_input = out.location('Java Input')
+        out.emit('new', 'java/io/BufferedInputStream')
+        out.emit('dup')
+        out.emit('getstatic', 'java/lang/System.in', 'Ljava/io/InputStream;')
+        out.emit('invokespecial', 'java/io/BufferedInputStream.<init>(Ljava/io/InputStream;)V')
+        out.emit('astore', java_input)
+        out.publish('Java Input')
+    else:
+        java_scanner = out.location('Java Scanner')
+        out.emit('new', 'java/util/Scanner')
+        out.emit('dup')
+        out.emit('getstatic', 'java/lang/System.in', 'Ljava/io/InputStream;')
+        out.emit('invokespecial', 'java/util/Scanner.<init>(Ljava/io/InputStream;)V')
+        out.emit('astore', java_scanner)
+        out.publish('Java Scanner')
+
+class Program_AST(AST):
+    """Base node"""
+    __slots__ = ('program',)
+    def __init__(self, program):
+        self.program = program
+    def text(self):
+        return (yield self.program.text())
+    def tree(self, level):
+        return (yield self.program.tree(level))
+    def children(self):
+        return (self.program,)
+    def fold(self):
+        return Program_AST((yield self.program.fold()))
+    def hoist(self, temps):
+        return Program_AST((yield self.program.hoist(temps)))
+    def write(self, out):
+        kinds = {type(node) for node in self.nodes()}
+        # only programs that read input need a Java Scanner
+        if In_AST in kinds:
+            open_input(out)
+        if Ot_AST not in kinds or not out.buffered:
+            yield self.program.write(out)
+            out.emit('return')
+            return
+        # one PrintWriter buffers all the output, it is flushed on return
+        # and by a handler for any exception before the exception goes on
+        java_writer = out.location('Java Writer')
+        out.emit('new', 'java/io/PrintWriter')
+        out.emit('dup')
+        out.emit('new', 'java/io/BufferedOutputStream')
+        out.emit('dup')
+        out.emit('getstatic', 'java/lang/System/out', 'Ljava/io/PrintStream;')
+        out.emit('invokespecial', 'java/io/BufferedOutputStream/<init>(Ljava/io/OutputStream;)V')
+        out.emit('invokespecial', 'java/io/PrintWriter/<init>(Ljava/io/OutputStream;)V')
+        out.emit('astore', java_writer)
+        out.publish('Java Writer')
+        start, end, handler = out.next_label(), out.next_label(), out.next_label()
+        out.label(start)
+        yield self.program.write(out)
+        out.emit('aload', java_writer)
+        out.emit('invokevirtual', 'java/io/PrintWriter/flush()V')
+        out.emit('return')
+        out.label(end)
+        out.label(handler)
+        out.emit('aload', java_writer)
+        out.emit('invokevirtual', 'java/io/PrintWriter/flush()V')
+        out.emit('athrow')
+        out.catch(start, end, handler)
+
+class Statements_AST(AST):
+    __slots__ = ('statements',)
     def __init__(self, statements):
         self.statements = statements
-    def __repr__(self):
-        result = repr(self.statements[0])
-        for st in self.statements[1:]:
-            result += '; ' + repr(st)
-        return result
-    def indented(self, level):
+    def text(self):
+        result = []
+        for st in self.statements:
+            result.append((yield st.text()))
+        return '; '.join(result)
+    def tree(self, level):
         result = indent('Statements', level)
         for st in self.statements:
-            result += st.indented(level+1)
+            result += yield st.tree(level+1)
         return result
-    def code(self):
-        result = ''
+    def children(self):
+        return self.statements
+    def fold(self):
+        # statements can disappear or be replaced by a block of statements
+        result = []
         for st in self.statements:
-            result += st.code()
-        return result
+            st = st.fold()
+            if isinstance(st, GeneratorType):
+                st = yield st
+            if isinstance(st, Statements_AST):
+                result.extend(st.statements)
+            elif st is not None:
+                result.append(st)
+        return Statements_AST(result)
+    def hoist(self, temps):
+        # loops are replaced by the assignments of their temporaries and
+        # the loop
+        result = []
+        for st in self.statements:
+            st = st.hoist(temps)
+            if isinstance(st, GeneratorType):
+                st = yield st
+            if isinstance(st, Statements_AST):
+                result.extend(st.statements)
+            else:
+                result.append(st)
+        return Statements_AST(result)
+    def invariant(self, loop):
+        result = []
+        for st in self.statements:
+            st = st.invariant(loop)
+            if isinstance(st, GeneratorType):
+                st = yield st
+            result.append(st)
+        return Statements_AST(result)
+    def write(self, out):
+        for st in self.statements:
+            task = st.write(out)
+            if task is not None:
+                yield task
 
-class If_AST:
+class If_AST(AST):
+    __slots__ = ('condition', 'then')
     def __init__(self, condition, then):
         self.condition = condition
         self.then = then
-    def __repr__(self):
-        return 'if ' + repr(self.condition) + ' { ' + \
-                       repr(self.then) + ' }'
-    def indented(self, level):
+    def text(self):
+        return 'if ' + (yield self.condition.text()) + ' { ' + \
+                       (yield self.then.text()) + ' }'
+    def tree(self, level):
         return indent('If', level) + \
-               self.condition.indented(level+1) + \
-               self.then.indented(level+1)
-    def code(self):
-        l1 = label_generator.next()
-        return self.condition.false_code(l1) + \
-               self.then.code() + \
-               l1 + ':\n'
+               (yield self.condition.tree(level+1)) + \
+               (yield self.then.tree(level+1))
+    def children(self):
+        return (self.condition, self.then)
+    def fold(self):
+        condition = yield self.condition.fold()
+        known = constant(condition)
+        if known is None:
+            return If_AST(condition, (yield self.then.fold()))
+        return (yield self.then.fold()) if known else None
+    def hoist(self, temps):
+        return If_AST(self.condition, (yield self.then.hoist(temps)))
+    def invariant(self, loop):
+        return If_AST((yield self.condition.invariant(loop)),
+                      (yield self.then.invariant(loop)))
+    def write(self, out):
+        l1 = out.next_label()
+        yield self.condition.write_jump(out, None, l1)
+        yield self.then.write(out)
+        out.label(l1)
 
-class If_El_AST:
+class If_El_AST(AST):
+    __slots__ = ('condition', 'then', '_else')
     def __init__(self, condition, then, _else):
         self.condition = condition
         self.then = then
         self._else = _else
-    def __repr__(self):
-        return 'if ' + repr(self.condition) + ' { ' + \
-                       repr(self.then) + ' } el { ' + repr(self._else) + ' }'
-    def indented(self, level):
+    def text(self):
+        return 'if ' + (yield self.condition.text()) + ' { ' + \
+                       (yield self.then.text()) + ' } el { ' + \
+                       (yield self._else.text()) + ' }'
+    def tree(self, level):
         return indent('If-El', level) + \
-               self.condition.indented(level+1) + \
-               self.then.indented(level+1) + \
-               self._else.indented(level+1)
-    def code(self):
-        l1 = label_generator.next()
-        l2 = label_generator.next()
-        return self.condition.false_code(l1) + \
-               self.then.code() + \
-               'goto ' + l2 + '\n' + \
-               l1 + ':\n' + \
-               self._else.code() + \
-               l2 + ':\n'
+               (yield self.condition.tree(level+1)) + \
+               (yield self.then.tree(level+1)) + \
+               (yield self._else.tree(level+1))
+    def children(self):
+        return (self.condition, self.then, self._else)
+    def fold(self):
+        condition = yield self.condition.fold()
+        known = constant(condition)
+        if known is None:
+            return If_El_AST(condition, (yield self.then.fold()),
+                             (yield self._else.fold()))
+        return (yield (self.then if known else self._else).fold())
+    def hoist(self, temps):
+        return If_El_AST(self.condition, (yield self.then.hoist(temps)),
+                         (yield self._else.hoist(temps)))
+    def invariant(self, loop):
+        return If_El_AST((yield self.condition.invariant(loop)),
+                         (yield self.then.invariant(loop)),
+                         (yield self._else.invariant(loop)))
+    def write(self, out):
+        l1 = out.next_label()
+        l2 = out.next_label()
+        yield self.condition.write_jump(out, None, l1)
+        yield self.then.write(out)
+        out.emit('goto', l2)
+        out.label(l1)
+        yield self._else.write(out)
+        out.label(l2)
         
 
-class Wl_AST:
+class Wl_AST(AST):
+    __slots__ = ('condition', 'body')
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
-    def __repr__(self):
-        return 'wl ' + repr(self.condition) + ' { ' + \
-                          repr(self.body) + ' }'
-    def indented(self, level):
+    def text(self):
+        return 'wl ' + (yield self.condition.text()) + ' { ' + \
+                          (yield self.body.text()) + ' }'
+    def tree(self, level):
         return indent('Wl', level) + \
-               self.condition.indented(level+1) + \
-               self.body.indented(level+1)
-    def code(self):
-        l1 = label_generator.next()
-        l2 = label_generator.next()
-        return l1 + ':\n' + \
-               self.condition.false_code(l2) + \
-               self.body.code() + \
-               'goto ' + l1 + '\n' + \
-               l2 + ':\n'
-
-class Fr_AST:
+               (yield self.condition.tree(level+1)) + \
+               (yield self.body.tree(level+1))
+    def children(self):
+        return (self.condition, self.body)
+    def fold(self):
+        condition = yield self.condition.fold()
+        if constant(condition) is False:
+            return None
+        return Wl_AST(condition, (yield self.body.fold()))
+    def hoist(self, temps):
+        nest = temps if isinstance(temps, Loop_Nest) else \
+               Loop_Nest(temps, self)
+        nest.enter(self)
+        body = yield self.body.hoist(nest)
+        loop = Loop_Invariants(nest)
+        condition = yield self.condition.invariant(loop)
+        body = yield body.invariant(loop)
+        return nest.leave(Wl_AST(condition, body))
+    def invariant(self, loop):
+        # the loop hoisted everything in it that is invariant here already
+        return self
+    def write(self, out):
+        # the condition is tested at the bottom, so each time round the
+        # loop takes one conditional jump
+        l1 = out.next_label()
+        l2 = out.next_label()
+        out.emit('goto', l2)
+        out.label(l1)
+        yield self.body.write(out)
+        out.label(l2)
+        yield self.condition.write_jump(out, l1, None)
+
+class Fr_AST(AST):
+    __slots__ = ('assignment', 'body')
     def __init__(self, assignment, body):
         self.assignment = assignment
         self.body = body
-    def __repr__(self):
-        return 'fr ' + repr(self.assignment) + ' { ' + \
-                            repr(self.body) + ' }'
-    def indented(self, level):
+    def text(self):
+        return 'fr ' + (yield self.assignment.text()) + ' { ' + \
+                            (yield self.body.text()) + ' }'
+    def tree(self, level):
         return indent('Fr', level) + \
-                self.assignment.indented(level+1) + \
-                self.body.indented(level+1)
-    def code(self):
-        loc = symbol_table.location(self.assignment.identifier.identifier)
-        l1 = label_generator.next()
-        return self.assignment.code() + \
-                l1 + ':\n' + \
-                self.body.code() + \
-                'iload ' + str(loc) + '\n' + \
-                'sipush 1\n' + \
-                'isub\n' + \
-                'istore ' + str(loc) + '\n' + \
-                'iload ' + str(loc) + '\n' + \
-                'sipush 0\n' + \
-                'if_icmpne ' + l1 + '\n'
-
-class Assign_AST:
+                (yield self.assignment.tree(level+1)) + \
+                (yield self.body.tree(level+1))
+    def children(self):
+        return (self.assignment, self.body)
+    def fold(self):
+        return Fr_AST((yield self.assignment.fold()), (yield self.body.fold()))
+    def hoist(self, temps):
+        nest = temps if isinstance(temps, Loop_Nest) else \
+               Loop_Nest(temps, self)
+        nest.enter(self)
+        body = yield self.body.hoist(nest)
+        body = yield body.invariant(Loop_Invariants(nest))
+        return nest.leave(Fr_AST(self.assignment, body))
+    def invariant(self, loop):
+        # the count is worked out once each time the outer loop comes to it
+        return Fr_AST(self.assignment.invariant(loop), self.body)
+    def write(self, out):
+        loc = out.location(self.assignment.identifier.identifier)
+        l1 = out.next_label()
+        yield self.assignment.write(out)
+        out.label(l1)
+        yield self.body.write(out)
+        out.emit('iinc', loc, -1)
+        out.emit('iload', loc)
+        out.emit('ifne', l1)
+
+class Assign_AST(AST):
+    __slots__ = ('identifier', 'expression')
     def __init__(self, identifier, expression):
         self.identifier = identifier
         self.expression = expression
-    def __repr__(self):
-        return repr(self.identifier) + ':' + repr(self.expression)
-    def indented(self, level):
+    def text(self):
+        return (yield self.identifier.text()) + ':' + \
+               (yield self.expression.text())
+    def tree(self, level):
         return indent('Assign', level) + \
-               self.identifier.indented(level+1) + \
-               self.expression.indented(level+1)
-    def code(self):
-        loc = symbol_table.location(self.identifier.identifier)
-        return self.expression.code() + \
-               'istore ' + str(loc) + '\n'
+               (yield self.identifier.tree(level+1)) + \
+               (yield self.expression.tree(level+1))
+    def children(self):
+        return (self.identifier, self.expression)
+    def fold(self):
+        return Assign_AST(self.identifier, self.expression.fold())
+    def hoist(self, temps):
+        return self
+    def invariant(self, loop):
+        return Assign_AST(self.identifier, loop.expression(self.expression))
+    def write(self, out):
+        loc = out.location(self.identifier.identifier)
+        self.expression.write(out)
+        out.emit('istore', loc)
 
-class Ot_AST:
+class Ot_AST(AST):
+    __slots__ = ('expression',)
     def __init__(self, expression):
         self.expression = expression
-    def __repr__(self):
-        return 'ot ' + repr(self.expression)
-    def indented(self, level):
-        return indent('Ot', level) + self.expression.indented(level+1)
-    def code(self):
-        return 'getstatic java/lang/System/out Ljava/io/PrintStream;\n' + \
-               self.expression.code() + \
-               'invokestatic java/lang/String/valueOf(I)Ljava/lang/String;\n' + \
-               'invokevirtual java/io/PrintStream/println(Ljava/lang/String;)V\n'
+    def text(self):
+        return 'ot ' + (yield self.expression.text())
+    def tree(self, level):
+        return indent('Ot', level) + (yield self.expression.tree(level+1))
+    def children(self):
+        return (self.expression,)
+    def fold(self):
+        return Ot_AST(self.expression.fold())
+    def hoist(self, temps):
+        return self
+    def invariant(self, loop):
+        return Ot_AST(loop.expression(self.expression))
+    def write(self, out):
+        if out.buffered:
+            out.emit('aload', out.location('Java Writer'))
+            self.expression.write(out)
+            out.emit('invokevirtual', 'java/io/PrintWriter/println(I)V')
+            return
+        out.emit('getstatic', 'java/lang/System/out', 'Ljava/io/PrintStream;')
+        self.expression.write(out)
+        out.emit('invokestatic', 'java/lang/String/valueOf(I)Ljava/lang/String;')
+        out.emit('invokevirtual', 'java/io/PrintStream/println(Ljava/lang/String;)V')
 
-class In_AST:
+class In_AST(AST):
+    __slots__ = ('identifier',)
     def __init__(self, identifier):
         self.identifier = identifier
-    def __repr__(self):
-        return 'in ' + repr(self.identifier)
-    def indented(self, level):
-        return indent('In', level) + self.identifier.indented(level+1)
-    def code(self):
-        java_scanner = symbol_table.location('Java Scanner')
-        loc = symbol_table.location(self.identifier.identifier)
-        return 'aload ' + str(java_scanner) + '\n' + \
-               'invokevirtual java/util/Scanner.nextInt()I\n' + \
-               'istore ' + str(loc) + '\n'
+    def text(self):
+        return 'in ' + (yield self.identifier.text())
+    def tree(self, level):
+        return indent('In', level) + (yield self.identifier.tree(level+1))
+    def children(self):
+        return (self.identifier,)
+    def fold(self):
+        return self
+    def hoist(self, temps):
+        return self
+    def invariant(self, loop):
+        return self
+    def write(self, out):
+        if out.buffered:
+            java_input = out.location('Java Input')
+            loc = out.location(self.identifier.identifier)
+            out.emit('aload', java_input)
+            out.emit('invokestatic', out.name + '/readInt(Ljava/io/InputStream;)I')
+            out.emit('istore', loc)
+            return
+        java_scanner = out.location('Java Scanner')
+        loc = out.location(self.identifier.identifier)
+        out.emit('aload', java_scanner)
+        out.emit('invokevirtual', 'java/util/Scanner.nextInt()I')
+        out.emit('istore', loc)
 
-class Comparison_AST:
+class Comparison_AST(AST):
+    __slots__ = ('left', 'op', 'right')
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
-    def __repr__(self):
-        return repr(self.left) + self.op + repr(self.right)
-    def indented(self, level):
+    def text(self):
+        return (yield self.left.text()) + self.op + (yield self.right.text())
+    def tree(self, level):
         return indent(self.op, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def true_code(self, label):
-        op = { '<':'if_icmplt', '=':'if_icmpeq', '>':'if_icmpgt',
-               '<=':'if_icmple', '!=':'if_icmpne', '>=':'if_icmpge' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + ' ' + label + '\n'
-    def false_code(self, label):
-        # Invert operator to negate
-        op = { '<':'if_icmpge', '=':'if_icmpne', '>':'if_icmple',
-               '<=':'if_icmpgt', '!=':'if_icmpeq', '>=':'if_icmplt' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + ' ' + label + '\n'
-
-class BooleanExpression_AST:
+               (yield self.left.tree(level+1)) + \
+               (yield self.right.tree(level+1))
+    def children(self):
+        return (self.left, self.right)
+    def fold(self):
+        return Comparison_AST(self.left.fold(), self.op, self.right.fold())
+    def invariant(self, loop):
+        return Comparison_AST(loop.expression(self.left), self.op,
+                              loop.expression(self.right))
+    def constant(self):
+        '''Returns the value of a comparison of two numbers or None.'''
+        if isinstance(self.left, Number_AST) and isinstance(self.right, Number_AST):
+            left, right = int(self.left.number), int(self.right.number)
+            return { '<':left < right, '=':left == right, '>':left > right,
+                     '<=':left <= right, '!=':left != right,
+                     '>=':left >= right }[self.op]
+        return None
+    def write_jump(self, out, true, false):
+        '''Jumps to the true label when the comparison holds and to the
+           false label when it does not. Either label can be None to go
+           on to the next instruction instead, which needs one jump.'''
+        self.left.write(out)
+        self.right.write(out)
+        if true is None:
+            out.emit(jump[negation[self.op]], false)
+            return
+        out.emit(jump[self.op], true)
+        if false is not None:
+            out.emit('goto', false)
+
+class BooleanExpression_AST(AST):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
-    def __repr__(self):
-        return '(' + repr(self.left) + ' | ' + repr(self.right) + ')'
-    def indented(self, level):
+    def text(self):
+        return '(' + (yield self.left.text()) + ' | ' + \
+               (yield self.right.text()) + ')'
+    def tree(self, level):
         return indent('|', level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def false_code(self, l1):
-        l2 = label_generator.next()
-        return self.left.true_code(l2) + \
-               self.right.true_code(l2) + \
-               'goto ' + l1 + '\n' + \
-               l2 + ':\n'
-    def true_code(self, l1):
-        return self.left.true_code(l1) + \
-               self.right.true_code(l1)
-    
-class BooleanTerm_AST:
+               (yield self.left.tree(level+1)) + \
+               (yield self.right.tree(level+1))
+    def children(self):
+        return (self.left, self.right)
+    def fold(self):
+        left, right = (yield self.left.fold()), (yield self.right.fold())
+        # a true side makes it true and a false side can be left out
+        if constant(left) is not None:
+            return left if constant(left) else right
+        if constant(right) is False:
+            return left
+        if constant(right) and safe(left):
+            return right
+        return BooleanExpression_AST(left, right)
+    def invariant(self, loop):
+        return BooleanExpression_AST((yield self.left.invariant(loop)),
+                                     (yield self.right.invariant(loop)))
+    def write_jump(self, out, true, false):
+        # when the left side is true the right side is skipped
+        label = true or out.next_label()
+        yield self.left.write_jump(out, label, None)
+        yield self.right.write_jump(out, true, false)
+        if true is None:
+            out.label(label)
+
+class BooleanTerm_AST(AST):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
-    def __repr__(self):
-        return '(' + repr(self.left) + ' & ' + repr(self.right) + ')'
-    def indented(self, level):
+    def text(self):
+        return '(' + (yield self.left.text()) + ' & ' + \
+               (yield self.right.text()) + ')'
+    def tree(self, level):
         return indent('&', level) + \
-                self.left.indented(level+1) + \
-                self.right.indented(level+1)
-    def false_code(self, label):
-        return self.left.false_code(label) + \
-               self.right.false_code(label)
-    def true_code(self, l1):
-        l2 = label_generator.next()
-        return self.left.false_code(l2) + \
-               self.right.false_code(l2)  + \
-               'goto ' + l1 + '\n' + \
-               l2 + ':\n'
-    
-class BooleanFactor_AST:
+                (yield self.left.tree(level+1)) + \
+                (yield self.right.tree(level+1))
+    def children(self):
+        return (self.left, self.right)
+    def fold(self):
+        left, right = (yield self.left.fold()), (yield self.right.fold())
+        # a false side makes it false and a true side can be left out
+        if constant(left) is not None:
+            return right if constant(left) else left
+        if constant(right):
+            return left
+        if constant(right) is False and safe(left):
+            return right
+        return BooleanTerm_AST(left, right)
+    def invariant(self, loop):
+        return BooleanTerm_AST((yield self.left.invariant(loop)),
+                               (yield self.right.invariant(loop)))
+    def write_jump(self, out, true, false):
+        # when the left side is false the right side is skipped
+        label = false or out.next_label()
+        yield self.left.write_jump(out, None, label)
+        yield self.right.write_jump(out, true, false)
+        if false is None:
+            out.label(label)
+
+class BooleanFactor_AST(AST):
+    __slots__ = ('bool_',)
     def __init__(self, bool_):
         self.bool_ = bool_
-    def __repr__(self):
-        return '(' + '& ' + repr(self.bool_) + ')'
-    def indented(self, level):
-        return indent('&', level) + \
-                self.bool_.indented(level+1)
-    def true_code(self, label):
-        return self.bool_.false_code(label)
-    def false_code(self, label):
-        return self.bool_.true_code(label)
+    def text(self):
+        return '(nt ' + (yield self.bool_.text()) + ')'
+    def tree(self, level):
+        return indent('nt', level) + \
+                (yield self.bool_.tree(level+1))
+    def children(self):
+        return (self.bool_,)
+    def fold(self):
+        bool_ = yield self.bool_.fold()
+        if isinstance(bool_, Comparison_AST):
+            return Comparison_AST(bool_.left, negation[bool_.op], bool_.right)
+        if isinstance(bool_, BooleanFactor_AST):
+            return bool_.bool_
+        return BooleanFactor_AST(bool_)
+    def invariant(self, loop):
+        return BooleanFactor_AST((yield self.bool_.invariant(loop)))
+    def write_jump(self, out, true, false):
+        yield self.bool_.write_jump(out, false, true)
         
-class Expression_AST:
+class Expression_AST(AST):
+    __slots__ = ('left', 'op', 'right')
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
-    def __repr__(self):
-        return '(' + repr(self.left) + self.op + repr(self.right) + ')'
-    def indented(self, level):
+    def text(self):
+        return '(' + (yield self.left.text()) + self.op + \
+               (yield self.right.text()) + ')'
+    def tree(self, level):
         return indent(self.op, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def code(self):
+               (yield self.left.tree(level+1)) + \
+               (yield self.right.tree(level+1))
+    def children(self):
+        return (self.left, self.right)
+    def fold(self):
+        if not isinstance(self.left, Expression_AST) and \
+           not isinstance(self.right, Expression_AST):
+            return self.simplified(self.left, self.right)
+        # fold the operands of every operator below this one first, the
+        # operator waits on the stack as the method that combines them
+        folded = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Expression_AST):
+                stack.append(node.simplified)
+                stack.append(node.right)
+                stack.append(node.left)
+            elif isinstance(node, AST):
+                folded.append(node)
+            else:
+                right = folded.pop()
+                folded[-1] = node(folded[-1], right)
+        return folded[0]
+    def simplified(self, left, right):
+        '''Returns the operator applied to folded operands.'''
+        l, r = number(left), number(right)
+        if l is not None and r is not None and not (self.op == '/' and r == 0):
+            op = { '+':'iadd', '-':'isub', '*':'imul', '/':'idiv' }
+            return Number_AST(str(arithmetic[op[self.op]](l, r)))
+        # x+0, 0+x, x-0, x*1, 1*x and x/1 are x
+        if r == 0 and self.op in '+-' or r == 1 and self.op in '*/':
+            return left
+        if l == 0 and self.op == '+' or l == 1 and self.op == '*':
+            return right
+        # x*0 and 0*x are 0 unless x could fail
+        if self.op == '*' and (l == 0 and safe(right) or r == 0 and safe(left)):
+            return Number_AST('0')
+        # a constant multiplies from the right, where it can be a shift
+        if self.op == '*' and l is not None:
+            return Expression_AST(right, self.op, left)
+        return Expression_AST(left, self.op, right)
+    def write(self, out):
         op = { '+':'iadd', '-':'isub', '*':'imul', '/':'idiv' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + '\n'
+        if not isinstance(self.left, Expression_AST) and \
+           not isinstance(self.right, Expression_AST):
+            self.left.write(out)
+            self.right.write(out)
+            out.emit(op[self.op])
+            return
+        # operands are written before their operator, which waits on the
+        # stack as its opcode
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                out.emit(node)
+            elif isinstance(node, Expression_AST):
+                stack.append(op[node.op])
+                # the same operand twice is worked out once
+                stack.append('dup' if node.right is node.left and
+                             isinstance(node.left, Expression_AST) else
+                             node.right)
+                stack.append(node.left)
+            else:
+                node.write(out)
 
-class Number_AST:
+class Number_AST(AST):
+    __slots__ = ('number',)
     def __init__(self, number):
         self.number = number
-    def __repr__(self):
+    def text(self):
         return self.number
-    def indented(self, level):
+        yield
+    def tree(self, level):
         return indent(self.number, level)
-    def code(self): # works only for short numbers
-        return 'sipush ' + self.number + '\n'
+        yield
+    def fold(self):
+        return self
+    def write(self, out):
+        out.emit(*load_constant(int(self.number)))
 
-class Identifier_AST:
+class Identifier_AST(AST):
+    __slots__ = ('identifier',)
     def __init__(self, identifier):
         self.identifier = identifier
-    def __repr__(self):
+    def text(self):
         return self.identifier
-    def indented(self, level):
+        yield
+    def tree(self, level):
         return indent(self.identifier, level)
-    def code(self):
-        loc = symbol_table.location(self.identifier)
-        return 'iload ' + str(loc) + '\n'
-
-# These functions make the recursive-descent parser.
-
-def program():
-    sts = statements()
-    return Program_AST(sts)
-
-def statements():
-    result = [statement()]
-    while scanner.lookahead() == Token.SEM:
-        scanner.consume(Token.SEM)
-        st = statement()
-        result.append(st)
-    return Statements_AST(result)
-
-
-def statement():
-    if scanner.lookahead() == Token.IF:
-        return if_statement()
-    elif scanner.lookahead() == Token.WL:
-        return wl_statement()
-    elif scanner.lookahead() == Token.FR:
-        return fr_statement()
-    elif scanner.lookahead() == Token.ID:
-        return assignment()
-    elif scanner.lookahead() == Token.OT:
-        return ot_statement()
-    elif scanner.lookahead() == Token.IN:
-        return in_statement()    
-    else: # error
-        return scanner.consume(Token.IF, Token.FR, Token.WL, Token.ID, Token.IN,
-                               Token.OT)
-
-def if_statement():
-    scanner.consume(Token.IF)
-    condition = boolean_expression()
-    scanner.consume(Token.LCRL)
-    then = statements()
-    scanner.consume(Token.RCRL)
-    if scanner.lookahead() == Token.EL:
-        scanner.consume(Token.EL)
-        scanner.consume(Token.LCRL)
-        _else = statements()
-        scanner.consume(Token.RCRL)
-        return If_El_AST(condition, then, _else)
-    return If_AST(condition, then)
-
-def wl_statement():
-    scanner.consume(Token.WL)
-    condition = boolean_expression()
-    scanner.consume(Token.LCRL)
-    body = statements()
-    scanner.consume(Token.RCRL)
-    return Wl_AST(condition, body)
-
-def fr_statement():
-    scanner.consume(Token.FR)
-    ass = assignment()
-    scanner.consume(Token.LCRL)
-    body = statements()
-    scanner.consume(Token.RCRL)
-    return Fr_AST(ass, body)
-
-def ot_statement():
-    scanner.consume(Token.OT)
-    ex = expression()
-    return Ot_AST(ex)
-
-def in_statement():
-    scanner.consume(Token.IN)
-    _id = identifier()
-    return In_AST(_id)
-
-def assignment():
-    ident = identifier()
-    scanner.consume(Token.BEC)
-    expr = expression()
-    return Assign_AST(ident, expr)
-
-operator = { Token.LESS:'<', Token.EQ:'=', Token.GRTR:'>',
-             Token.LEQ:'<=', Token.NEQ:'!=', Token.GEQ:'>=',
-             Token.ADD:'+', Token.SUB:'-', Token.MUL:'*', Token.DIV:'/' }
-
-def comparison():
-    left = expression()
-    op = scanner.consume(Token.LESS, Token.EQ, Token.GRTR,
-                         Token.LEQ, Token.NEQ, Token.GEQ)
-    right = expression()
-    return Comparison_AST(left, operator[op], right)
-
-def boolean_factor():
-    if scanner.lookahead() == Token.NT:
-        not_ = scanner.consume(Token.NT)
-        bool_ = boolean_factor()
-        result = BooleanFactor_AST(bool_)
-    else:
-        result = comparison()
-    return result
+        yield
+    def fold(self):
+        return self
+    def write(self, out):
+        loc = out.location(self.identifier)
+        out.emit('iload', loc)
 
-def boolean_term():
-    result = boolean_factor()
-    while scanner.lookahead() == Token.AND:
-        scanner.consume(Token.AND)
-        right = boolean_factor()
-        result = BooleanTerm_AST(result, right)
-    return result
+class Call_AST(AST):
+    """Statements moved into a method of their own, name, which is called
+       where they were. used and written are the variables the statements
+       use and assign, including those of calls in them."""
+    __slots__ = ('name', 'body', 'used', 'written')
+    def __init__(self, name, body, used, written):
+        self.name = name
+        self.body = body
+        self.used = used
+        self.written = written
+    def text(self):
+        return self.name + ' { ' + (yield self.body.text()) + ' }'
+    def tree(self, level):
+        return indent('Call ' + self.name, level) + \
+               (yield self.body.tree(level+1))
+    def children(self):
+        return (self.body,)
+    def write(self, out):
+        # the method sees the variables of this one it uses in their
+        # fields and those it changes are loaded back from them
+        for identifier in sorted(self.used & out.shared):
+            if identifier not in java_objects:
+                out.publish(identifier)
+        out.emit('invokestatic', out.name + '/' + self.name + '()V')
+        for identifier in sorted(self.written & out.shared):
+            out.fetch(identifier)
 
-def boolean_expression():
-    result = boolean_term()
-    while scanner.lookahead() == Token.OR:
-        scanner.consume(Token.OR)
-        right = boolean_term()
-        result = BooleanExpression_AST(result, right)
+def table(entries):
+    '''Returns a list indexed by token kind with the values in entries
+       and None for every other kind, which the parser looks the next
+       token up in.'''
+    result = [None] * Token.COUNT
+    for kind, value in entries.items():
+        result[kind] = value
     return result
 
-def expression():
-    result = term()
-    while scanner.lookahead() in [Token.ADD, Token.SUB]:
-        op = scanner.consume(Token.ADD, Token.SUB)
-        tree = term()
-        result = Expression_AST(result, operator[op], tree)
-    return result
+# The operator of each comparison and arithmetic token
+comparison_operator = table({ Token.LESS:'<', Token.EQ:'=', Token.GRTR:'>',
+                              Token.LEQ:'<=', Token.NEQ:'!=',
+                              Token.GEQ:'>=' })
+arithmetic_operator = table({ Token.ADD:'+', Token.SUB:'-', Token.MUL:'*',
+                              Token.DIV:'/' })
 
-def term():
-    result = factor()
-    while scanner.lookahead() in [Token.MUL, Token.DIV]:
-        op = scanner.consume(Token.MUL, Token.DIV)
-        tree = factor()
-        result = Expression_AST(result, operator[op], tree)
-    return result
+# Binding strength of arithmetic operators
+precedence = { '+':1, '-':1, '*':2, '/':2 }
+
+# Binding strength of logical operators
+binding = { '|':1, '&':2, 'nt':3 }
+logical = table({ Token.AND:'&', Token.OR:'|' })
+comparisons = (Token.LESS, Token.EQ, Token.GRTR, Token.LEQ, Token.NEQ,
+               Token.GEQ)
+
+# Tokens that start an if, wl or fr block, and the tokens that can start
+# a condition before its first expression
+block_start = table({ Token.IF:True, Token.WL:True, Token.FR:True })
+condition_start = table({ Token.NT:'nt', Token.LPAR:'(' })
+
+def condition(node):
+    '''Returns whether a node is a condition rather than an expression.'''
+    return isinstance(node, (Comparison_AST, BooleanExpression_AST,
+                             BooleanTerm_AST, BooleanFactor_AST))
+
+class Parser:
+    '''The methods of a Parser make the recursive-descent parser. Nested
+       blocks, expressions and nt are kept on explicit stacks rather than
+       Python's, so nesting is only limited by memory.'''
+    def __init__(self, scanner):
+        self.scanner = scanner
+        # the node for each name and number seen so far
+        self.identifiers = {}
+        self.numbers = {}
+
+    def program(self):
+        sts = self.statements()
+        return Program_AST(sts)
+
+    def statements(self):
+        # if, wl and fr blocks that are still open, with the statements
+        # of the block around each one
+        blocks = []
+        result = []
+        while True:
+            if block_start[self.scanner.lookahead()]:
+                blocks.append((self.block_header(), result))
+                result = []
+                continue
+            result.append(self.statement())
+            # close every block that ends after this statement
+            while self.scanner.lookahead() != Token.SEM:
+                if not blocks:
+                    return Statements_AST(result)
+                self.scanner.expect(Token.RCRL)
+                header, outer = blocks.pop()
+                body = Statements_AST(result)
+                if header[0] == Token.IF and self.scanner.lookahead() == Token.EL:
+                    self.scanner.take()
+                    self.scanner.expect(Token.LCRL)
+                    blocks.append(((Token.EL, header[1], body), outer))
+                    result = []
+                    break
+                outer.append(self.block(header, body))
+                result = outer
+            else:
+                self.scanner.take()
+
+    def block_header(self):
+        '''Parses the start of an if, wl or fr statement up to its '{'.'''
+        token = self.scanner.take()
+        if token == Token.FR:
+            header = (token, self.assignment())
+        else:
+            header = (token, self.boolean_expression())
+        self.scanner.expect(Token.LCRL)
+        return header
+
+    def block(self, header, body):
+        '''Returns the statement for a block header and its statements.'''
+        if header[0] == Token.IF:
+            return If_AST(header[1], body)
+        elif header[0] == Token.EL:
+            return If_El_AST(header[1], header[2], body)
+        elif header[0] == Token.WL:
+            return Wl_AST(header[1], body)
+        else:
+            return Fr_AST(header[1], body)
+
+    def statement(self):
+        parse = self.statement_parsers[self.scanner.lookahead()]
+        if parse is None: # error
+            return self.scanner.consume(Token.IF, Token.FR, Token.WL, Token.ID,
+                                        Token.IN, Token.OT)
+        return parse(self)
+
+    def ot_statement(self):
+        self.scanner.take()
+        ex = self.expression()
+        return Ot_AST(ex)
+
+    def in_statement(self):
+        self.scanner.take()
+        _id = self.identifier()
+        return In_AST(_id)
+
+    def assignment(self):
+        ident = self.identifier()
+        self.scanner.expect(Token.BEC)
+        expr = self.expression()
+        return Assign_AST(ident, expr)
+
+    def boolean_expression(self):
+        # A '(' can start a condition, (a < b | c < d), or an expression in
+        # a comparison, (a + b) < c, which is only known after what it
+        # holds. Conditions are parsed with a stack of operands and one of
+        # nt, & and | and the '(' still open, expressions are parsed by
+        # expression, continuing from the parentheses when needed.
+        operands = []
+        operators = []
+        opened = 0
+        while True:
+            op = condition_start[self.scanner.lookahead()]
+            while op is not None:
+                self.scanner.take()
+                operators.append(op)
+                if op == '(':
+                    opened += 1
+                op = condition_start[self.scanner.lookahead()]
+            operands.append(self.expression())
+            while True:
+                token = self.scanner.lookahead()
+                op = comparison_operator[token]
+                if op and not condition(operands[-1]):
+                    self.scanner.take()
+                    operands.append(Comparison_AST(operands.pop(), op,
+                                                   self.expression()))
+                elif arithmetic_operator[token] and not condition(operands[-1]):
+                    # what the parentheses held goes on in an expression
+                    operands.append(self.expression(operands.pop()))
+                elif logical[token]:
+                    op = logical[token]
+                    while operators and operators[-1] != '(' and \
+                          binding[operators[-1]] >= binding[op]:
+                        self.reduce_condition(operands, operators)
+                    self.need_condition(operands[-1])
+                    self.scanner.take()
+                    operators.append(op)
+                    break
+                elif token == Token.RPAR and opened:
+                    while operators[-1] != '(':
+                        self.reduce_condition(operands, operators)
+                    self.scanner.take()
+                    operators.pop()
+                    opened -= 1
+                else:
+                    while operators and operators[-1] != '(':
+                        self.reduce_condition(operands, operators)
+                    if opened:
+                        self.scanner.expect(Token.RPAR)
+                    self.need_condition(operands[0])
+                    return operands[0]
+
+    def reduce_condition(self, operands, operators):
+        '''Replaces the top operand, or two for & and |, with the top
+           operator applied to them.'''
+        op = operators.pop()
+        right = operands.pop()
+        self.need_condition(right)
+        if op == 'nt':
+            operands.append(BooleanFactor_AST(right))
+        elif op == '&':
+            operands.append(BooleanTerm_AST(operands.pop(), right))
+        else:
+            operands.append(BooleanExpression_AST(operands.pop(), right))
+
+    def need_condition(self, node):
+        '''An expression where a condition should be needs a comparison
+           operator next, which is reported as a syntax error.'''
+        if not condition(node):
+            self.scanner.consume(*comparisons)
+
+    def expression(self, first=None):
+        # finished operands and the operators and '(' waiting for them,
+        # starting from first when it was parsed already
+        operands = []
+        operators = []
+        while True:
+            if first is not None:
+                operands.append(first)
+                first = None
+            else:
+                while self.scanner.lookahead() == Token.LPAR:
+                    self.scanner.take()
+                    operators.append('(')
+                operands.append(self.factor())
+            while True:
+                op = arithmetic_operator[self.scanner.lookahead()]
+                if op is not None:
+                    while operators and operators[-1] != '(' and \
+                          precedence[operators[-1]] >= precedence[op]:
+                        self.reduce(operands, operators)
+                    self.scanner.take()
+                    operators.append(op)
+                    break
+                while operators and operators[-1] != '(':
+                    self.reduce(operands, operators)
+                if not operators:
+                    return operands[0]
+                self.scanner.expect(Token.RPAR)
+                operators.pop()
+
+    def reduce(self, operands, operators):
+        '''Replaces the top two operands with the top operator applied to them.'''
+        right = operands.pop()
+        operands.append(Expression_AST(operands.pop(), operators.pop(), right))
 
-def factor():
-    if scanner.lookahead() == Token.LPAR:
-        scanner.consume(Token.LPAR)
-        result = expression()
-        scanner.consume(Token.RPAR)
+    def factor(self):
+        token = self.scanner.lookahead()
+        if token == Token.NUM:
+            value = self.scanner.take_value()
+            return self.leaf(self.numbers, Number_AST, value)
+        elif token == Token.ID:
+            value = self.scanner.take_value()
+            return self.leaf(self.identifiers, Identifier_AST, value)
+        else: # error
+            return self.scanner.consume(Token.LPAR, Token.NUM, Token.ID)
+
+    def identifier(self):
+        value = self.scanner.expect(Token.ID)
+        return self.leaf(self.identifiers, Identifier_AST, value)
+
+    def leaf(self, table, kind, value):
+        '''Returns the node for value from table, making it the first time.
+           Nodes are never changed once made, so every use of a name or
+           number can share one node and one interned string.'''
+        node = table.get(value)
+        if node is None:
+            node = table[value] = kind(sys.intern(value))
+        return node
+
+# The method that parses each kind of statement, by the token it starts with
+Parser.statement_parsers = table({ Token.ID:Parser.assignment,
+                                   Token.OT:Parser.ot_statement,
+                                   Token.IN:Parser.in_statement })
+
+def parse_program(scanner):
+    '''Parses a whole program, which must use up all of the input.'''
+    ast = Parser(scanner).program()
+    if scanner.lookahead() != Token.END:
+        raise TrailingInputError(repr(Token.names[scanner.lookahead()]))
+    return ast
+
+# Bytes of code a method can have before the splitter moves statements out
+# of it. HotSpot does not compile methods bigger than 8000 bytes.
+SPLIT_SIZE = 8000
+
+# Bytes of code each kind of node adds to the code of its children, about
+extra_size = { Identifier_AST:2, Expression_AST:1, Comparison_AST:3,
+               If_El_AST:3, Wl_AST:3, Fr_AST:8, In_AST:5, Ot_AST:9 }
+
+def accesses(body, buffered=False):
+    '''Returns the variables the statements in body use, those they assign
+       and the calls among them, leaving out what is in the calls. The
+       Java objects In and Ot need are used like variables.'''
+    used, written, calls = set(), set(), []
+    stack = [body]
+    while stack:
+        node = stack.pop()
+        kind = type(node)
+        if kind is Call_AST:
+            calls.append(node)
+            continue
+        if kind is Identifier_AST:
+            used.add(node.identifier)
+        elif kind is Assign_AST or kind is In_AST:
+            written.add(node.identifier.identifier)
+        if kind is In_AST:
+            used.add('Java Input' if buffered else 'Java Scanner')
+        elif kind is Ot_AST and buffered:
+            used.add('Java Writer')
+        stack.extend(node.children())
+    return used, written, calls
+
+class Method_Splitter:
+    '''Splits a program that is too big for one method. Runs of statements
+       are moved into methods of their own, called where they were, until
+       the statements left come to about limit bytes of code. A statement
+       bigger than that has its blocks split instead, so a loop that fits
+       stays whole in one method, where the JIT compiler can compile it.
+       Sizes are worked out from the tree, a little over what the code
+       will be.'''
+    def __init__(self, limit, buffered=False):
+        self.limit = limit
+        self.buffered = buffered
+        self.sizes = {}
+        self.calls = 0
+
+    def program(self, ast):
+        '''Returns the program with its statements split into methods.'''
+        for node in reversed(list(ast.nodes())):
+            self.sizes[node] = self.estimate(node)
+        statements = run(self.statements(ast.program.statements, frozenset()))
+        return Program_AST(Statements_AST(statements))
+
+    def estimate(self, node):
+        '''Returns the size of a node from the sizes of its children.'''
+        kind = type(node)
+        if kind is Number_AST:
+            ins = load_constant(int(node.number))
+            return 1 if len(ins) == 1 else 2 if ins[0] == 'bipush' else 3
+        size = sum(self.sizes[child] for child in node.children())
+        if kind is Expression_AST and node.op == '/' and \
+           isinstance(node.right, Number_AST):
+            # division by a power of two is shifts that round toward zero
+            return size + 11
+        if kind is Ot_AST and self.buffered:
+            return size + 5
+        return size + extra_size.get(kind, 0)
+
+    def statements(self, statements, context):
+        '''Returns a list of statements with enough of them moved into
+           methods. context is the variables of the conditions the
+           statements are inside, which calls may have to store and load.'''
+        sizes = self.sizes
+        if sum(sizes[st] for st in statements) <= self.limit:
+            return statements
+        result = []
+        for st in statements:
+            if sizes[st] > self.limit:
+                st = yield self.block(st, context)
+            result.append(st)
+        if sum(sizes[st] for st in result) <= self.limit:
+            return result
+        result = self.grouped(result, context)
+        # with very many methods the calls are split too
+        while sum(sizes[st] for st in result) > self.limit:
+            grouped = self.grouped(result, context)
+            if len(grouped) == len(result):
+                break
+            result = grouped
         return result
-    elif scanner.lookahead() == Token.NUM:
-        value = scanner.consume(Token.NUM)[1]
-        return Number_AST(value)
-    elif scanner.lookahead() == Token.ID:
-        return identifier()
-    else: # error
-        return scanner.consume(Token.LPAR, Token.NUM, Token.ID)
-
-def identifier():
-    value = scanner.consume(Token.ID)[1]
-    return Identifier_AST(value)
-
-# Initialise objects
-
-scanner = Scanner(sys.stdin)
-symbol_table = Symbol_Table()
-symbol_table.location('Java Scanner') # fix a location for the Java Scanner
-label_generator = Label()
-
-ast = program()
-if scanner.lookahead() != None:
-    print('syntax error: end of input expected but token ' +
-          repr(scanner.lookahead()) + ' found')
-    sys.exit()
-
-
-# Uncomment follwing lines to to test the parser
-# and display the syntax tree
-#
-# print(ast.indented(0), end='')
-# sys.exit()
 
-# Call the code generator.
-print(ast.code(), end='')
+    def block(self, st, context):
+        '''Returns a statement with the statements in its blocks split.'''
+        kind = type(st)
+        if kind is Fr_AST:
+            inner = context | accesses(st.assignment)[0]
+            st = Fr_AST(st.assignment, (yield self.body(st.body, inner)))
+        elif kind in (If_AST, If_El_AST, Wl_AST):
+            inner = context | accesses(st.condition)[0]
+            if kind is If_AST:
+                st = If_AST(st.condition, (yield self.body(st.then, inner)))
+            elif kind is If_El_AST:
+                st = If_El_AST(st.condition,
+                               (yield self.body(st.then, inner)),
+                               (yield self.body(st._else, inner)))
+            else:
+                st = Wl_AST(st.condition, (yield self.body(st.body, inner)))
+        else:
+            return st
+        self.sizes[st] = self.estimate(st)
+        return st
+
+    def body(self, block, context):
+        '''Returns a block with its statements split.'''
+        block = Statements_AST((yield self.statements(block.statements,
+                                                      context)))
+        self.sizes[block] = self.estimate(block)
+        return block
+
+    def grouped(self, statements, context):
+        '''Returns calls of runs of statements that fit in a method.'''
+        groups, size = [[]], 0
+        for st in statements:
+            if groups[-1] and size + self.sizes[st] > self.limit:
+                groups.append([])
+                size = 0
+            groups[-1].append(st)
+            size += self.sizes[st]
+        return [group[0] if len(group) == 1 and
+                isinstance(group[0], Call_AST) else self.call(group, context)
+                for group in groups]
+
+    def call(self, statements, context):
+        '''Returns a call of a new method made of statements.'''
+        body = Statements_AST(statements)
+        self.sizes[body] = self.estimate(body)
+        used, written, calls = accesses(body, self.buffered)
+        for call in calls:
+            used |= call.used
+            written |= call.written
+        self.calls += 1
+        call = Call_AST('part' + str(self.calls), body, used, written)
+        # the call, with a store before it and a load after it for each
+        # variable it shares with the method it is in
+        self.sizes[call] = 3 + 5 * len((used | written) & context)
+        return call
+
+class Compiler:
+    '''Compiles Sm programs to Jasmin assembly, or with class_file to the
+       bytes of a class file. Every program gets its own scanner, symbol
+       table and labels, so one Compiler can be used for any number of
+       programs. With a Compile_Cache programs that were compiled before
+       are not scanned or parsed again. With buffered the program reads
+       and writes through buffered streams, which is much faster for
+       programs with a lot of input or output. Each hook has a start and
+       an end method that are called around every phase of compiling, as
+       the Profiler in profiler.py does. When main would have more than
+       split bytes of code its statements are split into methods, 0
+       leaves every program in main.'''
+    def __init__(self, cache=None, optimise=True, class_file=False,
+                 name='Program', buffered=False, hooks=(), split=SPLIT_SIZE):
+        self.cache = cache
+        self.optimise = optimise
+        self.class_file = class_file
+        self.name = name
+        self.buffered = buffered
+        self.hooks = list(hooks)
+        self.split = split
+        # How often each peephole rule was used
+        self.stats = Counter()
+
+    def options(self):
+        '''Returns a string of the options that change the output.'''
+        options = [self.name]
+        if self.optimise:
+            options.append('optimise')
+        if self.class_file:
+            options.append('class')
+        if self.buffered:
+            options.append('buffered')
+        if self.split:
+            options.append('split ' + str(self.split))
+        return ' '.join(options)
+
+    def phase(self, name, function, *args):
+        '''Runs one phase of compiling, which is one of lex, parse,
+           optimise, codegen and write. Every hook is told when it starts
+           and is given what it returns.'''
+        for hook in self.hooks:
+            hook.start(name)
+        result = function(*args)
+        for hook in self.hooks:
+            hook.end(name, result)
+        return result
+
+    def parse(self, input_file):
+        '''Returns the syntax tree of the program read from input_file.
+           With hooks all of the input is scanned before parsing, so the
+           two are timed apart.'''
+        if self.hooks:
+            scanner = Scanner(None, lexed=self.phase('lex', lex, input_file))
+        else:
+            scanner = Scanner(input_file)
+        return self.phase('parse', parse_program, scanner)
+
+    def optimised(self, ast):
+        '''Returns the syntax tree after the optimisations that are on.'''
+        if self.optimise:
+            temps = Temporary()
+            ast = self.phase('optimise', lambda:
+                             Common_Subexpressions(temps).program(
+                             run(run(ast.fold()).hoist(temps))))
+        return ast
+
+    def generate(self, ast):
+        '''Returns the methods of the class for a syntax tree.'''
+        main = Method('main', '([Ljava/lang/String;)V')
+        parts = []
+        def write():
+            out = Code_Generator(main, self.name, self.buffered)
+            run(ast.write(out))
+            main.max_locals = out.symbol_table.size()
+            if self.split and classfile.code_size(main.code) > self.split:
+                main.code, main.handlers = [], []
+                program = Method_Splitter(self.split,
+                                          self.buffered).program(ast)
+                out = self.write_split(main, program, parts)
+            return out
+        out = self.phase('codegen', write)
+        def optimise():
+            for method in [main] + parts:
+                keep = [label for handler in method.handlers
+                        for label in handler]
+                method.code = peephole.optimise(method.code, self.stats, keep)
+                method.code, method.max_locals = slots.allocate(
+                    method.code, 0, method.handlers)
+                method.code = slots.short_forms(method.code)
+            return main
+        if self.optimise:
+            self.phase('optimise', optimise)
+        # main never reads its String[] argument but needs a slot for it
+        main.max_locals = max(main.max_locals, 1)
+        for method in [main] + parts:
+            method.max_stack = max_stack(method.code, method.handlers)
+        methods = [constructor(), main] + parts
+        if 'Java Input' in out.symbol_table.symbol_table:
+            methods.append(read_int())
+        return methods
+
+    def write_split(self, main, program, parts):
+        '''Writes main for a program split by Method_Splitter and adds a
+           method for each of its calls to parts. Returns the
+           Code_Generator of main. Each method keeps the variables it uses
+           in locals. Those another method uses too are shared through
+           static fields, loaded when the method starts and stored when it
+           returns if it assigned them. Main makes the Java objects and
+           stores them for the rest.'''
+        used, _, calls = accesses(program, self.buffered)
+        uses = Counter()
+        direct = {}
+        stack = calls
+        while stack:
+            call = stack.pop()
+            direct[call] = accesses(call.body, self.buffered)
+            uses.update(direct[call][0])
+            stack.extend(direct[call][2])
+        used |= {name for name in uses if name in java_objects}
+        uses.update(used)
+        shared = {name for name, count in uses.items() if count > 1}
+        out = Code_Generator(main, self.name, self.buffered)
+        out.shared = shared & used
+        for identifier in sorted(out.shared):
+            if identifier not in java_objects:
+                out.fetch(identifier)
+        run(program.write(out))
+        main.max_locals = out.symbol_table.size()
+        for call in sorted(direct, key=lambda call: int(call.name[4:])):
+            method = Method(call.name, '()V', 'private static')
+            part = Code_Generator(method, self.name, self.buffered)
+            used, written, _ = direct[call]
+            part.shared = shared & used
+            for identifier in sorted(part.shared):
+                part.fetch(identifier)
+            run(call.body.write(part))
+            for identifier in sorted(part.shared & written):
+                part.publish(identifier)
+            part.emit('return')
+            method.max_locals = part.symbol_table.size()
+            parts.append(method)
+        return out
+
+    def write(self, methods, output):
+        '''Writes the class to output, a binary stream for a class file
+           and a text stream for Jasmin.'''
+        if self.class_file:
+            classfile.write_class(output, self.name, methods)
+        else:
+            write_class(output, self.name, methods)
+
+    def compile(self, input_file, output):
+        '''Writes the class for input_file to the output stream. The input
+           is read in chunks as it is scanned, with the cache too, so its
+           text is never held whole. A file that can seek is hashed chunk
+           by chunk first and only read again to compile it when it is not
+           in the cache. Other input is hashed as the scanner reads it, as
+           the hash is only known at the end, so a program from a pipe that
+           is in the cache is still scanned and parsed, though not
+           optimised or generated again.'''
+        if self.cache is None:
+            ast = self.optimised(self.parse(input_file))
+            self.phase('write', self.write, self.generate(ast), output)
+            return
+        digest = self.cache.digest(self.options())
+        ast = None
+        if input_file.seekable():
+            start = input_file.tell()
+            chunk = input_file.read(CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk.encode())
+                chunk = input_file.read(CHUNK_SIZE)
+            path = self.cache.entry(digest)
+            code = self.cache.lookup(path)
+            input_file.seek(start)
+        else:
+            reader = Hashing_Reader(input_file, digest)
+            ast = self.parse(reader)
+            path = self.cache.entry(digest)
+            code = self.cache.lookup(path)
+        if code is None:
+            if ast is None:
+                ast = self.parse(input_file)
+            stream = io.BytesIO() if self.class_file else io.StringIO()
+            ast = self.optimised(ast)
+            self.phase('write', self.write, self.generate(ast), stream)
+            code = stream.getvalue()
+            # the cache holds bytes for both kinds of output
+            if not self.class_file:
+                code = code.encode()
+            self.cache.store(path, code)
+        output.write(code if self.class_file else code.decode())
+
+def compile_source(text, optimise=True, class_file=False, buffered=False,
+                   split=SPLIT_SIZE):
+    '''Returns the Jasmin assembly for the program in text, or the bytes
+       of a class file.'''
+    output = io.BytesIO() if class_file else io.StringIO()
+    Compiler(optimise=optimise, class_file=class_file, buffered=buffered,
+             split=split).compile(io.StringIO(text), output)
+    return output.getvalue()
+
+def class_name(path):
+    '''Returns the name of the class for the source file at path, its
+       file name without the extension and characters a class name can
+       not have.'''
+    name = os.path.splitext(os.path.basename(path))[0]
+    for c in '.;[':
+        name = name.replace(c, '_')
+    return name
+
+def compile_file(path, cache=None, optimise=True, class_file=False,
+                 buffered=False, hooks=(), split=SPLIT_SIZE):
+    '''Compiles the Sm program at path to a .j file next to it, or with
+       class_file to a class file named after it. Returns the path, the
+       seconds taken, an error message or None and whether the output
+       came from the cache.'''
+    start = time.perf_counter()
+    error = None
+    hits = cache.hits if cache else 0
+    try:
+        if class_file:
+            name = class_name(path)
+            output = io.BytesIO()
+            target = os.path.join(os.path.dirname(path), name + '.class')
+        else:
+            name = 'Program'
+            output = io.StringIO()
+            target = os.path.splitext(path)[0] + '.j'
+        with open(path) as input_file:
+            Compiler(cache, optimise, class_file, name, buffered,
+                     hooks, split).compile(input_file, output)
+        with open(target, 'wb' if class_file else 'w') as f:
+            f.write(output.getvalue())
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e).__name__, e)
+    cached = cache is not None and cache.hits > hits
+    return path, time.perf_counter() - start, error, cached
+
+def source_files(patterns):
+    '''Expands directories and glob patterns to a sorted list of files.
+       A directory stands for every .sm file below it.'''
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.sm')
+        paths.extend(glob.glob(pattern, recursive=True) or [pattern])
+    return sorted(set(paths))
+
+def compile_files(paths, jobs=None, cache=None, optimise=True,
+                  class_file=False, buffered=False, hooks=(),
+                  split=SPLIT_SIZE):
+    '''Compiles every file in paths, using a pool of jobs processes
+       (one per core by default). Yields the result of compile_file for
+       each path in order, an error in one file does not stop the rest.
+       Hooks only see this process, so with hooks there is no pool.'''
+    jobs = jobs or os.cpu_count() or 1
+    compile_one = partial(compile_file, cache=cache, optimise=optimise,
+                          class_file=class_file, buffered=buffered,
+                          hooks=hooks, split=split)
+    if jobs == 1 or len(paths) == 1 or hooks:
+        yield from map(compile_one, paths)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        yield from executor.map(compile_one, paths, chunksize=chunksize)
+
+def batch(patterns, jobs=None, cache=None, optimise=True, class_file=False,
+          buffered=False, hooks=(), split=SPLIT_SIZE):
+    '''Compiles many files and reports on each. Returns the number of
+       files that failed.'''
+    failed = hits = 0
+    start = time.perf_counter()
+    paths = source_files(patterns)
+    for path, seconds, error, cached in compile_files(paths, jobs, cache,
+                                                      optimise, class_file,
+                                                      buffered, hooks,
+                                                      split):
+        hits += cached
+        if error:
+            failed += 1
+            print('error {0:8.3f}s {1}: {2}'.format(seconds, path, error))
+        else:
+            print('ok    {0:8.3f}s {1}{2}'.format(seconds, path,
+                                                  ' (cached)' if cached else ''))
+    print('{0} compiled, {1} failed in {2:.3f}s'.format(
+          len(paths) - failed, failed, time.perf_counter() - start))
+    if cache:
+        print('cache: {0} hits, {1} misses'.format(hits, len(paths) - hits))
+    return failed
+
+def report(hooks, form):
+    '''Prints what the profiler among hooks measured on stderr, as text
+       or json.'''
+    for hook in hooks:
+        print(hook.json() if form == 'json' else hook.text(), end='',
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles an Sm program from stdin to Jasmin assembly '
+                    'on stdout, or many files to .j files next to them.')
+    parser.add_argument('files', nargs='*',
+                        help='source files, directories or glob patterns')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes for compiling files '
+                             '(default: one per core)')
+    parser.add_argument('--class', dest='class_file', action='store_true',
+                        help='write class files instead of Jasmin assembly, '
+                             'from stdin as Program.class on stdout and for '
+                             'files as a class named after each file')
+    parser.add_argument('--no-optimise', action='store_true',
+                        help='generate code without optimising it')
+    parser.add_argument('--buffered', action='store_true',
+                        help='read input and write output through buffered '
+                             'streams instead of a Scanner and System.out')
+    parser.add_argument('--split-size', type=int, default=SPLIT_SIZE,
+                        metavar='BYTES',
+                        help='move statements into methods of their own when '
+                             'main would have more than this many bytes of '
+                             'code, 0 never does (default: %(default)s, the '
+                             'largest method HotSpot compiles)')
+    parser.add_argument('--peephole-stats', action='store_true',
+                        help='report how often each peephole rule was used '
+                             'on stderr')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the time and memory of each phase and '
+                             'counts of tokens, nodes, labels and locals on '
+                             'stderr, compiling without the cache in one '
+                             'process')
+    parser.add_argument('--profile-format', choices=['text', 'json'],
+                        default='text', help='format of the --profile report')
+    parser.add_argument('--profile-nodes', action='store_true',
+                        help='with --profile, also time code generation for '
+                             'each kind of node')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always compile, ignoring the compile cache')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='directory of the compile cache '
+                             '(default: $SM_CACHE_DIR or ~/.cache/sm)')
+    parser.add_argument('--cache-size', type=float, default=64,
+                        help='size limit of the compile cache in MB')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='report cache hits and misses on stderr')
+    args = parser.parse_args()
+    cache = None
+    if not args.no_cache and not args.profile:
+        cache = Compile_Cache(args.cache_dir, int(args.cache_size * 2**20))
+    hooks = []
+    if args.profile:
+        # imported here as the profiler imports this module
+        from profiler import Profiler
+        hooks.append(Profiler(nodes=args.profile_nodes))
+    if args.files:
+        failed = batch(args.files, args.jobs, cache, not args.no_optimise,
+                       args.class_file, args.buffered, hooks, args.split_size)
+        report(hooks, args.profile_format)
+        sys.exit(1 if failed else 0)
+    compiler = Compiler(cache, not args.no_optimise, args.class_file,
+                        buffered=args.buffered, hooks=hooks,
+                        split=args.split_size)
+    try:
+        if args.class_file:
+            compiler.compile(sys.stdin, sys.stdout.buffer)
+        else:
+            compiler.compile(sys.stdin, sys.stdout)
+    except TrailingInputError as e:
+        print('syntax error: ' + str(e))
+        sys.exit()
+    if args.peephole_stats:
+        for rule, hits in sorted(compiler.stats.items()):
+            print('peephole: {0:<14} {1}'.format(rule, hits), file=sys.stderr)
+    if cache and args.cache_stats:
+        print(cache.stats(), file=sys.stderr)
+    report(hooks, args.profile_format)
+
+    # To test the parser and display the syntax tree instead use
+    #
+    # print(Compiler().parse(sys.stdin).indented(0), end='')
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Peephole optimiser for lists of Jasmin instructions
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+from collections import Counter
+from jasmin import LABEL, constant_value, inverse_jump, jumps, \
+                   load_constant, unconditional
+
+# Comparisons with zero that replace a comparison of two ints
+zero_jump = { 'if_icmpeq':'ifeq', 'if_icmpne':'ifne', 'if_icmplt':'iflt',
+              'if_icmpge':'ifge', 'if_icmpgt':'ifgt', 'if_icmple':'ifle' }
+
+def optimise(code, stats=None, keep=()):
+    '''Returns the instructions in code with every rule applied until
+       none of them matches. Each time a rule is used it is counted in
+       the stats Counter. The labels in keep, such as those of exception
+       handlers, stay and the code after them is reachable.'''
+    if stats is None:
+        stats = Counter()
+    while True:
+        hits = sum(stats.values())
+        code = increments(code, stats)
+        code = local_rules(code, stats)
+        code = thread_jumps(code, stats)
+        code = remove_unreachable(code, stats, keep)
+        code = remove_unused_labels(code, stats, keep)
+        if sum(stats.values()) == hits:
+            return code
+
+def increments(code, stats):
+    '''iload n, k, iadd, istore n (and the same with k first or with
+       isub) become iinc n k when k fits in a byte.'''
+    result = []
+    i = 0
+    while i < len(code):
+        window = code[i:i+4]
+        if len(window) == 4 and window[3][0] == 'istore' and \
+           window[2][0] in ('iadd', 'isub'):
+            load, k = window[0], constant_value(window[1])
+            if window[2][0] == 'iadd' and k is None:
+                load, k = window[1], constant_value(window[0])
+            if k is not None and window[2][0] == 'isub':
+                k = -k
+            if k is not None and -128 <= k < 128 and \
+               load == ('iload', window[3][1]):
+                result.append(('iinc', window[3][1], k))
+                stats['iinc'] += 1
+                i += 4
+                continue
+        result.append(code[i])
+        i += 1
+    return result
+
+def power_of_two(value):
+    '''Returns k when value is 2**k for k from 1 to 30, otherwise None.'''
+    if value is not None and value > 1 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+def divide(k):
+    '''Returns the instructions that divide an int by 2**k rounding
+       toward zero like idiv. A negative int has 2**k - 1 added first,
+       which is its sign spread over all 32 bits shifted right without
+       sign by 32 - k.'''
+    return [('dup',), ('bipush', 31), ('ishr',), load_constant(32 - k),
+            ('iushr',), ('iadd',), load_constant(k), ('ishr',)]
+
+def local_rules(code, stats):
+    '''Rules that look at neighbouring instructions:
+         istore n, iload n        becomes dup, istore n
+         iconst_0, if_icmp<c> l   becomes if<c> l
+         if<c> l1, goto l2, l1:   becomes if<not c> l2, l1:
+         goto l, l:               becomes l:
+         2**k, imul               becomes k, ishl
+         2**k, idiv               becomes a shift that rounds toward zero
+         getstatic f, dup, istore n, putstatic f
+                                  becomes getstatic f, istore n'''
+    result = []
+    i = 0
+    while i < len(code):
+        ins = code[i]
+        following = code[i+1] if i+1 < len(code) else (None,)
+        if ins[0] == 'istore' and following == ('iload', ins[1]):
+            result.append(('dup',))
+            result.append(ins)
+            stats['store-load'] += 1
+            i += 2
+            continue
+        if constant_value(ins) == 0 and following[0] in zero_jump:
+            result.append((zero_jump[following[0]], following[1]))
+            stats['compare-zero'] += 1
+            i += 2
+            continue
+        if ins[0] in inverse_jump and following[0] == 'goto' and \
+           ins[1] in labels_at(code, i+2):
+            result.append((inverse_jump[ins[0]], following[1]))
+            stats['invert-jump'] += 1
+            i += 2
+            continue
+        if ins[0] == 'goto' and ins[1] in labels_at(code, i+1):
+            stats['jump-to-next'] += 1
+            i += 1
+            continue
+        if ins[0] == 'getstatic' and following == ('dup',) and \
+           code[i+2:i+4] == [code[i+2], ('putstatic',) + ins[1:]] and \
+           code[i+2][0] in ('istore', 'astore'):
+            # the field is stored back unchanged
+            result.append(ins)
+            result.append(code[i+2])
+            stats['field-unchanged'] += 1
+            i += 4
+            continue
+        k = following[0] in ('imul', 'idiv') and \
+            power_of_two(constant_value(ins))
+        if k and following[0] == 'imul':
+            result.append(load_constant(k))
+            result.append(('ishl',))
+            stats['shift-multiply'] += 1
+            i += 2
+            continue
+        if k:
+            result.extend(divide(k))
+            stats['shift-divide'] += 1
+            i += 2
+            continue
+        result.append(ins)
+        i += 1
+    return result
+
+def labels_at(code, i):
+    '''Returns the labels that start at index i of code.'''
+    labels = set()
+    while i < len(code) and code[i][0] == LABEL:
+        labels.add(code[i][1])
+        i += 1
+    return labels
+
+def thread_jumps(code, stats):
+    '''A jump to a goto jumps straight to where the goto goes.'''
+    # first instruction after each label
+    target = {}
+    following = (None,)
+    for ins in reversed(code):
+        if ins[0] == LABEL:
+            target[ins[1]] = following
+        else:
+            following = ins
+    # where a jump to each label ends up, worked out once for every label
+    # on a chain of gotos so long chains take linear time
+    final = {}
+    for label in target:
+        path, seen = [], set()
+        while label not in final and label not in seen:
+            path.append(label)
+            seen.add(label)
+            if target[label][0] != 'goto':
+                break
+            label = target[label][1]
+        end = final.get(label, label)
+        for label in path:
+            final[label] = end
+    result = []
+    for ins in code:
+        if ins[0] in jumps and final[ins[1]] != ins[1]:
+            ins = (ins[0], final[ins[1]])
+            stats['thread-jump'] += 1
+        result.append(ins)
+    return result
+
+def remove_unreachable(code, stats, keep=()):
+    '''Removes instructions after a goto or return that no jump reaches.'''
+    used = {ins[1] for ins in code if ins[0] in jumps} | set(keep)
+    result = []
+    reachable = True
+    for ins in code:
+        if ins[0] == LABEL and ins[1] in used:
+            reachable = True
+        if reachable:
+            result.append(ins)
+        elif ins[0] == LABEL:
+            stats['unused-label'] += 1
+        else:
+            stats['unreachable'] += 1
+        if ins[0] in unconditional:
+            reachable = False
+    return result
+
+def remove_unused_labels(code, stats, keep=()):
+    '''Removes labels that no jump goes to.'''
+    used = {ins[1] for ins in code if ins[0] in jumps} | set(keep)
+    result = []
+    for ins in code:
+        if ins[0] == LABEL and ins[1] not in used:
+            stats['unused-label'] += 1
+        else:
+            result.append(ins)
+    return result
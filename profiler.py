@@ -0,0 +1,198 @@
+"""
+Time and memory taken by each phase of compiling, with counts of what
+each phase made
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import json
+import time
+import tracemalloc
+from collections import Counter
+from types import GeneratorType
+from jasmin import Method
+from tokens import Token
+
+# Phases in the order the compiler runs them
+PHASES = ['lex', 'parse', 'optimise', 'codegen', 'write']
+
+def node_classes(base):
+    '''Returns every kind of syntax tree node below the class base with
+       its own write or write_jump method.'''
+    classes, stack = [], [base]
+    while stack:
+        cls = stack.pop()
+        stack.extend(cls.__subclasses__())
+        if 'write' in vars(cls) or 'write_jump' in vars(cls):
+            classes.append(cls)
+    return classes
+
+class Profiler:
+    '''A hook for Compiler that measures each phase of compiling: the
+       wall time, the bytes allocated and still held after it and the
+       most held at once during it. It also counts the tokens, the nodes
+       of the syntax tree, the labels and the locals. Any number of
+       programs can be compiled, the counts add up. With memory, timings
+       include the cost of tracing every allocation. With nodes, the time
+       spent writing each kind of node is measured too, which slows code
+       generation down a lot.'''
+    def __init__(self, memory=True, nodes=False):
+        self.memory = memory
+        self.nodes = nodes
+        self.programs = 0
+        self.seconds = Counter()
+        self.allocated = Counter()
+        self.peak = Counter()
+        self.tokens = Counter()
+        self.tree = Counter()
+        self.labels = 0
+        self.locals = 0
+        self.slots = 0
+        self.program_locals = 0
+        self.node_seconds = Counter()
+        # the base class of the nodes of the last tree parsed
+        self.node_base = None
+        # original write methods while nodes are being timed
+        self.patched = []
+        self.started = None
+        self.before = 0
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, phase):
+        if phase == 'codegen' and self.nodes:
+            self.time_nodes()
+        if self.memory:
+            tracemalloc.reset_peak()
+            self.before = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+
+    def end(self, phase, result):
+        self.seconds[phase] += time.perf_counter() - self.started
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocated[phase] += current - self.before
+            self.peak[phase] = max(self.peak[phase], peak - self.before)
+        if phase == 'codegen' and self.nodes:
+            self.restore_nodes()
+        if phase == 'lex':
+            self.programs += 1
+            kinds = Counter()
+            for batch in result:
+                kinds.update(batch[0])
+            self.tokens.update({Token.names[kind]: count for kind, count
+                                in kinds.items() if kind != Token.END})
+        elif phase == 'parse':
+            self.tree.update(type(node).__name__ for node in result.nodes())
+            self.node_base = type(result).__mro__[-2]
+        elif phase == 'codegen':
+            self.labels += result.label_generator.current_label
+            self.locals += result.symbol_table.size()
+            self.slots += result.symbol_table.size()
+            self.program_locals = result.symbol_table.size()
+        elif phase == 'optimise' and isinstance(result, Method):
+            # locals that share a slot need fewer slots than locals
+            self.slots += result.max_locals - self.program_locals
+
+    def time_nodes(self):
+        '''Replaces the write methods of every kind of node with ones that
+           time them. A node's time leaves out the nodes written inside
+           it. Methods that are generators are timed each time they run
+           until they yield.'''
+        inside = []
+        def timed(name, write):
+            def step(function, *args):
+                inside.append(0.0)
+                start = time.perf_counter()
+                try:
+                    return function(*args)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.node_seconds[name] += elapsed - inside.pop()
+                    if inside:
+                        inside[-1] += elapsed
+            def generator(task):
+                value = None
+                while True:
+                    try:
+                        child = step(task.send, value)
+                    except StopIteration as stop:
+                        return stop.value
+                    value = yield child
+            def wrapper(*args):
+                result = step(write, *args)
+                if type(result) is GeneratorType:
+                    return generator(result)
+                return result
+            return wrapper
+        for cls in node_classes(self.node_base):
+            for method in ('write', 'write_jump'):
+                if method in vars(cls):
+                    write = vars(cls)[method]
+                    self.patched.append((cls, method, write))
+                    setattr(cls, method, timed(cls.__name__, write))
+
+    def restore_nodes(self):
+        '''Puts back the write methods time_nodes replaced.'''
+        for cls, method, write in self.patched:
+            setattr(cls, method, write)
+        self.patched = []
+
+    def results(self):
+        '''Returns everything measured as a dictionary.'''
+        phases = [phase for phase in PHASES if phase in self.seconds]
+        result = {
+            'programs': self.programs,
+            'phases': {phase: {'seconds': self.seconds[phase]}
+                       for phase in phases},
+            'seconds': sum(self.seconds.values()),
+            'tokens': sum(self.tokens.values()),
+            'tokens by kind': dict(self.tokens.most_common()),
+            'nodes': sum(self.tree.values()),
+            'nodes by class': dict(self.tree.most_common()),
+            'labels': self.labels,
+            'locals': self.locals,
+            'slots': self.slots,
+        }
+        if self.memory:
+            for phase in phases:
+                result['phases'][phase]['allocated'] = self.allocated[phase]
+                result['phases'][phase]['peak'] = self.peak[phase]
+        if self.nodes:
+            result['codegen seconds by class'] = \
+                dict(self.node_seconds.most_common())
+        return result
+
+    def json(self):
+        '''Returns the results as JSON.'''
+        return json.dumps(self.results(), indent=2)
+
+    def text(self):
+        '''Returns the results as a table that is easy to read.'''
+        results = self.results()
+        lines = ['{0:<10} {1:>10} {2:>14} {3:>12}'.format(
+                 'phase', 'seconds', 'allocated kB', 'peak kB')]
+        for phase, measured in results['phases'].items():
+            if self.memory:
+                memory = '{0:>14.1f} {1:>12.1f}'.format(
+                         measured['allocated'] / 1024, measured['peak'] / 1024)
+            else:
+                memory = '{0:>14} {1:>12}'.format('-', '-')
+            lines.append('{0:<10} {1:>10.4f} {2}'.format(
+                         phase, measured['seconds'], memory))
+        lines.append('{0:<10} {1:>10.4f}'.format('total', results['seconds']))
+        lines.append('programs {0}, tokens {1}, nodes {2}, labels {3}, '
+                     'locals {4}, slots {5}'.format(
+                     results['programs'], results['tokens'], results['nodes'],
+                     results['labels'], results['locals'], results['slots']))
+        lines.append('tokens: ' + ', '.join(
+                     '{0} {1}'.format(kind, count) for kind, count
+                     in results['tokens by kind'].items()))
+        lines.append('nodes: ' + ', '.join(
+                     '{0} {1}'.format(name, count) for name, count
+                     in results['nodes by class'].items()))
+        if self.nodes:
+            lines.append('codegen by node:')
+            for name, seconds in results['codegen seconds by class'].items():
+                lines.append('  {0:<16} {1:>10.4f}'.format(name, seconds))
+        return '\n'.join(lines) + '\n'
@@ -6,74 +6,178 @@ __author__ = "Campbell Mercer-Butcher"
 
 import re
 import sys
-from token import Token
+from array import array
+from tokens import Token
+
+def master_pattern(token_regexp):
+    '''Combines the token regular expressions into one pattern.
+       Reserved words are looked up after matching an identifier and the
+       other patterns are tried longest first, so the longest match still
+       wins ('<=' beats '<' and 'if' beats the identifier 'i'). Returns
+       the pattern, the token of each reserved word and the token each
+       group of the pattern matches, by the group's number.'''
+    keywords = {r: t for (t, r) in token_regexp if re.fullmatch('[a-z]+', r)}
+    others = [(t, r) for (t, r) in token_regexp if r not in keywords]
+    others.sort(key=lambda tr: -len(re.sub(r'\\(.)', r'\1', tr[1])))
+    groups = '|'.join('(?P<{0}>{1})'.format(Token.names[t], r)
+                      for (t, r) in others)
+    kinds = [None] + [t for (t, r) in others]
+    return re.compile('[ \t\n]*(?:' + groups + ')?'), keywords, kinds
+
+# Number of characters read from the input at a time
+CHUNK_SIZE = 1 << 16
+
+def position(buffer, index, line, line_start):
+    '''Returns the line and column of index in buffer, which starts on
+       line with that line starting at index line_start.'''
+    newlines = buffer.count('\n', 0, index)
+    if newlines:
+        line_start = buffer.rindex('\n', 0, index) + 1
+    return line + newlines, index - line_start + 1
+
+def tokens(input_file, chunk_size=CHUNK_SIZE):
+    '''Generates the tokens of input_file in batches, reading it
+       chunk_size characters at a time. A batch is an array of the kind of
+       each token, a list of the lexemes of the identifiers and numbers
+       among them, interned, and the error that stopped the scan after
+       them or None. The last batch ends with Token.END. Lines are only
+       counted when there is an error to report.'''
+    match_at = Scanner.pattern.match
+    group_kinds = Scanner.group_kinds
+    keywords = Scanner.keywords
+    intern = sys.intern
+    ID, NUM = Token.ID, Token.NUM
+    kinds, values = array('B'), []
+    buffer, index, eof = '', 0, False
+    # line number the buffer starts on and the index in the buffer where
+    # that line starts, which is negative when it started before
+    line, line_start = 1, 0
+    while True:
+        match = match_at(buffer, index)
+        group, end = match.lastindex, match.end()
+        # a match that touches the end of the buffer may continue in the
+        # next chunk, as may an unmatched character such as a lone '!'
+        if not eof and (end == len(buffer) or group is None and end+1 >= len(buffer)):
+            if kinds:
+                yield kinds, values, None
+                kinds, values = array('B'), []
+            chunk = input_file.read(chunk_size)
+            eof = not chunk
+            # only the unconsumed part of the buffer is kept
+            newlines = buffer.count('\n', 0, index)
+            if newlines:
+                line += newlines
+                line_start = buffer.rindex('\n', 0, index) + 1
+            buffer, line_start = buffer[index:] + chunk, line_start - index
+            index = 0
+            continue
+        if group is None:
+            if end+1 < len(buffer):
+                yield kinds, values, LexicalError(
+                      buffer[end:], *position(buffer, end, line, line_start))
+                return
+            kinds.append(Token.END)
+            yield kinds, values, None
+            return
+        kind = group_kinds[group]
+        if kind == ID:
+            lexeme = match.group(group)
+            kind = keywords.get(lexeme, ID)
+            if kind == ID:
+                values.append(intern(lexeme))
+        elif kind == NUM:
+            lexeme = match.group(group)
+            if len(lexeme) > 9 and int(lexeme) >= 2**31:
+                yield kinds, values, IntegerError(
+                      lexeme, *position(buffer, match.start(group), line,
+                                        line_start))
+                return
+            values.append(lexeme)
+        kinds.append(kind)
+        index = end
+
+def lex(input_file, chunk_size=CHUNK_SIZE):
+    '''Scans all of input_file at once. Returns the list of batches of
+       tokens, which a Scanner can be given instead of a file. An error
+       is raised at the same point when the tokens are parsed.'''
+    return list(tokens(input_file, chunk_size))
 
 class Scanner:
-    '''Matches tokens through out provided file'''
-
-    def __init__(self, input_file):
-        '''Reads the whole input_file'''
-        # source code
-        self.input_string = input_file.read()
-        # Current index in source
-        self.current_char_index = 0
-        # Most recently matched token and sub string
-        self.current_token = self.get_token()
-
-    def skip_white_space(self):
-        '''Consumes all characters in input_string up to the next
-           non-white-space character.'''
-        try:
-            #loop till there is no more white spaces
-            while True:
-                if self.input_string[self.current_char_index] in [' ','\t','\n']:
-                    self.current_char_index += 1
-                else:
-                    break
-        except:
-            pass
-
-    def no_token(self):
-        '''Raise error if the input cannot be matched to a token.'''
-        raise LexicalError(self.input_string[self.current_char_index:])
-        
-
-    def get_token(self):
-        '''Returns the next token and the part of input_string it matched.'''
-        self.skip_white_space()
-        # find the longest prefix of input_string that matches a token
-        token, longest = None, ''
-        for (t, r) in Token.token_regexp:
-            match = re.match(r, self.input_string[self.current_char_index:])
-            if match and match.end() > len(longest):
-                token, longest = t, match.group()
-                
-        if token == None and self.current_char_index+1 < len(self.input_string):
-            self.no_token()
-        # consume the token by moving the index to the end of the matched part
-        self.current_char_index += len(longest)
-        return (token, longest)
+    '''Matches tokens through out provided file. The parser looks at the
+       kind of the next token and indexes tables with it, then takes it.'''
+
+    # Single pattern for all tokens, reserved word lookup table and the
+    # token of each group of the pattern
+    pattern, keywords, group_kinds = master_pattern(Token.token_regexp)
+
+    def __init__(self, input_file, chunk_size=CHUNK_SIZE, lexed=None):
+        '''Streams tokens from input_file as they are needed, or takes
+           them from lexed, the batches lex already found'''
+        if lexed is None:
+            self.batches = tokens(input_file, chunk_size)
+        else:
+            self.batches = iter(lexed)
+        # the kinds and values of the batch of tokens being parsed, the
+        # index in kinds of the next token and in values of the next
+        # identifier or number
+        self.kinds, self.values, self.error = array('B'), [], None
+        self.index = self.value = 0
+        self.next_batch()
+
+    def next_batch(self):
+        '''Moves on to the next batch once every token of this one has
+           been taken, raising the error that ended this one if any.'''
+        while self.index == len(self.kinds):
+            if self.error is not None:
+                raise self.error
+            self.kinds, self.values, self.error = next(self.batches)
+            self.index = self.value = 0
 
     def lookahead(self):
-        '''Returns the next token without consuming it'''
-        return self.current_token[0]
+        '''Returns the kind of the next token without consuming it'''
+        return self.kinds[self.index]
+
+    def take(self):
+        '''Consumes the next token, which the parser has already checked,
+           and returns its kind.'''
+        kind = self.kinds[self.index]
+        self.index += 1
+        if self.index == len(self.kinds):
+            self.next_batch()
+        return kind
+
+    def take_value(self):
+        '''Consumes the next token, an identifier or number the parser has
+           already checked, and returns its lexeme.'''
+        value = self.values[self.value]
+        self.value += 1
+        self.take()
+        return value
+
+    def expect(self, kind):
+        '''Consumes the next token, which must be kind. Returns the
+           lexeme of an identifier or number, otherwise the kind.'''
+        if self.kinds[self.index] != kind:
+            self.unexpected_token(self.kinds[self.index], (kind,))
+        if kind == Token.ID or kind == Token.NUM:
+            return self.take_value()
+        return self.take()
 
     def unexpected_token(self, found_token, expected_tokens):
         '''Stop execution because an unexpected token was found'''
-        raise SyntaxError(repr(sorted(expected_tokens)), repr(found_token))
+        raise SyntaxError(repr(sorted(Token.names[t] for t in expected_tokens)),
+                          repr(Token.names[found_token]))
 
     def consume(self, *expected_tokens):
-        '''Returns the next token and consumes it'''
+        '''Returns the next token and consumes it, with its lexeme for an
+           identifier or number'''
         #if token isnt in the expected tokens raise an error
-        if self.current_token[0] in expected_tokens:
-            old_token = self.current_token
-            self.current_token = self.get_token()
-            if old_token[0] in [Token.NUM, Token.ID]:
-                return old_token[0], old_token[1]
-            else:
-                return old_token[0]
-        else:
-            self.unexpected_token(self.current_token[0],expected_tokens)
+        kind = self.kinds[self.index]
+        if kind not in expected_tokens:
+            self.unexpected_token(kind, expected_tokens)
+        if kind == Token.ID or kind == Token.NUM:
+            return kind, self.take_value()
+        return self.take()
 
 class ScannerError(Exception):
     """Base exception for errors raised by Scanner"""
@@ -84,8 +188,17 @@ class ScannerError(Exception):
 
 class LexicalError(ScannerError):
     """Token cant be matched"""
-    def __init__(self, token):
+    def __init__(self, token, line=None, col=None):
         msg = "No token found at the start of {0}".format(token)
+        if line is not None:
+            msg += " (line {0}, column {1})".format(line, col)
+        super().__init__(msg)
+
+class IntegerError(ScannerError):
+    """Number too large for an int"""
+    def __init__(self, number, line, col):
+        msg = "Integer {0} is too large (line {1}, column {2})".format(
+              number, line, col)
         super().__init__(msg)
 
 class SyntaxError(ScannerError):
@@ -94,6 +207,12 @@ class SyntaxError(ScannerError):
         msg = "token in {0} expected but {1} found".format(expected, found)
         super().__init__(msg)
 
+class TrailingInputError(ScannerError):
+    """Tokens left after the end of the program"""
+    def __init__(self, found):
+        msg = "end of input expected but token {0} found".format(found)
+        super().__init__(msg)
+
 
 #Test Code
 
@@ -104,12 +223,12 @@ class SyntaxError(ScannerError):
 # # Show all tokens in the input.
 
 # token = scanner.lookahead()
-# while token != None:
+# while token != Token.END:
 #     if token in [Token.NUM, Token.ID]:
 #         token, value = scanner.consume(token)
-#         print(token, value)
+#         print(Token.names[token], value)
 #     else:
-#         print(scanner.consume(token))
+#         print(Token.names[scanner.consume(token)])
 #     token = scanner.lookahead()
     
 
@@ -0,0 +1,236 @@
+"""
+Compile server that keeps the compiler loaded and compiles the programs
+clients send it over a Unix domain socket
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cache import CACHE_DIR, Compile_Cache
+from client import SOCKET
+from parser_code_generator import SPLIT_SIZE, Compiler
+
+# Seconds a request may take, from connecting to the reply
+TIMEOUT = 10.0
+# Latencies kept for the percentiles in the stats
+LATENCIES = 10000
+
+# The compile cache of a worker process, made when it starts
+worker_cache = None
+
+def start_worker(cache_dir, cache_size):
+    '''Sets up a worker process, with its own compile cache unless
+       cache_dir is None.'''
+    global worker_cache
+    if cache_dir is not None:
+        worker_cache = Compile_Cache(cache_dir, cache_size)
+
+def compile_request(source, options):
+    '''Compiles source with the options of a request in a worker process.
+       Returns the output as bytes and None, or None and the name and
+       message of the error that stopped it, as not every error survives
+       being sent back from the worker.'''
+    class_file = options.get('class', False)
+    compiler = Compiler(worker_cache, options.get('optimise', True),
+                        class_file, buffered=options.get('buffered', False),
+                        split=options.get('split', SPLIT_SIZE))
+    output = io.BytesIO() if class_file else io.StringIO()
+    try:
+        compiler.compile(io.StringIO(source), output)
+    except Exception as e:
+        return None, (type(e).__name__, str(e))
+    output = output.getvalue()
+    return (output if class_file else output.encode()), None
+
+def percentile(values, p):
+    '''Returns the value p percent of the way through values, the
+       nearest rank, or None when there are none.'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+class Compile_Server:
+    '''Compiles programs sent to a Unix domain socket at path. The
+       compiler is imported once and compiles in a pool of jobs worker
+       processes (one per core by default), so a request pays for none of
+       the startup of a new Python. Each connection is one request, see
+       client.request. At most concurrency programs are compiling or
+       waiting for a worker at once, the rest wait to be read. A request
+       that is not answered within timeout seconds gets a TimeoutError,
+       though a program still compiling carries on in its worker.'''
+    def __init__(self, path=SOCKET, jobs=None, concurrency=None,
+                 timeout=TIMEOUT, cache_dir=CACHE_DIR,
+                 cache_size=64 * 2**20):
+        self.path = path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.concurrency = concurrency or 2 * self.jobs
+        self.timeout = timeout
+        self.pool = ProcessPoolExecutor(self.jobs, initializer=start_worker,
+                                        initargs=(cache_dir, cache_size))
+        self.started = time.monotonic()
+        # Requests to compile answered, and those that failed or timed out
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.active = 0
+        # Seconds taken by the latest requests
+        self.latencies = deque(maxlen=LATENCIES)
+        self.slots = None
+        self.stopping = None
+
+    def stats(self):
+        '''Returns the requests answered, the requests a second since the
+           server started and latencies of the latest requests in ms.'''
+        uptime = time.monotonic() - self.started
+        p50 = percentile(self.latencies, 50)
+        p99 = percentile(self.latencies, 99)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'active': self.active,
+            'uptime': uptime,
+            'requests per second': self.requests / uptime,
+            'p50 ms': None if p50 is None else p50 * 1000,
+            'p99 ms': None if p99 is None else p99 * 1000,
+            'jobs': self.jobs,
+            'concurrency': self.concurrency,
+        }
+
+    async def handle(self, reader, writer):
+        '''Answers one request.'''
+        start = time.monotonic()
+        deadline = start + self.timeout
+        remaining = lambda: max(deadline - time.monotonic(), 0)
+        header, body = {'ok': True}, b''
+        compiling = False
+        try:
+            request = json.loads(await asyncio.wait_for(reader.readline(),
+                                                        remaining()))
+            if request.get('stats'):
+                header = self.stats()
+            elif request.get('stop'):
+                self.stopping.set()
+            else:
+                compiling = True
+                source = await asyncio.wait_for(reader.read(), remaining())
+                async with self.slots:
+                    self.active += 1
+                    try:
+                        body, error = await asyncio.wait_for(
+                            asyncio.get_running_loop().run_in_executor(
+                                self.pool, compile_request,
+                                source.decode(), request),
+                            remaining())
+                    finally:
+                        self.active -= 1
+                if error is not None:
+                    header = {'error': error[0], 'message': error[1]}
+                    body = b''
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            header = {'error': 'TimeoutError',
+                      'message': 'no reply within {0} seconds'
+                                 .format(self.timeout)}
+        except Exception as e:
+            header = {'error': type(e).__name__, 'message': str(e)}
+        if compiling:
+            self.requests += 1
+            self.errors += 'error' in header
+            self.latencies.append(time.monotonic() - start)
+        try:
+            writer.write(json.dumps(header).encode() + b'\n' + body)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            # the client went away without waiting for the reply
+            pass
+
+    def warm_up(self):
+        '''Starts every worker by compiling a small program in each.'''
+        futures = [self.pool.submit(compile_request, 'ot 0', {})
+                   for _ in range(self.jobs)]
+        for future in futures:
+            future.result()
+
+    async def serve(self):
+        '''Answers requests until stopped by a request, SIGINT or SIGTERM.'''
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        server = await asyncio.start_unix_server(self.handle, self.path)
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            os.remove(self.path)
+
+    def run(self):
+        '''Listens at path and answers requests until stopped. Raises
+           OSError when another server is listening there already.'''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                try:
+                    s.connect(self.path)
+                except ConnectionRefusedError:
+                    # left behind by a server that did not stop cleanly
+                    os.remove(self.path)
+                else:
+                    raise OSError('a server is already listening at '
+                                  + self.path)
+        try:
+            self.warm_up()
+            asyncio.run(self.serve())
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Keeps the compiler loaded and compiles the programs '
+                    'client.py sends to a Unix domain socket.')
+    parser.add_argument('--socket', default=SOCKET,
+                        help='path of the socket to listen at '
+                             '(default: $SM_SOCKET or ~/.cache/sm/server.sock)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes compiling '
+                             '(default: one per core)')
+    parser.add_argument('--concurrency', type=int,
+                        help='most requests compiling or waiting for a '
+                             'worker at once (default: twice the jobs)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='seconds a request may take')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always compile, ignoring the compile cache')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='directory of the compile cache '
+                             '(default: $SM_CACHE_DIR or ~/.cache/sm)')
+    parser.add_argument('--cache-size', type=float, default=64,
+                        help='size limit of the compile cache in MB')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the stats as JSON on stderr when stopped')
+    args = parser.parse_args()
+    server = Compile_Server(args.socket, args.jobs, args.concurrency,
+                            args.timeout,
+                            None if args.no_cache else args.cache_dir,
+                            int(args.cache_size * 2**20))
+    server.run()
+    if args.stats:
+        print(json.dumps(server.stats(), indent=2), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Sharing of local variable slots between variables that are never live at
+the same time
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+from jasmin import LABEL, jumps, unconditional
+
+# Instructions that read or write the local in their first operand
+loads = {'iload', 'aload'}
+stores = {'istore', 'astore'}
+local_variables = loads | stores | {'iinc'}
+
+# Locals with their own one byte load and store instructions
+SHORT_FORMS = 4
+
+# Most pairs of locals that interfere for which slots are shared. Sharing
+# takes time in the number of pairs, which grows with the square of the
+# locals live at once, so past this each local keeps a slot of its own.
+MAX_PAIRS = 2**16
+
+def bits(mask):
+    '''Yields the index of each bit set in mask.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def blocks(code, handlers=()):
+    '''Splits code into basic blocks. Returns the index each block starts
+       at, the blocks each one can go on to and the exception handlers
+       each one can go on to from any of its instructions.'''
+    index = {ins[1]: i for i, ins in enumerate(code) if ins[0] == LABEL}
+    starts = {0}
+    for labels in handlers:
+        starts.update(index[label] for label in labels)
+    for i, ins in enumerate(code):
+        if ins[0] in jumps:
+            starts.add(index[ins[1]])
+            starts.add(i + 1)
+        elif ins[0] in unconditional:
+            starts.add(i + 1)
+    starts = sorted(s for s in starts if s < len(code))
+    block = {start: n for n, start in enumerate(starts)}
+    following = []
+    for n, start in enumerate(starts):
+        end = starts[n+1] if n + 1 < len(starts) else len(code)
+        successors = []
+        last = code[end-1]
+        if last[0] in jumps:
+            successors.append(block[index[last[1]]])
+        if last[0] not in unconditional and end < len(code):
+            successors.append(n + 1)
+        following.append(successors)
+    catching = [[block[index[handler]] for start, end, handler in handlers
+                 if index[start] <= first < index[end]] for first in starts]
+    return starts, following, catching
+
+def weights(code):
+    '''Returns how often each local is used, counting a use inside a loop
+       as ten times one outside it, so the busiest locals come first.'''
+    index = {ins[1]: i for i, ins in enumerate(code) if ins[0] == LABEL}
+    # a jump back to a label makes a loop of the code in between
+    depth = [0] * (len(code) + 1)
+    for i, ins in enumerate(code):
+        if ins[0] in jumps and index[ins[1]] <= i:
+            depth[index[ins[1]]] += 1
+            depth[i+1] -= 1
+    weight = {}
+    nesting = 0
+    for i, ins in enumerate(code):
+        nesting += depth[i]
+        if ins[0] in local_variables:
+            weight[ins[1]] = weight.get(ins[1], 0) + 10 ** min(nesting, 6)
+    return weight
+
+def allocate(code, arguments, handlers=()):
+    '''Gives locals that are never live at the same time the same slot,
+       with the busiest locals in the lowest slots. The first arguments
+       slots hold the method's arguments and keep them. Locals an
+       exception handler reads are live all through the code it covers.
+       When more than MAX_PAIRS pairs of locals interfere no slots are
+       shared, the locals are only ordered busiest first. Returns the new
+       code and the number of slots it uses.'''
+    starts, following, catching = blocks(code, handlers)
+    ends = starts[1:] + [len(code)]
+    # locals each block reads before writing them, and writes
+    used, written = [], []
+    for start, end in zip(starts, ends):
+        use = write = 0
+        for ins in code[start:end]:
+            if ins[0] in local_variables:
+                bit = 1 << ins[1]
+                if ins[0] not in stores and not write & bit:
+                    use |= bit
+                if ins[0] not in loads:
+                    write |= bit
+        used.append(use)
+        written.append(write)
+    # locals live at the start of each block, until nothing changes
+    live_in = [0] * len(starts)
+    def caught(n):
+        '''Returns the locals the handlers of block n read.'''
+        live = 0
+        for handler in catching[n]:
+            live |= live_in[handler]
+        return live
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(starts))):
+            live_out = 0
+            for successor in following[n]:
+                live_out |= live_in[successor]
+            live = used[n] | live_out & ~written[n] | caught(n)
+            if live != live_in[n]:
+                live_in[n] = live
+                changed = True
+    # two locals interfere when one is written while the other is live
+    interferes = {ins[1]: 0 for ins in code if ins[0] in local_variables}
+    for n, (start, end) in enumerate(zip(starts, ends)):
+        handled = caught(n)
+        live = handled
+        for successor in following[n]:
+            live |= live_in[successor]
+        for ins in reversed(code[start:end]):
+            if ins[0] not in local_variables:
+                continue
+            bit = 1 << ins[1]
+            if ins[0] not in loads:
+                interferes[ins[1]] |= live & ~bit
+                live = live & ~bit | handled
+            if ins[0] not in stores:
+                live |= bit
+    # arguments and locals read before being written are all live at the
+    # start of the method
+    entry = live_in[0] if starts else 0
+    entry |= (1 << arguments) - 1
+    for local in bits(entry):
+        interferes[local] = interferes.get(local, 0) | entry & ~(1 << local)
+    weight = weights(code)
+    order = sorted(interferes, key=lambda local: (-weight.get(local, 0),
+                                                  local))
+    pairs = sum(bin(mask).count('1') for mask in interferes.values())
+    if pairs > MAX_PAIRS:
+        # arguments keep their slots, the other locals follow, busiest
+        # first
+        slot = {local: local for local in range(arguments)}
+        for local in order:
+            if local not in slot:
+                slot[local] = len(slot)
+        return renumber(code, slot, arguments)
+    for local in list(interferes):
+        for other in bits(interferes[local]):
+            interferes[other] = interferes.get(other, 0) | 1 << local
+    # arguments keep their slots, the other locals take the lowest slot
+    # none of the locals they interfere with has, busiest first
+    slot = {local: local for local in range(arguments)}
+    for local in order:
+        if local in slot:
+            continue
+        taken = {slot[other] for other in bits(interferes[local])
+                 if other in slot}
+        slot[local] = min(set(range(len(taken) + 1)) - taken)
+    return renumber(code, slot, arguments)
+
+def renumber(code, slot, arguments):
+    '''Returns code with each local moved to its slot and the number of
+       slots it uses.'''
+    result = []
+    for ins in code:
+        if ins[0] in local_variables:
+            ins = (ins[0], slot[ins[1]]) + ins[2:]
+        result.append(ins)
+    return result, max(list(slot.values()) + [arguments - 1]) + 1
+
+def short_forms(code):
+    '''Uses iload_n, istore_n, aload_n and astore_n for the first slots.'''
+    result = []
+    for ins in code:
+        if ins[0] in (loads | stores) and ins[1] < SHORT_FORMS:
+            ins = (ins[0] + '_' + str(ins[1]),)
+        result.append(ins)
+    return result
@@ -0,0 +1,182 @@
+"""
+Tests that class files are the same every time and can be read back, and
+that the example's Jasmin is what the compiler writes now
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import os
+import struct
+import unittest
+from classfile import MAJOR_VERSION, MINOR_VERSION, opcodes
+from parser_code_generator import compile_source
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'example', 'example_program')
+EXAMPLE_JASMIN = os.path.join(os.path.dirname(EXAMPLE), 'Program.j')
+
+# Opcode of each instruction, with invokenonvirtual left out as it is
+# another name for invokespecial
+names = {code: op for op, code in opcodes.items() if op != 'invokenonvirtual'}
+
+# Bytes of operands after the opcode, for instructions that have any
+operand_bytes = { 'bipush':1, 'sipush':2, 'ldc':1, 'ldc_w':2, 'iload':1,
+                  'aload':1, 'istore':1, 'astore':1, 'iinc':2, 'goto':2,
+                  'goto_w':4, 'getstatic':2, 'putstatic':2,
+                  'invokevirtual':2, 'invokespecial':2, 'invokestatic':2,
+                  'new':2 }
+for jump in ('ifeq', 'ifne', 'iflt', 'ifge', 'ifgt', 'ifle', 'if_icmpeq',
+             'if_icmpne', 'if_icmplt', 'if_icmpge', 'if_icmpgt', 'if_icmple'):
+    operand_bytes[jump] = 2
+
+class Reader:
+    '''Reads a class file back, checking its structure as it goes.'''
+    def __init__(self, test, data):
+        self.test = test
+        self.data = data
+        self.position = 0
+
+    def unpack(self, form):
+        values = struct.unpack_from(form, self.data, self.position)
+        self.position += struct.calcsize(form)
+        return values if len(values) > 1 else values[0]
+
+    def constant(self, index, tag):
+        '''Returns the constant at index, which must have tag.'''
+        self.test.assertTrue(0 < index < len(self.pool))
+        self.test.assertEqual(self.pool[index][0], tag)
+        return self.pool[index][1]
+
+    def read(self):
+        '''Returns the class name and a dictionary of its methods, each
+           with its max stack, max locals and instructions.'''
+        self.test.assertEqual(self.unpack('>I'), 0xCAFEBABE)
+        self.test.assertEqual(self.unpack('>HH'),
+                              (MINOR_VERSION, MAJOR_VERSION))
+        self.pool = [None]
+        for _ in range(self.unpack('>H') - 1):
+            tag = self.unpack('>B')
+            if tag == 1:
+                length = self.unpack('>H')
+                text = self.data[self.position:self.position+length]
+                self.position += length
+                self.pool.append((tag, text.decode()))
+            elif tag == 3:
+                self.pool.append((tag, self.unpack('>i')))
+            elif tag in (7, 8):
+                self.pool.append((tag, self.unpack('>H')))
+            elif tag in (9, 10, 12):
+                self.pool.append((tag, self.unpack('>HH')))
+            else:
+                self.test.fail('constant of tag {0}'.format(tag))
+        _, this, super_, interfaces = self.unpack('>HHHH')
+        name = self.constant(self.constant(this, 7), 1)
+        self.test.assertEqual(self.constant(self.constant(super_, 7), 1),
+                              'java/lang/Object')
+        self.test.assertEqual(interfaces, 0)
+        for _ in range(self.unpack('>H')):
+            _, field, descriptor, attributes = self.unpack('>HHHH')
+            self.constant(field, 1)
+            self.constant(descriptor, 1)
+            self.test.assertEqual(attributes, 0)
+        methods = {}
+        for _ in range(self.unpack('>H')):
+            _, method, descriptor, attributes = self.unpack('>HHHH')
+            method = self.constant(method, 1) + self.constant(descriptor, 1)
+            self.test.assertEqual(attributes, 1)
+            methods[method] = self.code()
+        self.test.assertEqual(self.unpack('>H'), 0)
+        self.test.assertEqual(self.position, len(self.data))
+        return name, methods
+
+    def code(self):
+        '''Reads a Code attribute and returns its max stack, max locals
+           and instructions.'''
+        self.test.assertEqual(self.constant(self.unpack('>H'), 1), 'Code')
+        length = self.unpack('>I')
+        start = self.position
+        stack, locals_, size = self.unpack('>HHI')
+        code = self.data[self.position:self.position+size]
+        self.position += size
+        instructions = self.instructions(code)
+        for _ in range(self.unpack('>H')):
+            handler = self.unpack('>HHHH')
+            for offset in handler[:3]:
+                self.test.assertIn(offset, instructions)
+        self.test.assertEqual(self.unpack('>H'), 0)
+        self.test.assertEqual(self.position - start, length)
+        return stack, locals_, instructions
+
+    def instructions(self, code):
+        '''Returns the instructions of code by their offsets, checking that
+           every jump lands on one and every constant is in the pool.'''
+        instructions, targets, i = {}, [], 0
+        while i < len(code):
+            start = i
+            op = names[code[i]]
+            i += 1
+            if op == 'wide':
+                op = 'wide ' + names[code[i]]
+                i += 5 if op == 'wide iinc' else 3
+            else:
+                i += operand_bytes.get(op, 0)
+            operands = code[start+1:i]
+            if op in ('ldc', 'ldc_w'):
+                self.constant(int.from_bytes(operands, 'big'), 3)
+            elif op == 'goto_w':
+                targets.append(start + struct.unpack('>i', operands)[0])
+            elif op.startswith('if') or op == 'goto':
+                targets.append(start + struct.unpack('>h', operands)[0])
+            instructions[start] = op
+        self.test.assertEqual(i, len(code))
+        for target in targets:
+            self.test.assertIn(target, instructions)
+        return instructions
+
+class Class_File_Test(unittest.TestCase):
+    def test_same_bytes(self):
+        with open(EXAMPLE) as f:
+            text = f.read()
+        self.assertEqual(compile_source(text, class_file=True),
+                         compile_source(text, class_file=True))
+
+    def test_example_jasmin(self):
+        # regenerate it with
+        # python parser_code_generator.py --no-cache < example/example_program
+        with open(EXAMPLE) as f:
+            text = f.read()
+        with open(EXAMPLE_JASMIN) as f:
+            self.assertEqual(compile_source(text), f.read())
+
+    def test_example(self):
+        with open(EXAMPLE) as f:
+            data = compile_source(f.read(), class_file=True)
+        name, methods = Reader(self, data).read()
+        self.assertEqual(name, 'Program')
+        self.assertEqual(set(methods), {'<init>()V',
+                                        'main([Ljava/lang/String;)V'})
+        _, _, instructions = methods['main([Ljava/lang/String;)V']
+        self.assertEqual(list(instructions.values())[-1], 'return')
+
+    def test_wide_forms(self):
+        # 300 variables need wide loads and stores, 300 different large
+        # ints need ldc_w and a loop body over 32 kB needs goto_w
+        statements = ['v{0}: {1}'.format(chr(97 + n % 26) * (n // 26 + 1),
+                                         100000 + n) for n in range(300)]
+        body = ['x: x + {0} * y'.format(100000 + n % 300)
+                for n in range(3000)]
+        text = ';\n'.join(statements + ['wl x > 0 {\n' + ';\n'.join(body) +
+                                        '\n}'])
+        data = compile_source(text, optimise=False, class_file=True, split=0)
+        self.assertEqual(data, compile_source(text, optimise=False,
+                                              class_file=True, split=0))
+        _, methods = Reader(self, data).read()
+        _, locals_, instructions = methods['main([Ljava/lang/String;)V']
+        self.assertGreater(locals_, 256)
+        used = set(instructions.values())
+        self.assertIn('goto_w', used)
+        self.assertIn('ldc_w', used)
+        self.assertIn('wide istore', used)
+
+if __name__ == '__main__':
+    unittest.main()
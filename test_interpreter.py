@@ -0,0 +1,157 @@
+"""
+Tests of the interpreter that runs compiled programs without a JVM
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import io
+import unittest
+from unittest import mock
+from jasmin import LABEL, Method
+import interpreter
+from interpreter import DIVIDE_SHIFT, IF_LOCAL_CONSTANT, IF_LOCAL_ZERO, \
+                        IF_LOCALS, Interpreter, JavaException
+from test_optimise import generate, run_program
+
+def run_code(code, max_locals):
+    '''Runs code as main and returns its output.'''
+    main = Method('main', '([Ljava/lang/String;)V')
+    main.code = code
+    main.max_locals = max_locals
+    output = io.StringIO()
+    Interpreter([main]).run(io.StringIO(), output)
+    return output.getvalue()
+
+def println(value):
+    '''Returns the instructions that print the int on top of the stack
+       once value has pushed it.'''
+    return [('getstatic', 'java/lang/System/out', 'Ljava/io/PrintStream;'),
+            value,
+            ('invokestatic', 'java/lang/String/valueOf(I)Ljava/lang/String;'),
+            ('invokevirtual',
+             'java/io/PrintStream/println(Ljava/lang/String;)V')]
+
+class Interpreter_Test(unittest.TestCase):
+    def test_arithmetic(self):
+        self.assertEqual(run_program('in x; ot x + 2147483647; ot x * 65536 '
+                                     '* 65536; ot 0 - x - 2147483647 - 1; '
+                                     'ot x / (0 - 2)', '1'),
+                         ('-2147483648\n0\n2147483647\n0\n', None))
+
+    def test_division_by_zero(self):
+        for text in ('in x; ot 7; ot 1 / x; ot 8', 'in x; ot 7; ot x / x'):
+            for optimise in (True, False):
+                self.assertEqual(run_program(text, '0', optimise),
+                                 ('7\n', 'java.lang.ArithmeticException'))
+        main = generate('in x; ot 1 / x')[1]
+        with self.assertRaises(JavaException) as caught:
+            Interpreter([main]).run(io.StringIO('0'), io.StringIO())
+        self.assertEqual(str(caught.exception),
+                         'java.lang.ArithmeticException: / by zero')
+
+    def test_end_of_input(self):
+        text = 'in x; ot x; in y; ot y'
+        self.assertEqual(run_program(text, '5'),
+                         ('5\n', 'java.util.NoSuchElementException'))
+        self.assertEqual(run_program(text, ''),
+                         ('', 'java.util.NoSuchElementException'))
+        self.assertEqual(run_program(text, '  -2147483648\n\n 2147483647 \n'),
+                         ('-2147483648\n2147483647\n', None))
+
+    def test_bad_input(self):
+        for stdin in ('5 abc', '5 2147483648', '5 1.5', '5 --1'):
+            self.assertEqual(run_program('in x; ot x; in y; ot y', stdin),
+                             ('5\n', 'java.util.InputMismatchException'),
+                             stdin)
+
+    def test_fused_operations(self):
+        text = 'in n; in x; i: 0; wl i < n { i: i + 1; ' \
+               'if x = 5 { ot x / 4 }; if x != 0 { ot x / 8 } }'
+        main = generate(text)[1]
+        ops, _, _ = Interpreter([main]).translate(main)
+        for op in (IF_LOCALS, IF_LOCAL_CONSTANT, IF_LOCAL_ZERO, DIVIDE_SHIFT):
+            self.assertIn(op, ops)
+
+    def test_fused_same_as_unfused(self):
+        text = 'in n; in x; i: 0; wl i < n {{ i: i + 1; ' \
+               'if x = {0} {{ ot x / 4 }}; if x != 0 {{ ot x / 8 }}; ' \
+               'if i >= x {{ ot i }}; x: x - 3 }}'
+        unfused = lambda ops, args: (ops, args)
+        for value in (-9, -8, -5, -1, 0, 5, 7, 64):
+            source = text.format(value if value >= 0
+                                 else '0 - {0}'.format(-value))
+            stdin = '6 {0}'.format(value)
+            expected = run_program(source, stdin)
+            with mock.patch.object(interpreter, 'fuse', unfused):
+                self.assertEqual(run_program(source, stdin), expected)
+
+    def test_divide_shift(self):
+        for value in ('0 - 7', '0 - 8', '7', '0 - 2147483647 - 1',
+                      '2147483647', '0 - 1'):
+            text = 'x: {0}; ot x / 4; ot x / 1024; ot x / 2'.format(value)
+            self.assertEqual(run_program(text),
+                             run_program(text, optimise=False))
+
+    def test_jump_into_fused(self):
+        # the goto lands on the second load of a pair fused with the
+        # jump after it, comparing 0 with local 1 instead of local 0
+        code = [('iconst_1',), ('istore', 0), ('iconst_2',), ('istore', 1),
+                ('iconst_0',), ('goto', 'middle'), ('iload', 0),
+                (LABEL, 'middle'), ('iload', 1), ('if_icmpgt', 'greater')] + \
+               println(('iconst_0',)) + [('return',), (LABEL, 'greater')] + \
+               println(('iconst_1',)) + [('return',)]
+        self.assertEqual(run_code(code, 2), '0\n')
+        code[4:7] = [('iconst_3',), ('goto', 'middle'), ('iload', 0)]
+        self.assertEqual(run_code(code, 2), '1\n')
+
+class Flushes(io.StringIO):
+    "Output that records how much had been written each time it is flushed"
+    def __init__(self):
+        super().__init__()
+        self.flushes = []
+    def flush(self):
+        self.flushes.append(len(self.getvalue()))
+
+class Buffered_Test(unittest.TestCase):
+    def same(self, text, stdin=''):
+        '''Asserts the program in text gives the same output and exception
+           buffered and not, optimised or not, and returns them.'''
+        result = run_program(text, stdin)
+        for optimise in (True, False):
+            self.assertEqual(run_program(text, stdin, optimise, True), result)
+        return result
+
+    def test_input(self):
+        text = 'in x; ot x; in y; ot y'
+        self.assertEqual(self.same(text, '  -2147483648\n\n +2147483647 \n'),
+                         ('-2147483648\n2147483647\n', None))
+        for stdin in ('5', '5 \n\n', '5 \t'):
+            self.assertEqual(self.same(text, stdin),
+                             ('5\n', 'java.util.NoSuchElementException'))
+        self.assertEqual(self.same(text, ''),
+                         ('', 'java.util.NoSuchElementException'))
+        for stdin in ('5 2147483648', '5 -2147483649', '5 abc', '5 1.5',
+                      '5 --1', '5 12x', '5 -', '5 -\n'):
+            self.assertEqual(self.same(text, stdin),
+                             ('5\n', 'java.util.InputMismatchException'),
+                             stdin)
+
+    def test_division_by_zero(self):
+        self.assertEqual(self.same('in x; ot 7; ot 1 / x; ot 8', '0'),
+                         ('7\n', 'java.lang.ArithmeticException'))
+
+    def test_flushed(self):
+        # the output is flushed once, at the end or by the handler
+        methods = generate('in x; ot 7; ot 8; ot 1 / x; ot 9', buffered=True)
+        for stdin, throws in (('2', False), ('0', True), ('', True)):
+            output = Flushes()
+            try:
+                Interpreter(methods).run(io.StringIO(stdin), output)
+                threw = False
+            except JavaException:
+                threw = True
+            self.assertEqual(threw, throws)
+            self.assertEqual(output.flushes, [len(output.getvalue())])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""
+Tests that optimised programs do what the same programs do unoptimised
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import io
+import unittest
+from interpreter import Interpreter, JavaException
+from parser_code_generator import SPLIT_SIZE, Compiler, run
+
+def generate(text, optimise=True, buffered=False, split=SPLIT_SIZE):
+    '''Returns the methods of the class for the program in text.'''
+    compiler = Compiler(optimise=optimise, buffered=buffered, split=split)
+    return compiler.generate(compiler.optimised(
+                             compiler.parse(io.StringIO(text))))
+
+def run_program(text, stdin='', optimise=True, buffered=False,
+                split=SPLIT_SIZE):
+    '''Runs the program in text on the interpreter. Returns its output and
+       the name of the exception that ended it or None.'''
+    output = io.StringIO()
+    try:
+        Interpreter(generate(text, optimise, buffered, split)).run(
+            io.StringIO(stdin), output)
+    except JavaException as e:
+        return output.getvalue(), e.name
+    return output.getvalue(), None
+
+def operations(text, optimise=True):
+    '''Returns the names of the instructions of main for the program in
+       text, without its labels.'''
+    main = [method for method in generate(text, optimise)
+            if method.name == 'main'][0]
+    return [ins[0] for ins in main.code if ins[0] != ':']
+
+def optimised(text):
+    '''Returns the program in text as the optimised syntax tree prints it.'''
+    compiler = Compiler()
+    return run(compiler.optimised(compiler.parse(io.StringIO(text))).text())
+
+class Optimise_Test(unittest.TestCase):
+    def same(self, text, stdin=''):
+        '''Asserts the program in text gives the same output and exception
+           optimised and not, and returns them.'''
+        result = run_program(text, stdin)
+        self.assertEqual(result, run_program(text, stdin, optimise=False))
+        return result
+
+class Fold_Test(Optimise_Test):
+    def test_wraparound(self):
+        self.assertEqual(self.same('ot 2147483647 + 1; ot 65536 * 65536; '
+                                   'ot 0 - 2147483647 - 1 - 1'),
+                         ('-2147483648\n0\n2147483647\n', None))
+        self.assertEqual(self.same('ot (0 - 2147483647 - 1) / (0 - 1)'),
+                         ('-2147483648\n', None))
+
+    def test_division_rounds_toward_zero(self):
+        self.assertEqual(self.same('ot (0 - 7) / 2; ot 7 / (0 - 2)'),
+                         ('-3\n-3\n', None))
+
+    def test_constants_folded(self):
+        self.assertEqual(operations('ot (1 + 2) * 3 - 9 / 4'),
+                         ['getstatic', 'bipush', 'invokestatic',
+                          'invokevirtual', 'return'])
+
+    def test_division_by_zero_kept(self):
+        self.assertEqual(self.same('ot 5; ot 1 / 0'),
+                         ('5\n', 'java.lang.ArithmeticException'))
+        for text in ('x: 0; ot (1 / x) * 0', 'x: 0; ot 0 * (1 / x)',
+                     'x: 0; ot 0 / x', 'x: 3; ot (x - x) / 0',
+                     'x: 0; y: 1 / x - 1 / x; ot 1'):
+            self.assertEqual(self.same(text),
+                             ('', 'java.lang.ArithmeticException'), text)
+
+    def test_identities(self):
+        self.assertEqual(self.same('x: 5; ot x * 1 + 0; ot 1 * x - 0; '
+                                   'ot 0 - (0 - x); ot x * 0'),
+                         ('5\n5\n5\n0\n', None))
+
+    def test_known_conditions(self):
+        self.assertEqual(self.same('if 1 < 2 {ot 1} el {ot 2}; '
+                                   'wl 2 < 1 {ot 3}; '
+                                   'if nt (1 = 1) | 2 > 3 {ot 4}; ot 5'),
+                         ('1\n5\n', None))
+        self.assertNotIn('ifeq', operations('if 1 < 2 {ot 1} el {ot 2}'))
+
+    def test_short_circuit(self):
+        self.assertEqual(self.same('x: 0; if 1 < 2 | 1 / x > 0 {ot 1}; '
+                                   'if 1 > 2 & 1 / x > 0 {ot 2}; ot 3'),
+                         ('1\n3\n', None))
+
+    def test_variables_not_folded(self):
+        self.assertEqual(self.same('x: 3; fr i: x { ot i * x; x: x + 1 }; '
+                                   'ot x'),
+                         ('9\n8\n5\n6\n', None))
+
+class Hoist_Test(Optimise_Test):
+    def test_invariant_hoisted(self):
+        text = 'in n; in m; i: 0; wl i < n * m { i: i + 1 }; ot i'
+        self.assertEqual(self.same(text, '3 4'), ('12\n', None))
+        self.assertEqual(optimised(text), 'in n; in m; i:0; Temp 1:(n*m); '
+                                          'wl i<Temp 1 { i:(i+1) }; ot i')
+
+    def test_outermost_loop(self):
+        # a * b leaves both loops, i * 7 only the inner one
+        text = 'in a; in b; fr i: 3 { fr j: 2 { ot a * b + i * 7 + j } }'
+        self.assertEqual(self.same(text, '2 5'),
+                         ('33\n32\n26\n25\n19\n18\n', None))
+        self.assertEqual(optimised(text),
+                         'in a; in b; Temp 2:(a*b); fr i:3 { '
+                         'Temp 1:(Temp 2+(i*7)); fr j:2 { ot (Temp 1+j) } }')
+
+    def test_changed_variables_stay(self):
+        text = 'in n; in m; i: 0; wl i < n * m { i: i + 1; m: m - 1 }; ot i'
+        self.assertEqual(self.same(text, '3 4'), ('3\n', None))
+        self.assertNotIn('Temp', optimised(text))
+        # the counter of a fr loop changes every time round
+        text = 'in a; fr i: 3 { fr j: 2 { ot a * i + j } }'
+        self.assertEqual(self.same(text, '10'),
+                         ('32\n31\n22\n21\n12\n11\n', None))
+        self.assertEqual(optimised(text), 'in a; fr i:3 { Temp 1:(a*i); '
+                                          'fr j:2 { ot (Temp 1+j) } }')
+
+    def test_out_of_if(self):
+        text = 'in n; in m; i: 0; wl i < 20 { i: i + 1; if i > 2 { ' \
+               'wl i < n * m + 4 { i: i + 1 } } }; ot i'
+        self.assertEqual(self.same(text, '3 4'), ('20\n', None))
+        self.assertTrue(optimised(text).startswith(
+                        'in n; in m; i:0; Temp 1:((n*m)+4); wl'))
+
+    def test_division_not_hoisted(self):
+        # the loop never divides by d when it is 0
+        text = 'in d; i: 0; wl i < 3 { if d != 0 { ot 10 / d }; ' \
+               'i: i + 1 }; ot i'
+        self.assertEqual(self.same(text, '0'), ('3\n', None))
+        self.assertEqual(self.same(text, '4'), ('2\n2\n2\n3\n', None))
+        self.assertNotIn('Temp', optimised(text))
+
+    def test_loop_never_run(self):
+        text = 'in a; in b; i: 5; wl i < 3 { ot a * b; i: i + 1 }; ot i'
+        self.assertEqual(self.same(text, '65536 65536'), ('5\n', None))
+
+    def test_deep_nesting(self):
+        # each loop runs once, the innermost sets x so they all end
+        depth = 500
+        text = 'in a; x: 0; ' + 'wl x < a * 2 { ' * depth + 'x: a * 2 + 1' \
+               + ' }' * depth + '; ot x'
+        self.assertEqual(self.same(text, '3'), ('7\n', None))
+
+class Common_Subexpression_Test(Optimise_Test):
+    def test_reused(self):
+        text = 'in x; in y; in z; a: x * y + z; ot (x * y + z) * 2; ot a'
+        self.assertEqual(self.same(text, '3 4 5'), ('34\n17\n', None))
+        self.assertEqual(self.same(text, '65536 65536 7'), ('14\n7\n', None))
+        self.assertEqual(optimised(text),
+                         'in x; in y; in z; Temp 1:((x*y)+z); a:Temp 1; '
+                         'ot (Temp 1*2); ot a')
+
+    def test_assignment_between(self):
+        for text in ('in x; in y; a: x * y; x: 3; b: x * y; ot a; ot b',
+                     'in x; in y; a: x * y; in x; b: x * y; ot a; ot b'):
+            self.assertEqual(self.same(text, '5 7 3'), ('35\n21\n', None))
+            self.assertNotIn('Temp', optimised(text))
+
+    def test_jump_between(self):
+        text = 'in x; in y; a: x * y; if a > 0 { ot x * y }; ot x * y'
+        self.assertEqual(self.same(text, '2 3'), ('6\n6\n', None))
+        self.assertEqual(operations(text).count('imul'), 3)
+
+    def test_dup(self):
+        text = 'in a; in b; ot (a + b) * (a + b)'
+        self.assertEqual(self.same(text, '3 4'), ('49\n', None))
+        self.assertEqual(operations(text).count('iadd'), 1)
+        self.assertIn('dup', operations(text))
+
+    def test_division_by_zero(self):
+        text = 'in x; in y; ot 1; a: x / y + 1; ot x / y + 1; ot a'
+        self.assertEqual(self.same(text, '7 0'),
+                         ('1\n', 'java.lang.ArithmeticException'))
+        self.assertEqual(self.same(text, '7 2'), ('1\n4\n4\n', None))
+
+class Split_Test(Optimise_Test):
+    def split(self, text, stdin=''):
+        '''Asserts the program in text gives the same output and exception
+           split into small methods as in main alone, optimised or not and
+           buffered or not. Returns them.'''
+        result = self.same(text, stdin)
+        for optimise in (True, False):
+            for buffered in (False, True):
+                self.assertEqual(run_program(text, stdin, optimise, buffered,
+                                             split=100), result)
+        names = [method.name for method in generate(text, split=100)]
+        self.assertIn('part1', names)
+        return result
+
+    def test_statements(self):
+        text = 'in n; s: 0; ' + '; '.join('s: s + n * {0}; ot s'.format(k)
+                                          for k in range(40)) + '; ot s'
+        output, error = self.split(text, '3')
+        self.assertEqual(output.split()[-2:], ['2340', '2340'])
+
+    def test_loop_split_inside(self):
+        text = 'in n; s: 0; i: 0; wl i < n { ' + \
+               '; '.join('s: s + i * {0}'.format(k) for k in range(60)) + \
+               '; i: i + 1 }; ot s'
+        self.assertEqual(self.split(text, '5'), ('17700\n', None))
+        # the loop stays in main and calls the parts of its body
+        main = generate(text, split=100)[1]
+        self.assertIn(('invokestatic', 'Program/part1()V'), main.code)
+        self.assertIn('if_icmplt', [ins[0] for ins in main.code])
+
+    def test_input_in_parts(self):
+        text = '; '.join('in v{0}; ot v{0} * 2'.format(c)
+                         for c in 'abcdefghijklmnop')
+        output, _ = self.split(text, ' '.join(map(str, range(16))))
+        self.assertEqual(output.split(), [str(2 * n) for n in range(16)])
+        self.assertEqual(self.split(text, '1 2')[1],
+                         'java.util.NoSuchElementException')
+
+    def test_exception_in_part(self):
+        text = 'in n; ' + '; '.join('ot n + {0}'.format(k)
+                                    for k in range(30)) + \
+               '; ot 1 / (n - 3); ot 5'
+        output, error = self.split(text, '3')
+        self.assertEqual(error, 'java.lang.ArithmeticException')
+        self.assertEqual(output.split(), [str(3 + k) for k in range(30)])
+
+if __name__ == '__main__':
+    unittest.main()
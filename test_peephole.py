@@ -0,0 +1,161 @@
+"""
+Tests of the rules of the peephole optimiser
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import unittest
+from collections import Counter
+from jasmin import LABEL, constant_value, java_div, java_int
+import peephole
+from test_optimise import Optimise_Test, operations
+
+def shift(code, value):
+    '''Runs the instructions divide returns on value and returns the int
+       they leave.'''
+    stack = [value]
+    for ins in code:
+        op = ins[0]
+        if constant_value(ins) is not None:
+            stack.append(constant_value(ins))
+        elif op == 'dup':
+            stack.append(stack[-1])
+        elif op == 'iadd':
+            b = stack.pop()
+            stack.append(java_int(stack.pop() + b))
+        elif op == 'ishr':
+            b = stack.pop() & 31
+            stack.append(stack.pop() >> b)
+        elif op == 'iushr':
+            b = stack.pop() & 31
+            stack.append(java_int((stack.pop() & 0xffffffff) >> b))
+        else:
+            raise ValueError(op)
+    return stack.pop()
+
+class Peephole_Test(unittest.TestCase):
+    def rule(self, function, code, expected, name):
+        '''Asserts a pass turns code into expected, using rule name once.'''
+        stats = Counter()
+        self.assertEqual(function(code, stats), expected)
+        self.assertEqual(stats, Counter({name: 1}))
+
+    def test_increments(self):
+        increments = peephole.increments
+        self.rule(increments, [('iload', 1), ('iconst_2',), ('iadd',),
+                               ('istore', 1)], [('iinc', 1, 2)], 'iinc')
+        self.rule(increments, [('bipush', 100), ('iload', 1), ('iadd',),
+                               ('istore', 1)], [('iinc', 1, 100)], 'iinc')
+        self.rule(increments, [('iload', 1), ('bipush', 127), ('isub',),
+                               ('istore', 1)], [('iinc', 1, -127)], 'iinc')
+        for code in ([('iload', 1), ('sipush', 128), ('iadd',), ('istore', 1)],
+                     [('iload', 2), ('iconst_1',), ('iadd',), ('istore', 1)],
+                     [('iconst_5',), ('iload', 1), ('isub',), ('istore', 1)],
+                     [('iload', 1), ('bipush', -128), ('isub',),
+                      ('istore', 1)]):
+            self.assertEqual(increments(code, Counter()), code)
+
+    def test_store_load(self):
+        self.rule(peephole.local_rules, [('istore', 3), ('iload', 3)],
+                  [('dup',), ('istore', 3)], 'store-load')
+        code = [('istore', 3), ('iload', 4)]
+        self.assertEqual(peephole.local_rules(code, Counter()), code)
+
+    def test_compare_zero(self):
+        self.rule(peephole.local_rules, [('iconst_0',), ('if_icmplt', 'l1')],
+                  [('iflt', 'l1')], 'compare-zero')
+
+    def test_invert_jump(self):
+        self.rule(peephole.local_rules,
+                  [('ifeq', 'l1'), ('goto', 'l2'), (LABEL, 'l1')],
+                  [('ifne', 'l2'), (LABEL, 'l1')], 'invert-jump')
+
+    def test_jump_to_next(self):
+        self.rule(peephole.local_rules,
+                  [('goto', 'l1'), (LABEL, 'l0'), (LABEL, 'l1')],
+                  [(LABEL, 'l0'), (LABEL, 'l1')], 'jump-to-next')
+
+    def test_field_unchanged(self):
+        field = ('Program/x', 'I')
+        self.rule(peephole.local_rules,
+                  [('getstatic',) + field, ('dup',), ('istore', 0),
+                   ('putstatic',) + field],
+                  [('getstatic',) + field, ('istore', 0)], 'field-unchanged')
+
+    def test_shift_multiply(self):
+        self.rule(peephole.local_rules, [('bipush', 8), ('imul',)],
+                  [('iconst_3',), ('ishl',)], 'shift-multiply')
+        code = [('bipush', 12), ('imul',)]
+        self.assertEqual(peephole.local_rules(code, Counter()), code)
+
+    def test_shift_divide(self):
+        self.rule(peephole.local_rules, [('iconst_4',), ('idiv',)],
+                  peephole.divide(2), 'shift-divide')
+        values = [0, 1, -1, 2, -2, 7, -7, 1000, -1000, 2**31 - 1, -2**31,
+                  -2**31 + 1]
+        for k in range(1, 31):
+            for value in values:
+                self.assertEqual(shift(peephole.divide(k), value),
+                                 java_div(value, 2**k), (value, k))
+
+    def test_power_of_two(self):
+        self.assertEqual([peephole.power_of_two(v) for v in
+                          (None, -4, 0, 1, 2, 6, 1024, 2**30)],
+                         [None, None, None, None, 1, None, 10, 30])
+
+    def test_thread_jumps(self):
+        code = [('ifeq', 'l1'), ('return',), (LABEL, 'l1'), ('goto', 'l2'),
+                (LABEL, 'l2'), ('goto', 'l3'), (LABEL, 'l3'), ('return',)]
+        stats = Counter()
+        result = peephole.thread_jumps(code, stats)
+        self.assertEqual([ins for ins in result if ins[0] in ('ifeq', 'goto')],
+                         [('ifeq', 'l3'), ('goto', 'l3'), ('goto', 'l3')])
+        self.assertEqual(stats['thread-jump'], 2)
+        # a loop of gotos ends
+        code = [(LABEL, 'l1'), ('goto', 'l2'), (LABEL, 'l2'), ('goto', 'l1')]
+        peephole.thread_jumps(code, Counter())
+
+    def test_remove_unreachable(self):
+        code = [('goto', 'l2'), ('iconst_1',), (LABEL, 'l1'), ('pop',),
+                (LABEL, 'l2'), ('return',), ('iconst_2',), (LABEL, 'l3'),
+                ('return',)]
+        stats = Counter()
+        self.assertEqual(peephole.remove_unreachable(code, stats, ['l3']),
+                         [('goto', 'l2'), (LABEL, 'l2'), ('return',),
+                          (LABEL, 'l3'), ('return',)])
+        self.assertEqual(stats, Counter({'unreachable': 3,
+                                         'unused-label': 1}))
+
+    def test_remove_unused_labels(self):
+        code = [(LABEL, 'l1'), ('goto', 'l2'), (LABEL, 'l2'), (LABEL, 'l3'),
+                ('return',)]
+        self.assertEqual(peephole.remove_unused_labels(code, Counter(),
+                                                       ['l3']),
+                         code[1:])
+
+    def test_optimise_until_done(self):
+        # x: x + 1 by a store and load, then a jump over nothing
+        code = [('iload', 0), ('iconst_1',), ('iadd',), ('istore', 0),
+                ('goto', 'l1'), (LABEL, 'l1'), ('return',)]
+        stats = Counter()
+        self.assertEqual(peephole.optimise(code, stats),
+                         [('iinc', 0, 1), ('return',)])
+        self.assertEqual(stats, Counter({'iinc': 1, 'jump-to-next': 1,
+                                         'unused-label': 1}))
+
+class Peephole_Program_Test(Optimise_Test):
+    def test_shifts(self):
+        text = 'x: {0}; ot x * 8; ot x / 8; ot x / 2; ot x / 1024'
+        for value in ('0 - 9', '9', '0 - 2147483647 - 1', '2147483647',
+                      '0 - 1'):
+            self.same(text.format(value))
+        self.assertIn('ishl', operations(text.format(3)))
+        self.assertNotIn('idiv', operations(text.format(3)))
+
+    def test_increments(self):
+        self.assertEqual(self.same('x: 2147483647; x: x + 1; ot x; '
+                                   'x: x - 128; ot x'),
+                         ('-2147483648\n2147483520\n', None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of the sharing of local slots between variables
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import unittest
+from unittest import mock
+from jasmin import LABEL
+import slots
+from generator import identifier_name
+from test_optimise import Optimise_Test
+
+def slots_of(code):
+    '''Returns the slots code uses in order of first use.'''
+    used = []
+    for ins in code:
+        if ins[0] in slots.local_variables and ins[1] not in used:
+            used.append(ins[1])
+    return used
+
+class Allocate_Test(unittest.TestCase):
+    def test_disjoint_share(self):
+        code = [('iconst_1',), ('istore', 5), ('iload', 5), ('istore', 6),
+                ('iload', 6), ('ireturn',)]
+        code, size = slots.allocate(code, 0)
+        self.assertEqual(slots_of(code), [0])
+        self.assertEqual(size, 1)
+
+    def test_interfering_apart(self):
+        code = [('iconst_1',), ('istore', 5), ('iconst_2',), ('istore', 6),
+                ('iload', 5), ('iload', 6), ('iadd',), ('ireturn',)]
+        code, size = slots.allocate(code, 0)
+        self.assertEqual(sorted(slots_of(code)), [0, 1])
+        self.assertEqual(size, 2)
+
+    def test_arguments_keep_slots(self):
+        code = [('iconst_1',), ('istore', 2), ('iload', 0), ('iload', 1),
+                ('iadd',), ('iload', 2), ('iadd',), ('ireturn',)]
+        self.assertEqual(slots.allocate(code, 2), (code, 3))
+
+    def test_busiest_first(self):
+        # local 4 is the counter of a loop, local 3 is used once after it
+        code = [('iconst_0',), ('istore', 3), ('iconst_0',), ('istore', 4),
+                (LABEL, 'l1'), ('iinc', 4, 1), ('iload', 4), ('bipush', 9),
+                ('if_icmplt', 'l1'), ('iload', 3), ('ireturn',)]
+        code, size = slots.allocate(code, 0)
+        self.assertEqual(code[3], ('istore', 0))
+        self.assertEqual(code[1], ('istore', 1))
+        self.assertEqual(size, 2)
+
+    def test_handler_reads_keep_locals_live(self):
+        # local 1 is only read by the handler, so it is live all through
+        # the code the handler covers, where local 2 is written
+        code = [('iconst_1',), ('istore', 1), (LABEL, 'start'),
+                ('iconst_2',), ('istore', 2), ('iload', 2), ('pop',),
+                (LABEL, 'end'), ('iconst_0',), ('ireturn',),
+                (LABEL, 'handler'), ('pop',), ('iload', 1), ('ireturn',)]
+        handlers = [('start', 'end', 'handler')]
+        code, size = slots.allocate(code, 0, handlers)
+        self.assertEqual(size, 2)
+        self.assertNotEqual(code[1][1], code[4][1])
+        code, size = slots.allocate(code[:10], 0)
+        self.assertEqual(size, 1)
+
+    def test_too_many_pairs(self):
+        # 300 locals all live at once interfere in 89700 pairs
+        count = 300
+        self.assertGreater(count * (count - 1), slots.MAX_PAIRS)
+        code = []
+        for local in range(count):
+            code += [('iconst_1',), ('istore', local)]
+        # the last local is the busiest
+        code += [(LABEL, 'l1'), ('iinc', count - 1, 1), ('iload', count - 1),
+                 ('ifne', 'l1')]
+        for local in range(count):
+            code += [('iload', local), ('pop',)]
+        code.append(('return',))
+        result, size = slots.allocate(code, 0)
+        self.assertEqual(size, count)
+        self.assertEqual(result[2 * count - 1], ('istore', 0))
+        self.assertEqual(sorted(set(slots_of(result))), list(range(count)))
+
+    def test_short_forms(self):
+        self.assertEqual(slots.short_forms([('iload', 3), ('istore', 4),
+                                            ('aload', 0), ('iinc', 1, 1)]),
+                         [('iload_3',), ('istore', 4), ('aload_0',),
+                          ('iinc', 1, 1)])
+
+class Slot_Program_Test(Optimise_Test):
+    def test_shared_slots(self):
+        # a and b are never live at once, nor are the two counters
+        text = 'in a; ot a * 2; in b; ot b + 1; c: 0; ' \
+               'fr i: 10 { c: c + i }; ot c; fr i: 3 { ot i }'
+        self.assertEqual(self.same(text, '4 5'),
+                         ('8\n6\n55\n3\n2\n1\n', None))
+
+    def test_many_live_variables(self):
+        # all 300 are live at once, past MAX_PAIRS
+        names = [identifier_name(n) for n in range(300)]
+        text = '; '.join('{0}: {1} * 3'.format(name, n)
+                         for n, name in enumerate(names))
+        text += '; s: 0; ' + '; '.join('s: s + {0}'.format(name)
+                                       for name in names) + '; ot s'
+        self.assertEqual(self.same(text),
+                         (str(3 * sum(range(300))) + '\n', None))
+
+    def test_no_sharing(self):
+        text = 'in a; b: a * a; wl b > 0 { c: b / 3; ot c; b: b - 7 }; ' \
+               'd: a + 1; ot d'
+        with mock.patch.object(slots, 'MAX_PAIRS', 0):
+            self.assertEqual(self.same(text, '5'),
+                             ('8\n6\n3\n1\n6\n', None))
+
+if __name__ == '__main__':
+    unittest.main()
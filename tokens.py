@@ -0,0 +1,79 @@
+"""
+Tokens and regular expressions for matching
+in input
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+class Token:
+    # The following enumerates all tokens as small ints, so the kinds of
+    # many tokens fit in an array of bytes and can index tables. END is
+    # the end of the input.
+    END   = 0
+    EL    = 1
+    IF    = 2
+    WL    = 3
+    FR    = 4
+    SEM   = 5
+    BEC   = 6
+    LESS  = 7
+    EQ    = 8
+    GRTR  = 9
+    LEQ   = 10
+    NEQ   = 11
+    GEQ   = 12
+    AND   = 13
+    NT    = 14
+    OR    = 15
+    ADD   = 16
+    SUB   = 17
+    MUL   = 18
+    DIV   = 19
+    LPAR  = 20
+    RPAR  = 21
+    LCRL  = 22
+    RCRL  = 23
+    NUM   = 24
+    ID    = 25
+    IN    = 26
+    OT    = 27
+
+    # Name of each token by its kind, for messages
+    names = (None, 'EL', 'IF', 'WL', 'FR', 'SEM', 'BEC', 'LESS', 'EQ',
+             'GRTR', 'LEQ', 'NEQ', 'GEQ', 'AND', 'NT', 'OR', 'ADD', 'SUB',
+             'MUL', 'DIV', 'LPAR', 'RPAR', 'LCRL', 'RCRL', 'NUM', 'ID',
+             'IN', 'OT')
+
+    # Number of kinds of token, the length of tables indexed by them
+    COUNT = len(names)
+
+    # Regular expression for matching tokens.
+    token_regexp = [
+        (EL,    'el'),
+        (IF,    'if'),
+        (WL,    'wl'),
+        (FR,    'fr'),
+        (IN,    'in'),
+        (OT,    'ot'),
+        (AND,   '&'),
+        (NT,    'nt'),
+        (OR,    '\\|'), # | is special in regular expressions
+        (SEM,   ';'),
+        (BEC,   ':'),
+        (LESS,  '<'),
+        (EQ,    '='),
+        (MUL,   '\*'),
+        (DIV,   '/'),
+        (NEQ,   '!='),        
+        (GRTR,  '>'),
+        (LEQ,   '<='),
+        (GEQ,   '>='),
+        (ADD,   '\\+'), # + is special in regular expressions
+        (SUB,   '-'),
+        (LPAR,  '\\('), # ( is special in regular expressions
+        (RPAR,  '\\)'), # ) is special in regular expressions
+        (LCRL,  '{'), 
+        (RCRL,  '}'), 
+        (ID,    '[a-z]+'),
+        (NUM,   '[0-9]+')
+    ]
\ No newline at end of file
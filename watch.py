@@ -0,0 +1,393 @@
+"""
+Watch mode that recompiles a program as it is edited, redoing only the top
+level statements an edit changed
+"""
+
+__author__ = "Campbell Mercer-Butcher"
+
+import argparse
+import bisect
+import heapq
+import io
+import os
+import sys
+import time
+from collections import Counter
+from scanner import Scanner, ScannerError, TrailingInputError
+from tokens import Token
+from parser_code_generator import Code_Generator, Common_Subexpressions, \
+                                  In_AST, Label, Parser, Symbol_Table, \
+                                  Temporary, class_name, open_input, run
+from jasmin import LimitError, Method, constructor, format_instruction, \
+                   max_stack, write_class
+import classfile
+import peephole
+import slots
+
+# Characters compared at a time when looking for the part that changed
+BLOCK = 4096
+
+def boundaries(text, start):
+    '''Yields the index just after each ';' that is not inside a block,
+       starting from index start, then the end of text. Sm has no strings
+       or comments, so only braces change the depth.'''
+    depth = 0
+    for i in range(start, len(text)):
+        c = text[i]
+        if c == ';' and depth == 0:
+            yield i + 1
+        elif c == '{':
+            depth += 1
+        elif c == '}' and depth:
+            depth -= 1
+    yield len(text)
+
+def common_prefix(a, b):
+    '''Returns the number of characters at the start of a and b that are
+       the same.'''
+    n = min(len(a), len(b))
+    i = 0
+    while i + BLOCK <= n and a[i:i+BLOCK] == b[i:i+BLOCK]:
+        i += BLOCK
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def common_suffix(a, b, limit):
+    '''Returns the number of characters at the end of a and b that are the
+       same, at most limit.'''
+    n = min(len(a), len(b), limit)
+    i = 0
+    while i + BLOCK <= n and a[len(a)-i-BLOCK:len(a)-i] == \
+                             b[len(b)-i-BLOCK:len(b)-i]:
+        i += BLOCK
+    while i < n and a[len(a)-i-1] == b[len(b)-i-1]:
+        i += 1
+    return i
+
+class Statement_Label(Label):
+    "Labels of one statement, which no other statement uses"
+    def __init__(self, number):
+        super().__init__()
+        self.number = number
+    def next(self):
+        self.current_label += 1
+        return 'l{0}_{1}'.format(self.number, self.current_label)
+
+class Statement_Temporary(Temporary):
+    "Temporaries of one statement, which no other statement uses"
+    def __init__(self, number):
+        super().__init__()
+        self.number = number
+    def next(self):
+        self.count += 1
+        return 'Temp {0}.{1}'.format(self.number, self.count)
+
+class Shared_Symbol_Table(Symbol_Table):
+    '''The symbol table all the statements share. It counts the statements
+       that use each identifier, and the location of one that none uses
+       any more goes to the next new identifier, lowest first.'''
+    def __init__(self):
+        super().__init__()
+        self.uses = Counter()
+        # locations no identifier has, as a heap
+        self.free = []
+    def size(self):
+        '''Returns the number of locations up to the last one used.'''
+        return max(self.symbol_table.values(), default=-1) + 1
+    def location(self, identifier):
+        if identifier in self.symbol_table:
+            return self.symbol_table[identifier]
+        if self.free:
+            index = heapq.heappop(self.free)
+        else:
+            index = len(self.symbol_table)
+        self.symbol_table[identifier] = index
+        return index
+    def release(self, identifiers):
+        '''Takes back the identifiers of a statement that was removed.'''
+        for identifier in identifiers:
+            self.uses[identifier] -= 1
+            if not self.uses[identifier]:
+                del self.uses[identifier]
+                heapq.heappush(self.free, self.symbol_table.pop(identifier))
+
+class Statement_Symbols:
+    "Locations of the identifiers of one statement, from the shared table"
+    def __init__(self, table):
+        self.table = table
+        self.identifiers = set()
+    def location(self, identifier):
+        if identifier not in self.identifiers:
+            self.identifiers.add(identifier)
+            self.table.uses[identifier] += 1
+        return self.table.location(identifier)
+
+class Statement:
+    '''One top level statement of the program with its compiled code, or
+       the error compiling it gave.'''
+    __slots__ = ('text', 'number', 'identifiers', 'code', 'assembly',
+                 'stack', 'reads', 'error')
+    def __init__(self, text, number):
+        self.text = text
+        self.number = number
+        # the identifiers it holds in the shared symbol table
+        self.identifiers = set()
+        self.code = []
+        # the code as Jasmin
+        self.assembly = ''
+        self.stack = 0
+        self.reads = False
+        self.error = None
+
+class Incremental_Compiler:
+    '''Compiles a program that changes a little at a time. The program is
+       split into its top level statements and each one is compiled on its
+       own and kept, so after an edit only the statements the edit touched
+       are scanned, parsed and compiled again. Every statement has its own
+       labels and temporaries and all of them share one symbol table, so
+       the code of the others stays the same. Variables that are live at
+       the same time do not share locals, as that would need the whole
+       method, but the local of a variable or temporary no statement
+       uses any more goes to the next new one, so the locals do not grow
+       with every edit.'''
+    def __init__(self, optimise=True, name='Program'):
+        self.optimise = optimise
+        self.name = name
+        self.text = ''
+        self.statements = []
+        # the index in text each statement starts at
+        self.starts = []
+        self.symbol_table = Shared_Symbol_Table()
+        self.numbers = 0
+        # How often each peephole rule was used
+        self.stats = Counter()
+
+    def update(self, text):
+        '''Takes the new text of the whole program and recompiles what
+           changed. Returns the number of statements compiled.'''
+        if not self.statements:
+            self.text = ''
+            return self.edit(0, 0, text)
+        prefix = common_prefix(self.text, text)
+        suffix = common_suffix(self.text, text,
+                               min(len(self.text), len(text)) - prefix)
+        return self.edit(prefix, len(self.text) - suffix,
+                         text[prefix:len(text)-suffix])
+
+    def edit(self, start, end, replacement):
+        '''Replaces the characters from start to end with replacement and
+           recompiles the statements around them. Returns the number of
+           statements compiled.'''
+        old = self.text
+        text = self.text = old[:start] + replacement + old[end:]
+        change = len(replacement) - (end - start)
+        # statements before the one the edit starts in are not touched
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        begin = self.starts[first] if self.starts else 0
+        # split again until a statement ends where an old one after the
+        # edit started, from there on the old statements are the same
+        pieces, last = [], len(self.starts)
+        position = begin
+        for boundary in boundaries(text, begin):
+            pieces.append(text[position:boundary])
+            position = boundary
+            if boundary == len(text):
+                break
+            old_boundary = boundary - change
+            if old_boundary >= end:
+                i = bisect.bisect_left(self.starts, old_boundary, first + 1)
+                if i < len(self.starts) and self.starts[i] == old_boundary:
+                    last = i
+                    break
+        # statements whose text is the same keep their code
+        replaced = {}
+        for st in reversed(self.statements[first:last]):
+            replaced.setdefault(st.text, []).append(st)
+        kept = [replaced[piece].pop() if replaced.get(piece) else None
+                for piece in pieces]
+        for removed in replaced.values():
+            for st in removed:
+                self.symbol_table.release(st.identifiers)
+        new, compiled = [], 0
+        for piece, st in zip(pieces, kept):
+            if st is None:
+                self.numbers += 1
+                st = Statement(piece, self.numbers)
+                self.compile(st)
+                compiled += 1
+            new.append(st)
+        starts = [begin]
+        for piece in pieces[:-1]:
+            starts.append(starts[-1] + len(piece))
+        self.statements[first:last] = new
+        self.starts[first:last] = starts
+        if change:
+            after = first + len(new)
+            self.starts[after:] = [s + change for s in self.starts[after:]]
+        return compiled
+
+    def compile(self, st):
+        '''Scans, parses and generates the code of one statement.'''
+        text = st.text[:-1] if st.text.endswith(';') else st.text
+        symbols = Statement_Symbols(self.symbol_table)
+        st.identifiers = symbols.identifiers
+        try:
+            scanner = Scanner(io.StringIO(text))
+            ast = Parser(scanner).statements()
+            if scanner.lookahead() != Token.END:
+                raise TrailingInputError(repr(Token.names[scanner.lookahead()]))
+            if self.optimise:
+                temps = Statement_Temporary(st.number)
+                ast = run(run(ast.fold()).hoist(temps))
+                ast = Common_Subexpressions(temps).program(ast)
+            method = Method('main', '([Ljava/lang/String;)V')
+            out = Code_Generator(method, self.name)
+            out.symbol_table = symbols
+            out.label_generator = Statement_Label(st.number)
+            run(ast.write(out))
+            code = method.code
+            if self.optimise:
+                code = peephole.optimise(code, self.stats)
+                code = slots.short_forms(code)
+            st.code = code
+            st.assembly = ''.join(map(format_instruction, code))
+            st.stack = max_stack(code)
+            st.reads = any(isinstance(node, In_AST) for node in ast.nodes())
+            st.error = None
+        except (ScannerError, LimitError) as e:
+            st.code, st.assembly, st.error = [], '', e
+
+    def error(self):
+        '''Returns the line the first statement that did not compile
+           starts on and its error, or None when every statement compiled.'''
+        for st, start in zip(self.statements, self.starts):
+            if st.error is not None:
+                blank = len(st.text) - len(st.text.lstrip())
+                return self.text.count('\n', 0, start + blank) + 1, st.error
+        return None
+
+    def prologue(self):
+        '''Returns the code main starts with, which makes the Java Scanner
+           when a statement reads input.'''
+        method = Method('main', '([Ljava/lang/String;)V')
+        if any(st.reads for st in self.statements):
+            out = Code_Generator(method, self.name)
+            out.symbol_table = self.symbol_table
+            open_input(out)
+        if self.optimise:
+            return slots.short_forms(method.code)
+        return method.code
+
+    def methods(self):
+        '''Returns the methods of the class, or raises the error of the
+           first statement that did not compile.'''
+        error = self.error()
+        if error is not None:
+            raise error[1]
+        main = Method('main', '([Ljava/lang/String;)V')
+        main.code = self.prologue()
+        for st in self.statements:
+            main.code.extend(st.code)
+        main.emit('return')
+        # main never reads its String[] argument but needs a slot for it
+        main.max_locals = max(self.symbol_table.size(), 1)
+        main.max_stack = max([max_stack(self.prologue())] +
+                             [st.stack for st in self.statements])
+        return [constructor(), main]
+
+    def jasmin(self):
+        '''Returns the Jasmin for the program, or raises the error of the
+           first statement that did not compile. Only the kept text of
+           each statement is joined, nothing is formatted again.'''
+        error = self.error()
+        if error is not None:
+            raise error[1]
+        stream = io.StringIO()
+        write_class(stream, self.name, [constructor()])
+        prologue = self.prologue()
+        stream.write('.method public static main([Ljava/lang/String;)V\n')
+        stream.write('.limit locals {0}\n'.format(
+                     max(self.symbol_table.size(), 1)))
+        stream.write('.limit stack {0}\n'.format(
+                     max([max_stack(prologue)] +
+                         [st.stack for st in self.statements])))
+        stream.writelines(map(format_instruction, prologue))
+        stream.writelines(st.assembly for st in self.statements)
+        stream.write('return\n.end method\n')
+        return stream.getvalue()
+
+    def write(self, path, class_file=False):
+        '''Writes the class to path, as a class file with class_file. The
+           file is left as it was when the class is over a limit.'''
+        if class_file:
+            stream = io.BytesIO()
+            classfile.write_class(stream, self.name, self.methods())
+            with open(path, 'wb') as f:
+                f.write(stream.getvalue())
+        else:
+            with open(path, 'w') as f:
+                f.write(self.jasmin())
+
+def watch(path, interval=0.2, optimise=True, class_file=False):
+    '''Compiles the program at path whenever it changes, to a .j file
+       next to it or with class_file to a class file named after it,
+       until interrupted.'''
+    name = class_name(path) if class_file else 'Program'
+    if class_file:
+        target = os.path.join(os.path.dirname(path), name + '.class')
+    else:
+        target = os.path.splitext(path)[0] + '.j'
+    compiler = Incremental_Compiler(optimise, name)
+    seen = None
+    while True:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if stat is not None and (stat.st_mtime_ns, stat.st_size) != seen:
+            seen = stat.st_mtime_ns, stat.st_size
+            with open(path) as f:
+                text = f.read()
+            start = time.perf_counter()
+            compiled = compiler.update(text)
+            error = compiler.error()
+            if error is None:
+                try:
+                    compiler.write(target, class_file)
+                except (ScannerError, LimitError) as e:
+                    # the whole of main can be too big for a class file
+                    # even though every statement compiled
+                    error = None, e
+            elapsed = time.perf_counter() - start
+            if error is None:
+                print('compiled {0} of {1} statements in {2:.1f} ms'.format(
+                      compiled, len(compiler.statements), elapsed * 1000))
+            else:
+                line, e = error
+                print('error{0}: {1}: {2}'.format(
+                      '' if line is None else ' on line {0}'.format(line),
+                      type(e).__name__, e))
+            sys.stdout.flush()
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Watches an Sm program and recompiles it to a .j file '
+                    'next to it every time it is saved.')
+    parser.add_argument('file', help='source file to watch')
+    parser.add_argument('--interval', type=float, default=0.2,
+                        help='seconds between checks for changes')
+    parser.add_argument('--class', dest='class_file', action='store_true',
+                        help='write a class file named after the source file '
+                             'instead of Jasmin assembly')
+    parser.add_argument('--no-optimise', action='store_true',
+                        help='generate code without optimising it')
+    args = parser.parse_args()
+    try:
+        watch(args.file, args.interval, not args.no_optimise, args.class_file)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()